@@ -1,54 +1,118 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json import JSONEncoder
 from flask_cors import CORS
 import os
 import json
+import queue
+import asyncio
 import uuid
-from datetime import datetime
 from typing import Dict, List, Any, Optional
-import re
 
 from config import GAME_CONFIG
+from opening_pool import OpeningPool
+from game_store import create_game_store, GameConflictError
+from game_turns import TurnCoordinator
+from transcript import TranscriptWriter
+from sanitizer import strip_inquiry, extract_inquiry
+from visible_view import VisibleMessageCache
+from message_log import MessageLog, as_message_log, replace_message
+from game_state import json_default
 from game_engine import (
     patient_node,
     body_node,
     system_node,
+    system_and_patient_node,
+    apatient_node,
+    abody_node,
+    asystem_node,
+    asystem_and_patient_node,
+    run_in_engine,
+    get_engine_loop,
     invoke_llm,
+    llm_transport,
+    llm_scheduler,
+    llm_singleflight,
+    diagnosis_matcher,
+    referee_parser,
+    referee_batcher,
     save_api_log,
+    release_game,
+    llm_response_cache,
+    initial_symptoms_cache,
+    context_manager,
     PATIENT_SYSTEM_MESSAGE,
     BODY_SYSTEM_MESSAGE,
     SYSTEM_REFEREE_MESSAGE
 )
 
+class GameJSONEncoder(JSONEncoder):
+    """jsonify时把游戏状态、消息列表和消息转换为原来的JSON格式"""
+
+    def default(self, o):
+        try:
+            return json_default(o)
+        except TypeError:
+            return super().default(o)
+
 app = Flask(__name__)
+app.json_encoder = GameJSONEncoder
 # 配置CORS，允许所有请求
 CORS(app, resources={r"/*": {"origins": "*", "supports_credentials": True, "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"]}})
 
-# 存储游戏状态的字典
-active_games = {}
+def _save_evicted_game(game_id, state, logs, meta):
+    """游戏从游戏状态存储中淘汰前，把对话写入磁盘"""
+    _write_conversation(game_id, state, logs, meta.get("conversation_file"))
+    release_game(game_id)
+    visible_views.release(game_id)
+
+# 按游戏缓存返回给前端的消息，每轮只处理新增的消息
+visible_views = VisibleMessageCache(max_games=GAME_CONFIG["game_store"]["max_games"])
+
+# 游戏状态存储，淘汰游戏前先把对话写入磁盘
+# 使用SQLite后端时游戏状态、疾病统计和请求去重缓存在同一台机器的多个工作进程间共享
+game_store = create_game_store(
+    backend=GAME_CONFIG["game_store"]["backend"],
+    path=GAME_CONFIG["game_store"]["path"],
+    max_games=GAME_CONFIG["game_store"]["max_games"],
+    idle_timeout_seconds=GAME_CONFIG["game_store"]["idle_timeout_seconds"],
+    finished_ttl_seconds=GAME_CONFIG["game_store"]["finished_ttl_seconds"],
+    reap_interval_seconds=GAME_CONFIG["game_store"]["reap_interval_seconds"],
+    on_evict=_save_evicted_game
+)
+
+# 存储游戏状态的字典（游戏状态存储本身）
+active_games = game_store
 
-# 存储API日志
-api_logs = {}
+# 存储API日志（游戏状态存储中游戏日志的字典视图）
+api_logs = game_store.logs
 
 # 存储最近的请求，用于去重
-recent_requests = {}
+recent_requests = game_store.shared_dict("recent_requests")
+
+# 同一个游戏的回合依次处理，带幂等键的重复请求直接返回进行中或已完成的结果
+turn_coordinator = TurnCoordinator(
+    result_ttl_seconds=GAME_CONFIG["idempotency"]["ttl_seconds"],
+    max_results=GAME_CONFIG["idempotency"]["max_results"]
+)
 
 # 存储疾病统计数据的字典 {疾病名称: {"attempts": 尝试次数, "correct": 正确次数}}
-disease_stats = {}
+disease_stats = game_store.shared_dict("disease_stats")
 
 # 加载疾病统计数据
 def load_disease_stats():
-    """从文件加载疾病统计数据"""
-    global disease_stats
+    """从文件加载疾病统计数据，共享存储中已有的疾病以共享存储为准"""
     stats_file = "disease_stats.json"
 
     if os.path.exists(stats_file):
         try:
             with open(stats_file, "r", encoding="utf-8") as f:
-                disease_stats = json.load(f)
+                saved_stats = json.load(f)
+            for disease, stats in saved_stats.items():
+                if disease not in disease_stats:
+                    disease_stats[disease] = stats
             print(f"已加载疾病统计数据: {len(disease_stats)}个疾病")
         except Exception as e:
             print(f"加载疾病统计数据失败: {e}")
-            disease_stats = {}
 
     # 确保所有配置中的疾病都有统计数据
     for disease in GAME_CONFIG["diseases"]:
@@ -61,7 +125,7 @@ def save_disease_stats():
     stats_file = "disease_stats.json"
     try:
         with open(stats_file, "w", encoding="utf-8") as f:
-            json.dump(disease_stats, f, ensure_ascii=False, indent=2)
+            json.dump(dict(disease_stats), f, ensure_ascii=False, indent=2)
         print("疾病统计数据已保存")
     except Exception as e:
         print(f"保存疾病统计数据失败: {e}")
@@ -74,14 +138,14 @@ def update_disease_stats(disease, is_correct):
         disease: 疾病名称
         is_correct: 是否正确诊断
     """
-    global disease_stats
-
-    if disease not in disease_stats:
-        disease_stats[disease] = {"attempts": 0, "correct": 0}
+    def record(stats):
+        stats["attempts"] += 1
+        if is_correct:
+            stats["correct"] += 1
+        return stats
 
-    disease_stats[disease]["attempts"] += 1
-    if is_correct:
-        disease_stats[disease]["correct"] += 1
+    # 原子地更新，多个工作进程同时更新时不会丢失计数
+    disease_stats.modify(disease, record, {"attempts": 0, "correct": 0})
 
     # 保存更新后的统计数据
     save_disease_stats()
@@ -89,160 +153,296 @@ def update_disease_stats(disease, is_correct):
 # 初始化时加载统计数据
 load_disease_stats()
 
+# 对话记录文件的写入器
+transcript_writer = TranscriptWriter("conversations")
+
 # 自动保存对话函数
-def auto_save_conversation(game_id):
-    """自动保存对话历史到服务器"""
+def auto_save_conversation(game_id, final=False):
+    """
+    自动保存对话历史到服务器
+    游戏进行中只追加上次保存之后的新消息；游戏结束或final为True时写入包含游戏日志的完整记录
+
+    Args:
+        game_id: 游戏ID
+        final: 是否写入完整记录
+
+    Returns:
+        对话记录文件路径，游戏不存在时返回None
+    """
     if game_id not in active_games:
         return None
 
     state = active_games[game_id]
-    logs = api_logs.get(game_id, [])
-
-    # 创建保存目录
-    os.makedirs("conversations", exist_ok=True)
-
-    # 存储游戏会话对话文件名的全局字典
-    if "game_conversation_files" not in globals():
-        globals()["game_conversation_files"] = {}
+    filename = game_store.get_meta(game_id, "conversation_file")
+    if not filename:
+        filename = transcript_writer.new_filename(game_id)
+        game_store.set_meta(game_id, "conversation_file", filename)
 
-    # 确定文件名
-    if game_id in globals()["game_conversation_files"]:
-        # 使用已存在的对话文件
-        filename = globals()["game_conversation_files"][game_id]
+    if final or state.get("game_over", False):
+        transcript_writer.render(filename, state["messages"], api_logs.get(game_id, []))
+        # 完整记录末尾有游戏日志，之后如果继续游戏需要重新写入
+        cursor = None
     else:
-        # 查找是否已经存在该游戏ID的对话文件
-        import glob
-        existing_files = glob.glob(f"conversations/conversation_*_{game_id}.txt")
-
-        if existing_files:
-            # 如果找到现有文件，使用第一个找到的文件
-            filename = existing_files[0]
-        else:
-            # 生成新的文件名 (使用时间戳+game_id确保按时间排序且不会重名)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"conversations/conversation_{timestamp}_{game_id}.txt"
-
-        # 保存到全局字典中
-        globals()["game_conversation_files"][game_id] = filename
-
-    # 写入文件
-    with open(filename, "w", encoding="utf-8") as f:
-        # 写入标题
-        f.write("="*70 + "\n")
-        f.write(" "*20 + "AI问诊小游戏记录\n")
-        f.write("="*70 + "\n\n")
-
-        # 写入对话历史
-        f.write("## 对话内容\n")
-        f.write("-"*70 + "\n\n")
-
-        # 清理病人消息中可能的询问身体内容
-        messages_to_save = []
-        for msg in state["messages"]:
-            if msg["sender"] == "patient":
-                # 复制消息以避免修改原始状态
-                new_msg = msg.copy()
-                # 清理询问身体内容，使用更严格的正则表达式
-                # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', new_msg["content"])
-                # 匹配旧格式[询问身体]
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', new_msg["content"])
-                # 去除可能的多余空格
-                new_msg["content"] = new_msg["content"].strip()
-                messages_to_save.append(new_msg)
-            elif msg["sender"] != "body":  # 排除身体消息
-                messages_to_save.append(msg)
-
-        # 写入清理后的消息
-        for msg in messages_to_save:
-            # 只显示医生、病人和最终的系统消息
-            if msg["sender"] in ["doctor", "patient"] or (msg["sender"] == "system" and "恭喜" in msg["content"]):
-                sender = msg["sender"].upper()
-                if sender == "PATIENT":
-                    sender = "👤 病人"
-                elif sender == "DOCTOR":
-                    sender = "👨‍⚕️ 医生"
-                elif sender == "SYSTEM":
-                    sender = "🎮 系统"
-
-                f.write(f"{sender}：{msg['content']}\n\n")
-
-        # 写入游戏日志
-        if logs:
-            f.write("\n\n## 游戏日志\n")
-            f.write("-"*70 + "\n\n")
-            for log in logs:
-                f.write(log + "\n\n")
-
-        # 写入时间戳
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        f.write(f"\n最后更新时间: {timestamp}\n")
+        cursor = transcript_writer.append(filename, state["messages"], game_store.get_meta(game_id, "transcript_cursor"))
+    game_store.set_meta(game_id, "transcript_cursor", cursor)
 
     return filename
 
-@app.route('/api/new_game', methods=['POST'])
-def new_game():
-    """创建一个新游戏"""
-    import time
-    import hashlib
+def _write_conversation(game_id, state, logs, filename=None):
+    """把完整的对话记录写入文件，返回文件路径"""
+    filename = filename or transcript_writer.new_filename(game_id)
+    transcript_writer.render(filename, state["messages"], logs)
+    return filename
 
-    # 生成请求ID（基于客户端IP和时间戳）
-    client_ip = request.remote_addr
-    timestamp = int(time.time())
-    request_id = hashlib.md5(f"{client_ip}:{timestamp // 2}".encode()).hexdigest()  # 每2秒内的请求视为相同请求
+# 游戏处理流程
+# 流程以生成器实现：需要调用节点时 yield (节点名, 状态)，由驱动函数执行节点后把新状态 send 回来，
+# 流程结束时返回 (响应数据, HTTP状态码)。这样同一套流程既可以由同步接口驱动，也可以由异步接口驱动
+def _run_steps(steps, game_id):
+    """同步驱动处理流程，依次执行流程请求的节点"""
+    nodes = {"patient": patient_node, "body": body_node, "system": system_node,
+             "system+patient": system_and_patient_node}
+    try:
+        # 回合中的所有LLM调用共用一个时间预算
+        with llm_transport.deadlines.scope(game_id):
+            node_name, state = next(steps)
+            while True:
+                node_name, state = steps.send(nodes[node_name](state, game_id))
+    except StopIteration as stop:
+        return stop.value
+    except GameConflictError:
+        return _conflict_response(game_id)
+
+async def _arun_steps(steps, game_id, on_event=None):
+    """
+    异步驱动处理流程，节点调用期间不占用线程
 
-    # 检查是否是重复请求
-    if request_id in recent_requests:
-        print(f"检测到重复的new_game请求，返回缓存的响应: {request_id}")
-        return jsonify(recent_requests[request_id])
+    Args:
+        steps: 处理流程生成器
+        game_id: 游戏ID
+        on_event: 可选的事件回调 on_event(事件名, 数据)，用于流式接口输出处理阶段和病人回复内容
+    """
+    nodes = {"patient": apatient_node, "body": abody_node, "system": asystem_node,
+             "system+patient": asystem_and_patient_node}
+    try:
+        # 回合中的所有LLM调用共用一个时间预算
+        with llm_transport.deadlines.scope(game_id):
+            # 流程在两个节点之间读写游戏状态存储、保存对话记录和统计数据，在工作线程中推进，不阻塞引擎事件循环
+            done, value = await asyncio.to_thread(_advance_steps, steps, None)
+            while not done:
+                node_name, state = value
+                if on_event:
+                    result = await _arun_node_with_events(node_name, state, game_id, on_event)
+                else:
+                    result = await nodes[node_name](state, game_id)
+                done, value = await asyncio.to_thread(_advance_steps, steps, result)
+            return value
+    except GameConflictError:
+        return _conflict_response(game_id)
+
+def _advance_steps(steps, result):
+    """
+    把节点的结果交给处理流程，执行到下一个节点
 
-    # 使用配置文件中的疾病列表
-    import random
-    diagnosis = random.choice(GAME_CONFIG["diseases"])
+    Returns:
+        (流程是否结束, 下一个节点的(节点名, 状态)或流程的返回值)
+    """
+    # StopIteration不能通过Future传递，在这里转换为返回值
+    try:
+        return False, steps.send(result)
+    except StopIteration as stop:
+        return True, stop.value
+
+def _conflict_response(game_id):
+    """游戏在处理期间被其他请求（可能在其他工作进程中）修改，放弃本次结果"""
+    print(f"游戏状态冲突，放弃本次处理结果: {game_id}")
+    return {"error": "游戏状态已被其他请求修改，请刷新后重试"}, 409
+
+async def _arun_node_with_events(node_name, state, game_id, on_event):
+    """执行节点并通过on_event报告处理阶段、病人回复内容和系统判断结果"""
+    if node_name == "patient":
+        streamed = []
+
+        def on_token(delta):
+            streamed.append(delta)
+            on_event("token", {"content": delta})
+
+        on_event("phase", {"phase": "patient_reply"})
+        result = await apatient_node(state, game_id, on_token=on_token)
+        if streamed and result.get("current_sender") == "body":
+            # 已输出的内容被判定为询问身体，通知前端丢弃
+            on_event("patient_reset", {})
+        return result
+
+    if node_name == "body":
+        on_event("phase", {"phase": "body_inquiry"})
+        return await abody_node(state, game_id)
+
+    if node_name == "system+patient":
+        streamed = []
+
+        def on_token(delta):
+            streamed.append(delta)
+            on_event("token", {"content": delta})
+
+        on_event("phase", {"phase": "system_check"})
+        on_event("phase", {"phase": "patient_reply"})
+        system_state, patient_state = await asystem_and_patient_node(state, game_id, on_token=on_token)
+        on_event("verdict", {
+            "phase": "system_check",
+            "current_sender": system_state.get("current_sender"),
+            "game_over": system_state.get("game_over", False)
+        })
+        if streamed and (patient_state is None or patient_state.get("current_sender") == "body"):
+            on_event("patient_reset", {})
+        return system_state, patient_state
+
+    # 医生消息由系统判断诊断是否正确，病人消息由裁判检查格式
+    last_sender = state["messages"][-1]["sender"] if state["messages"] else None
+    phase = "system_check" if last_sender == "doctor" else "referee"
+    on_event("phase", {"phase": phase})
+    result = await asystem_node(state, game_id)
+    on_event("verdict", {
+        "phase": phase,
+        "current_sender": result.get("current_sender"),
+        "game_over": result.get("game_over", False)
+    })
+    return result
 
-    # 生成游戏ID
-    game_id = str(uuid.uuid4())
+def _stream_events(steps, game_id, idempotency_key=None, since=None):
+    """
+    在引擎事件循环中驱动处理流程，并把过程中的事件逐条转换为SSE格式输出
+    重复的请求（相同幂等键）只输出第一次请求的done事件；传入since时done事件为增量响应
+    """
+    events = queue.Queue()
 
-    # 创建初始状态
-    initial_state = {
-        "messages": [{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}],
+    async def drive():
+        try:
+            response, status = await turn_coordinator.arun(
+                game_id, idempotency_key,
+                lambda: _arun_steps(steps, game_id, on_event=lambda event, data: events.put((event, data)))
+            )
+            events.put(("done" if status == 200 else "error", _delta_response(response, since)))
+        except Exception as e:
+            print(f"流式处理消息时出错: {e}")
+            events.put(("error", {"error": "处理消息失败"}))
+        finally:
+            events.put(None)
+
+    asyncio.run_coroutine_threadsafe(drive(), get_engine_loop())
+
+    while True:
+        item = events.get()
+        if item is None:
+            break
+        event, data = item
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=json_default)}\n\n"
+
+def _initial_state(diagnosis):
+    """新游戏的初始状态"""
+    return {
+        "messages": MessageLog([{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}]),
         "current_sender": "patient",
         "diagnosis": diagnosis,
         "game_over": False,
         "turn_count": 0  # 初始化对话轮数计数
     }
 
-    # 存储游戏状态
-    active_games[game_id] = initial_state
-    api_logs[game_id] = []
+def _opening_steps(diagnosis):
+    """
+    生成开局的处理流程：病人问候医生，并经过系统检查
 
-    # 记录游戏开始和诊断信息
-    api_logs[game_id].append(f"游戏开始，诊断为: {diagnosis}")
+    Args:
+        diagnosis: 疾病名称
 
+    Returns:
+        开局的消息列表
+    """
     # 生成病人的初始消息 - patient_node内部会自动调用get_initial_symptoms
-    patient_state = patient_node(initial_state, game_id)
+    patient_state = yield ("patient", _initial_state(diagnosis))
 
     # 确保初始消息不包含询问身体内容
     for i, msg in enumerate(patient_state["messages"]):
         if msg["sender"] == "patient":
-            # 清理可能的询问身体内容，使用更严格的正则表达式
-            # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', msg["content"])
-            # 匹配旧格式[询问身体]
-            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', cleaned_content)
-            # 去除可能的多余空格
-            cleaned_content = cleaned_content.strip()
+            # 清理可能的询问身体内容
+            cleaned_content = strip_inquiry(msg["content"])
 
             if not cleaned_content:
                 cleaned_content = "医生您好，我最近感觉身体不舒服，来看看是怎么回事。"
-            patient_state["messages"][i]["content"] = cleaned_content
+            if cleaned_content is not msg["content"]:
+                patient_state["messages"] = replace_message(patient_state["messages"], i, {**msg, "content": cleaned_content})
 
     # 进行系统检查
-    system_checked_state = system_node(patient_state, game_id)
+    system_checked_state = yield ("system", patient_state)
+    return system_checked_state["messages"]
+
+async def _agenerate_opening(diagnosis):
+    """为开局池生成一个开局，开局自带游戏ID，生成过程的API日志记录在这个游戏ID下"""
+    game_id = str(uuid.uuid4())
+    # 补充开局池是后台工作，LLM调用排在所有玩家的调用之后
+    with llm_scheduler.background():
+        messages = await _arun_steps(_opening_steps(diagnosis), game_id)
+    return {"game_id": game_id, "diagnosis": diagnosis, "messages": messages}
+
+# 预先生成的游戏开局池
+opening_pool = OpeningPool(
+    _agenerate_opening,
+    GAME_CONFIG["diseases"],
+    size_per_disease=GAME_CONFIG["opening_pool"]["size_per_disease"],
+    ttl_seconds=GAME_CONFIG["opening_pool"]["ttl_seconds"],
+    refill_concurrency=GAME_CONFIG["opening_pool"]["refill_concurrency"],
+    # 过期未用的开局不会成为游戏，释放生成时按它的游戏ID记录的日志文件名等
+    on_expire=lambda opening: release_game(opening["game_id"])
+)
+
+def _new_game_steps(client_ip, game_id):
+    """
+    创建新游戏的处理流程
+
+    Args:
+        client_ip: 客户端IP，用于识别重复请求
+        game_id: 新游戏的ID（使用预先生成的开局时改用开局自带的ID）
+
+    Returns:
+        (响应数据, HTTP状态码)
+    """
+    import time
+    import hashlib
+
+    # 生成请求ID（基于客户端IP和时间戳）
+    timestamp = int(time.time())
+    request_id = hashlib.md5(f"{client_ip}:{timestamp // 2}".encode()).hexdigest()  # 每2秒内的请求视为相同请求
+
+    # 检查是否是重复请求
+    if request_id in recent_requests:
+        print(f"检测到重复的new_game请求，返回缓存的响应: {request_id}")
+        return recent_requests[request_id], 200
+
+    # 使用配置文件中的疾病列表
+    import random
+    diagnosis = random.choice(GAME_CONFIG["diseases"])
+
+    # 优先使用预先生成的开局
+    opening = opening_pool.pop(diagnosis)
+    opening_pool.ensure_filling()
+
+    if opening:
+        game_id = opening["game_id"]
+        messages = opening["messages"]
+        active_games[game_id] = _initial_state(diagnosis)
+        api_logs[game_id] = [f"游戏开始，诊断为: {diagnosis}", "使用预先生成的开局"]
+    else:
+        # 存储游戏状态
+        active_games[game_id] = _initial_state(diagnosis)
+        api_logs[game_id] = []
+
+        # 记录游戏开始和诊断信息
+        game_store.append_log(game_id, f"游戏开始，诊断为: {diagnosis}")
+
+        messages = yield from _opening_steps(diagnosis)
 
     # 更新游戏状态
     active_games[game_id] = {
-        "messages": system_checked_state["messages"],
+        "messages": messages,
         "current_sender": "doctor",  # 轮到医生
         "diagnosis": diagnosis,
         "game_over": False,
@@ -255,7 +455,7 @@ def new_game():
     # 返回游戏信息和初始消息
     response = {
         "game_id": game_id,
-        "messages": [msg for msg in system_checked_state["messages"] if msg["sender"] != "body"],
+        "messages": visible_views.messages(game_id, messages),
         "current_sender": "doctor",
         "game_over": False
     }
@@ -270,7 +470,7 @@ def new_game():
         del recent_requests[oldest_key]
 
     print(f"创建新游戏成功，请求ID: {request_id}, 游戏ID: {game_id}")
-    return jsonify(response)
+    return response, 200
 
 @app.route('/api/get_config', methods=['GET'])
 def get_config():
@@ -281,31 +481,34 @@ def get_config():
         "max_conversation_turns": GAME_CONFIG["max_conversation_turns"]
     })
 
-@app.route('/api/send_message', methods=['POST'])
-def send_message():
-    """发送消息"""
-    data = request.json
-    game_id = data.get('game_id')
-    message = data.get('message')
+def _send_message_steps(game_id, message):
+    """
+    医生发送消息的处理流程
 
-    if not game_id or not message or game_id not in active_games:
-        return jsonify({"error": "Invalid request"}), 400
+    Args:
+        game_id: 游戏ID
+        message: 医生消息
+
+    Returns:
+        (响应数据, HTTP状态码)
+    """
+    # 读取游戏状态和版本号，保存时如果游戏已被其他请求修改则放弃本次结果
+    current_state, version = game_store.load(game_id) if game_id else (None, None)
+    if not message or current_state is None:
+        return {"error": "Invalid request"}, 400
 
     # 检查消息长度是否超过限制
     max_length = GAME_CONFIG["max_input_length"]
     if len(message) > max_length:
-        return jsonify({"error": f"消息长度超过限制（最大{max_length}字）"}), 400
-
-    # 获取当前游戏状态
-    current_state = active_games[game_id]
+        return {"error": f"消息长度超过限制（最大{max_length}字）"}, 400
 
     # 如果游戏已结束，返回错误
     if current_state.get("game_over", False):
-        return jsonify({"error": "Game already over"}), 400
+        return {"error": "Game already over"}, 400
 
     # 如果不是医生的回合，返回错误
     if current_state.get("current_sender") != "doctor":
-        return jsonify({"error": "Not doctor's turn"}), 400
+        return {"error": "Not doctor's turn"}, 400
 
     # 获取当前对话轮数
     current_turn_count = current_state.get("turn_count", 0)
@@ -315,25 +518,26 @@ def send_message():
     if current_turn_count >= max_turns:
         # 添加系统消息，通知对话轮数已达上限
         limit_message = {"sender": "system", "content": f"对话已达到{max_turns}轮上限，游戏结束。"}
-        active_games[game_id]["messages"].append(limit_message)
-        active_games[game_id]["game_over"] = True
+        # 不修改读取到的状态对象（内存存储中它就是保存的状态本身），构造新状态后保存
+        current_state = {**current_state, "messages": current_state["messages"] + [limit_message], "game_over": True}
+        game_store.save(game_id, current_state, expected_version=version)
 
         # 自动保存对话
         auto_save_conversation(game_id)
 
-        return jsonify({
-            "messages": [msg for msg in active_games[game_id]["messages"] if msg["sender"] != "body"],
+        return {
+            "messages": visible_views.messages(game_id, current_state["messages"]),
             "current_sender": "system",
             "game_over": True,
             "diagnosis": current_state.get("diagnosis")
-        })
+        }, 200
 
     # 增加对话轮数计数
     new_turn_count = current_turn_count + 1
 
     # 添加医生消息
     doctor_state = {
-        "messages": current_state["messages"] + [{"sender": "doctor", "content": message}],
+        "messages": as_message_log(current_state["messages"]) + [{"sender": "doctor", "content": message}],
         "current_sender": "system",
         "diagnosis": current_state.get("diagnosis"),
         "game_over": current_state.get("game_over", False),
@@ -341,13 +545,18 @@ def send_message():
     }
 
     # 系统检查消息
-    system_state = system_node(doctor_state, game_id)
+    if GAME_CONFIG["speculative_patient_reply"]:
+        # 推测执行：系统判断诊断的同时生成病人回复，不需要病人回复时结果为None
+        system_state, speculative_patient_state = yield ("system+patient", doctor_state)
+    else:
+        system_state = yield ("system", doctor_state)
+        speculative_patient_state = None
 
     # 检查游戏是否结束
     if system_state.get("game_over", False):
         # 保留对话轮数计数
         system_state["turn_count"] = new_turn_count
-        active_games[game_id] = system_state
+        game_store.save(game_id, system_state, expected_version=version)
 
         # 自动保存对话
         auto_save_conversation(game_id)
@@ -366,28 +575,31 @@ def send_message():
             update_disease_stats(diagnosis, is_correct)
 
         # 返回游戏结束信息
-        return jsonify({
-            "messages": [msg for msg in system_state["messages"] if msg["sender"] != "body"],
+        return {
+            "messages": visible_views.messages(game_id, system_state["messages"]),
             "current_sender": "system",
             "game_over": True,
             "diagnosis": diagnosis
-        })
+        }, 200
 
     # 如果不是病人回合，直接返回系统状态
     if system_state.get("current_sender") != "patient":
         # 保留对话轮数计数
         system_state["turn_count"] = new_turn_count
-        active_games[game_id] = system_state
-        return jsonify({
-            "messages": [msg for msg in system_state["messages"] if msg["sender"] != "body"],
+        game_store.save(game_id, system_state, expected_version=version)
+        return {
+            "messages": visible_views.messages(game_id, system_state["messages"]),
             "current_sender": system_state.get("current_sender"),
             "game_over": False
-        })
+        }, 200
 
     # 病人回合 - 生成病人回复
     # 保留对话轮数计数
     system_state["turn_count"] = new_turn_count
-    patient_state = patient_node(system_state, game_id)
+    if speculative_patient_state is not None:
+        patient_state = speculative_patient_state
+    else:
+        patient_state = yield ("patient", system_state)
 
     # 检查患者是否询问身体
     if patient_state.get("current_sender") == "body":
@@ -400,21 +612,13 @@ def send_message():
                 break
 
         if last_patient_msg:
-            # 提取询问身体的内容（使用更严格的格式匹配）
-            # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-            inquiry_match = re.search(r'\s*\[\s*询问身体\s*[：:]\s*(.*?)\]\s*', last_patient_msg["content"])
-            if inquiry_match and inquiry_match.group(1).strip():
-                inquiry_content = inquiry_match.group(1).strip()
-                api_logs[game_id].append(f"患者询问身体: {inquiry_content}")
-            else:
-                # 尝试匹配旧格式[询问身体]
-                old_format_match = re.search(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*(.*)', last_patient_msg["content"])
-                if old_format_match and old_format_match.group(1).strip():
-                    inquiry_content = old_format_match.group(1).strip()
-                    api_logs[game_id].append(f"患者询问身体: {inquiry_content}")
+            # 提取询问身体的内容（支持新旧两种格式）
+            inquiry_content = extract_inquiry(last_patient_msg["content"])
+            if inquiry_content:
+                game_store.append_log(game_id, f"患者询问身体: {inquiry_content}")
 
             # 调用身体节点
-            body_state = body_node(patient_state, game_id)
+            body_state = yield ("body", patient_state)
 
             # 找到身体回复消息
             body_msg = None
@@ -424,33 +628,35 @@ def send_message():
                     break
 
             if body_msg and body_msg["content"].strip():
-                api_logs[game_id].append(f"身体感知响应:\n{body_msg['content']}")
+                game_store.append_log(game_id, f"身体感知响应:\n{body_msg['content']}")
 
                 # 使用更新后的patient_node处理body回复
-                final_patient_state = patient_node(body_state, game_id)
+                final_patient_state = yield ("patient", body_state)
 
                 # 找到基于身体感知生成的患者回复
                 new_patient_msg = None
-                for msg in reversed(final_patient_state["messages"]):
+                new_patient_index = None
+                for index in range(len(final_patient_state["messages"]) - 1, -1, -1):
+                    msg = final_patient_state["messages"][index]
                     if msg["sender"] == "patient" and msg not in body_state["messages"]:
                         new_patient_msg = msg
+                        new_patient_index = index
                         break
 
                 if new_patient_msg and new_patient_msg["content"].strip():
                     # 确保回复中不包含询问身体的内容
-                    clean_content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', new_patient_msg["content"])
-                    clean_content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', clean_content)
-                    clean_content = clean_content.strip()
+                    clean_content = strip_inquiry(new_patient_msg["content"])
 
                     # 如果清理后内容为空，提供默认回复
                     if not clean_content:
                         clean_content = "医生，我感觉症状确实比较明显，您能给我一些建议吗？"
-                        new_patient_msg["content"] = clean_content
+                        final_patient_state["messages"] = replace_message(
+                            final_patient_state["messages"], new_patient_index, {**new_patient_msg, "content": clean_content})
 
-                    api_logs[game_id].append(f"患者基于身体感知的回复: {clean_content}")
+                    game_store.append_log(game_id, f"患者基于身体感知的回复: {clean_content}")
 
                 # 系统验证最终的病人消息
-                final_state = system_node(final_patient_state, game_id)
+                final_state = yield ("system", final_patient_state)
 
                 # 检查是否需要再次验证病人回复
                 # 如果system_node返回的current_sender是system，说明需要再次验证
@@ -459,51 +665,32 @@ def send_message():
 
                 while final_state.get("current_sender") == "system" and retry_count < max_retries:
                     # 记录重试信息
-                    api_logs[game_id].append(f"重新验证基于身体感知的病人回复 (第{retry_count+1}次)")
+                    game_store.append_log(game_id, f"重新验证基于身体感知的病人回复 (第{retry_count+1}次)")
 
                     # 再次调用system_node进行验证
-                    final_state = system_node(final_state, game_id)
+                    final_state = yield ("system", final_state)
                     retry_count += 1
 
                 # 如果经过多次重试后仍然是system状态，强制设为doctor以避免卡住
                 if final_state.get("current_sender") == "system":
-                    api_logs[game_id].append("警告：多次重试后基于身体感知的回复仍未通过验证，强制设置为医生回合")
+                    game_store.append_log(game_id, "警告：多次重试后基于身体感知的回复仍未通过验证，强制设置为医生回合")
                     final_state["current_sender"] = "doctor"
 
                 # 确保保留对话轮数计数
                 if "turn_count" not in final_state and "turn_count" in doctor_state:
                     final_state["turn_count"] = doctor_state["turn_count"]
                 # 更新游戏状态
-                active_games[game_id] = final_state
+                game_store.save(game_id, final_state, expected_version=version)
 
                 # 自动保存对话
                 auto_save_conversation(game_id)
 
-                # 过滤所有空白消息和清理患者消息中的询问身体内容
-                messages_to_return = []
-                for msg in final_state["messages"]:
-                    if msg["sender"] != "body" and (not msg["sender"] == "patient" or msg["content"].strip()):
-                        # 如果是患者消息，确保彻底清理询问身体内容
-                        if msg["sender"] == "patient":
-                            # 复制消息以避免修改原始状态
-                            new_msg = msg.copy()
-                            # 清理询问身体内容，使用更严格的正则表达式
-                            # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-                            new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', new_msg["content"])
-                            # 匹配旧格式[询问身体]
-                            new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', new_msg["content"])
-                            # 去除可能的多余空格
-                            new_msg["content"] = new_msg["content"].strip()
-                            messages_to_return.append(new_msg)
-                        else:
-                            messages_to_return.append(msg)
-
-                # 返回更新后的消息
-                return jsonify({
-                    "messages": messages_to_return,
+                # 返回更新后的消息（去掉空白消息和身体消息，并清理患者消息中的询问身体内容）
+                return {
+                    "messages": visible_views.messages(game_id, final_state["messages"]),
                     "current_sender": final_state.get("current_sender"),
                     "game_over": final_state.get("game_over", False)
-                })
+                }, 200
             else:
                 # 如果身体消息为空，回退到普通患者回复
                 patient_state["current_sender"] = "system"
@@ -512,7 +699,7 @@ def send_message():
             patient_state["current_sender"] = "system"
 
     # 如果没有询问身体或询问身体过程有问题，走普通流程
-    final_state = system_node(patient_state, game_id)
+    final_state = yield ("system", patient_state)
 
     # 检查是否需要再次验证病人回复
     # 如果system_node返回的current_sender是system，说明需要再次验证
@@ -521,51 +708,121 @@ def send_message():
 
     while final_state.get("current_sender") == "system" and retry_count < max_retries:
         # 记录重试信息
-        api_logs[game_id].append(f"重新验证病人回复 (第{retry_count+1}次)")
+        game_store.append_log(game_id, f"重新验证病人回复 (第{retry_count+1}次)")
 
         # 再次调用system_node进行验证
-        final_state = system_node(final_state, game_id)
+        final_state = yield ("system", final_state)
         retry_count += 1
 
     # 如果经过多次重试后仍然是system状态，强制设为doctor以避免卡住
     if final_state.get("current_sender") == "system":
-        api_logs[game_id].append("警告：多次重试后仍未通过验证，强制设置为医生回合")
+        game_store.append_log(game_id, "警告：多次重试后仍未通过验证，强制设置为医生回合")
         final_state["current_sender"] = "doctor"
 
     # 确保保留对话轮数计数
     if "turn_count" not in final_state and "turn_count" in doctor_state:
         final_state["turn_count"] = doctor_state["turn_count"]
     # 更新游戏状态
-    active_games[game_id] = final_state
+    game_store.save(game_id, final_state, expected_version=version)
 
     # 自动保存对话
     auto_save_conversation(game_id)
 
-    # 过滤所有空白消息和身体消息，并清理患者消息中的询问身体内容
-    messages_to_return = []
-    for msg in final_state["messages"]:
-        if msg["sender"] != "body" and (not msg["sender"] == "patient" or msg["content"].strip()):
-            # 如果是患者消息，确保彻底清理询问身体内容
-            if msg["sender"] == "patient":
-                # 复制消息以避免修改原始状态
-                new_msg = msg.copy()
-                # 清理询问身体内容，使用更严格的正则表达式
-                # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', new_msg["content"])
-                # 匹配旧格式[询问身体]
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', new_msg["content"])
-                # 去除可能的多余空格
-                new_msg["content"] = new_msg["content"].strip()
-                messages_to_return.append(new_msg)
-            else:
-                messages_to_return.append(msg)
-
-    # 返回更新后的消息
-    return jsonify({
-        "messages": messages_to_return,
+    # 返回更新后的消息（去掉空白消息和身体消息，并清理患者消息中的询问身体内容）
+    return {
+        "messages": visible_views.messages(game_id, final_state["messages"]),
         "current_sender": final_state.get("current_sender"),
         "game_over": final_state.get("game_over", False)
-    })
+    }, 200
+
+@app.route('/api/new_game', methods=['POST'])
+def new_game():
+    """创建一个新游戏"""
+    game_id = str(uuid.uuid4())
+    response, status = _run_steps(_new_game_steps(request.remote_addr, game_id), game_id)
+    return jsonify(response), status
+
+def _idempotency_key(data):
+    """请求的幂等键：Idempotency-Key请求头，或请求体中的idempotency_key"""
+    return request.headers.get("Idempotency-Key") or data.get("idempotency_key")
+
+def _parse_since(value):
+    """客户端已有的消息数量，没有或无效时为None（返回全部消息）"""
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        return None
+    return since if since >= 0 else None
+
+def _delta_response(response, since):
+    """
+    增量响应：客户端传入已有的消息数量since时，messages只包含之后的新消息，
+    并返回message_offset（新消息在全部消息中的起始位置）和message_count（全部消息的数量）。
+    since超过全部消息的数量时（客户端的消息与服务器不一致）从头返回全部消息
+    """
+    if since is None or "messages" not in response:
+        return response
+    messages = response["messages"]
+    offset = since if since <= len(messages) else 0
+    return {**response, "messages": messages[offset:], "message_offset": offset, "message_count": len(messages)}
+
+@app.route('/api/send_message', methods=['POST'])
+def send_message():
+    """
+    发送消息
+    同一个游戏的消息依次处理；客户端重试时带上相同的幂等键（Idempotency-Key请求头），
+    会得到第一次请求的结果，而不会重新处理
+    """
+    data = request.json
+    game_id = data.get('game_id')
+    message = data.get('message')
+    response, status = turn_coordinator.run(
+        game_id, _idempotency_key(data),
+        lambda: _run_steps(_send_message_steps(game_id, message), game_id)
+    )
+    return jsonify(_delta_response(response, _parse_since(data.get('since')))), status
+
+@app.route('/api/send_message_stream', methods=['POST'])
+def send_message_stream():
+    """
+    发送消息（流式接口）
+    以Server-Sent Events返回处理过程：phase（处理阶段）、token（病人回复片段）、
+    patient_reset（丢弃已输出的片段）、verdict（系统判断结果），
+    最后是done（与/api/send_message相同的响应数据）或error
+    """
+    data = request.json
+    game_id = data.get('game_id')
+    steps = _send_message_steps(game_id, data.get('message'))
+    since = _parse_since(data.get('since'))
+    return Response(_stream_events(steps, game_id, _idempotency_key(data), since), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def handle_new_game(client_ip):
+    """创建新游戏（异步），返回 (响应数据, HTTP状态码)"""
+    game_id = str(uuid.uuid4())
+    return await run_in_engine(_arun_steps(_new_game_steps(client_ip, game_id), game_id))
+
+async def handle_send_message(game_id, message, idempotency_key=None, since=None):
+    """处理医生消息（异步），返回 (响应数据, HTTP状态码)，传入客户端已有的消息数量since时为增量响应"""
+    response, status = await run_in_engine(turn_coordinator.arun(
+        game_id, idempotency_key,
+        lambda: _arun_steps(_send_message_steps(game_id, message), game_id)
+    ))
+    return _delta_response(response, _parse_since(since)), status
+
+@app.route('/api/async/new_game', methods=['POST'])
+async def new_game_async():
+    """创建一个新游戏（异步接口）"""
+    response, status = await handle_new_game(request.remote_addr)
+    return jsonify(response), status
+
+@app.route('/api/async/send_message', methods=['POST'])
+async def send_message_async():
+    """发送消息（异步接口）"""
+    data = request.json
+    response, status = await handle_send_message(data.get('game_id'), data.get('message'), _idempotency_key(data),
+                                                 data.get('since'))
+    return jsonify(response), status
 
 @app.route('/api/game_status/<game_id>', methods=['GET'])
 def game_status(game_id):
@@ -575,31 +832,13 @@ def game_status(game_id):
 
     state = active_games[game_id]
 
-    # 过滤所有身体消息，并清理患者消息中的询问身体内容
-    messages_to_return = []
-    for msg in state["messages"]:
-        if msg["sender"] != "body":
-            # 如果是患者消息，确保彻底清理询问身体内容
-            if msg["sender"] == "patient":
-                # 复制消息以避免修改原始状态
-                new_msg = msg.copy()
-                # 清理询问身体内容，使用更严格的正则表达式
-                # 匹配[询问身体:xxx]格式，包括可能的空格和换行
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*:\s*.*?\]\s*', '', new_msg["content"])
-                # 匹配旧格式[询问身体]
-                new_msg["content"] = re.sub(r'\s*\[\s*询问身体\s*\]\s*:?\s*', '', new_msg["content"])
-                # 去除可能的多余空格
-                new_msg["content"] = new_msg["content"].strip()
-                messages_to_return.append(new_msg)
-            else:
-                messages_to_return.append(msg)
-
-    return jsonify({
-        "messages": messages_to_return,
+    return jsonify(_delta_response({
+        # 过滤所有身体消息，并清理患者消息中的询问身体内容
+        "messages": visible_views.messages(game_id, state["messages"]),
         "current_sender": state.get("current_sender"),
         "game_over": state.get("game_over", False),
         "diagnosis": state.get("diagnosis") if state.get("game_over", False) else None
-    })
+    }, _parse_since(request.args.get("since"))))
 
 @app.route('/api/logs/<game_id>', methods=['GET'])
 def get_logs(game_id):
@@ -619,8 +858,8 @@ def save_conversation(game_id):
     if game_id not in active_games:
         return jsonify({"error": "Game not found"}), 404
 
-    # 使用自动保存函数保存文件
-    filename = auto_save_conversation(game_id)
+    # 写入完整的对话记录
+    filename = auto_save_conversation(game_id, final=True)
 
     if not filename:
         return jsonify({"error": "保存失败"}), 500
@@ -651,11 +890,37 @@ def get_active_games():
         "games": games
     })
 
+@app.route('/api/opening_pool', methods=['GET'])
+def get_opening_pool_stats():
+    """获取开局池的统计数据（命中、未命中、过期数量和各疾病可用开局数）"""
+    return jsonify(opening_pool.stats())
+
+@app.route('/api/game_store', methods=['GET'])
+def get_game_store_stats():
+    """获取游戏状态存储的统计数据（游戏数量和按原因统计的淘汰数量）"""
+    return jsonify(game_store.stats())
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """获取LLM响应缓存和初始症状缓存的统计数据"""
+    return jsonify({
+        "llm_response_cache": llm_response_cache.stats(),
+        "initial_symptoms_cache": initial_symptoms_cache.stats(),
+        "turns": turn_coordinator.stats(),
+        "context": context_manager.stats(),
+        "llm_transport": llm_transport.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+        "llm_singleflight": llm_singleflight.stats(),
+        "diagnosis_matcher": diagnosis_matcher.stats(),
+        "referee": referee_parser.stats(),
+        "referee_batch": referee_batcher.stats()
+    })
+
 @app.route('/api/disease_stats', methods=['GET'])
 def get_all_disease_stats():
     """获取所有疾病的统计数据"""
     return jsonify({
-        "stats": disease_stats
+        "stats": dict(disease_stats)
     })
 
 @app.route('/api/disease_stats/<disease>', methods=['GET'])
@@ -703,4 +968,6 @@ def get_current_game_stats(game_id):
     })
 
 if __name__ == '__main__':
+    # 启动时预先生成开局
+    opening_pool.ensure_filling()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,268 @@
+"""
+API调用日志存储
+日志以JSONL格式（每行一条JSON记录）追加写入，每次调用只写入一行，
+避免每次记录都重新读取并重写整个日志文件
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+from config import GAME_CONFIG
+
+# 追加写入时使用的进程级锁，防止多线程写入的行互相交错
+_write_lock = threading.Lock()
+
+def append_api_log(log_file, log_data):
+    """
+    追加一条API调用日志
+
+    Args:
+        log_file: 日志文件路径（.jsonl）
+        log_data: 日志数据（字典）
+    """
+    append_api_logs(log_file, [log_data])
+
+def append_api_logs(log_file, records):
+    """
+    批量追加多条API调用日志，一次打开文件写入所有记录
+
+    Args:
+        log_file: 日志文件路径（.jsonl）
+        records: 日志数据列表
+    """
+    if not records:
+        return
+
+    lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    with _write_lock:
+        with open(log_file, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+def read_api_logs(log_file):
+    """
+    读取API调用日志，返回与旧版JSON数组文件相同的列表视图
+
+    同时兼容新的JSONL文件和旧的JSON数组文件；
+    JSONL文件中无法解析的行（例如进程中断时写了一半的最后一行）会被跳过
+
+    Args:
+        log_file: 日志文件路径（.jsonl或.json）
+
+    Returns:
+        日志数据列表
+    """
+    if not os.path.exists(log_file):
+        return []
+
+    with open(log_file, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    # 旧格式：整个文件是一个JSON数组（或单个对象）
+    if log_file.endswith(".json"):
+        try:
+            logs = json.loads(content)
+        except json.JSONDecodeError:
+            return []
+        return logs if isinstance(logs, list) else [logs]
+
+    logs = []
+    for line in content.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            logs.append(json.loads(line))
+        except json.JSONDecodeError:
+            print(f"跳过无法解析的日志行: {log_file}")
+    return logs
+
+def convert_to_json(log_file, output_file=None):
+    """
+    将JSONL日志转换为旧版的JSON数组文件，供现有工具使用
+
+    Args:
+        log_file: JSONL日志文件路径
+        output_file: 输出文件路径，默认为同名的.json文件
+
+    Returns:
+        输出文件路径
+    """
+    if not output_file:
+        output_file = os.path.splitext(log_file)[0] + ".json"
+
+    logs = read_api_logs(log_file)
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(logs, f, ensure_ascii=False, indent=2)
+
+    return output_file
+
+class ApiLogSink:
+    """
+    后台日志写入器
+
+    调用方只需把日志记录放入队列，由专门的写入线程按批次写盘：
+    累积到batch_size条或距上次写入超过flush_interval_ms毫秒时写入一次。
+    队列有上限，写满时按overflow_policy处理：
+    "drop"丢弃新记录并计数，"block"阻塞调用方直到队列有空位
+    """
+
+    def __init__(self, batch_size=50, flush_interval_ms=200, max_queue_size=10000, overflow_policy="drop"):
+        if overflow_policy not in ("drop", "block"):
+            raise ValueError(f"未知的队列溢出策略: {overflow_policy}")
+
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval_ms / 1000
+        self.overflow_policy = overflow_policy
+        self.dropped = 0  # 因队列已满被丢弃的记录数
+        self.written = 0  # 已写入的记录数
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # 检查是否已关闭和放入队列需要与关闭时放入结束标记互斥，否则记录可能排在结束标记之后而丢失
+        self._submit_lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, log_file, log_data):
+        """
+        提交一条日志记录
+
+        Args:
+            log_file: 日志文件路径，.jsonl文件追加写入，.json文件整体写入
+            log_data: 日志数据
+
+        Returns:
+            是否成功进入队列
+        """
+        with self._submit_lock:
+            if not self._closed:
+                self._ensure_started()
+                if self.overflow_policy == "block":
+                    # 写入线程不需要这个锁，持有锁阻塞时队列仍会腾出空位
+                    self._queue.put((log_file, log_data))
+                    return True
+                try:
+                    self._queue.put_nowait((log_file, log_data))
+                    return True
+                except queue.Full:
+                    self.dropped += 1
+                    if self.dropped == 1 or self.dropped % 100 == 0:
+                        print(f"警告：API日志队列已满，已丢弃{self.dropped}条日志")
+                    return False
+
+        # 写入线程已关闭，直接同步写入，避免丢失关闭过程中的日志
+        self._write_batch([(log_file, log_data)])
+        return True
+
+    def flush(self):
+        """等待队列中已提交的日志全部写入"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """写完队列中剩余的日志并停止写入线程"""
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def _ensure_started(self):
+        """首次提交日志时启动写入线程"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._run, name="api-log-writer", daemon=True)
+                thread.start()
+                self._thread = thread
+
+    def _run(self):
+        """写入线程主循环"""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                self._queue.task_done()
+
+    def _write_batch(self, batch):
+        """按文件分组写入一批日志"""
+        grouped = {}
+        for log_file, log_data in batch:
+            grouped.setdefault(log_file, []).append(log_data)
+
+        for log_file, records in grouped.items():
+            try:
+                if log_file.endswith(".jsonl"):
+                    append_api_logs(log_file, records)
+                else:
+                    # 单次调用的独立日志文件，保持原来的JSON对象格式
+                    with open(log_file, "w", encoding="utf-8") as f:
+                        json.dump(records[-1], f, ensure_ascii=False, indent=2)
+                self.written += len(records)
+            except Exception as e:
+                print(f"写入API日志时出错: {log_file}: {e}")
+
+# 进程级的后台日志写入器
+_log_sink = None
+_log_sink_lock = threading.Lock()
+
+def get_log_sink():
+    """获取进程级的后台日志写入器，首次调用时按配置创建并注册退出时写盘"""
+    global _log_sink
+    if _log_sink is None:
+        with _log_sink_lock:
+            if _log_sink is None:
+                log_config = GAME_CONFIG["api_log"]
+                _log_sink = ApiLogSink(
+                    batch_size=log_config["batch_size"],
+                    flush_interval_ms=log_config["flush_interval_ms"],
+                    max_queue_size=log_config["max_queue_size"],
+                    overflow_policy=log_config["overflow_policy"]
+                )
+                atexit.register(shutdown_log_sink)
+    return _log_sink
+
+def shutdown_log_sink():
+    """进程退出前写完所有排队中的日志"""
+    if _log_sink is not None:
+        _log_sink.close()
+
+if __name__ == "__main__":
+    import sys
+
+    # 用法: python api_log_store.py api_logs/api_calls_xxx.jsonl [输出文件]
+    if len(sys.argv) < 2:
+        print("用法: python api_log_store.py <日志文件.jsonl> [输出文件.json]")
+        sys.exit(1)
+
+    output = convert_to_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"已转换: {output}")
@@ -0,0 +1,72 @@
+"""
+ASGI入口
+创建游戏和发送消息由异步引擎直接处理，LLM调用期间不占用线程，
+单个进程可以同时保持大量进行中的LLM调用；其余接口交给Flask应用处理
+
+启动方式（需要安装ASGI服务器，例如uvicorn）:
+    uvicorn asgi:application --port 5001
+"""
+
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+from api import app, handle_new_game, handle_send_message
+from game_state import json_default
+
+# 其余接口仍由Flask应用处理
+flask_application = WsgiToAsgi(app)
+
+async def _read_json(receive):
+    """读取请求体并解析为JSON"""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        return json.loads(body or b"{}")
+    except json.JSONDecodeError:
+        return {}
+
+async def _send_json(send, data, status=200):
+    """发送JSON响应"""
+    body = json.dumps(data, ensure_ascii=False, default=json_default).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json; charset=utf-8"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _new_game(scope, receive):
+    client = scope.get("client")
+    return await handle_new_game(client[0] if client else None)
+
+async def _send_message(scope, receive):
+    data = await _read_json(receive)
+    headers = dict(scope.get("headers") or [])
+    idempotency_key = headers.get(b"idempotency-key", b"").decode("latin-1") or data.get("idempotency_key")
+    return await handle_send_message(data.get("game_id"), data.get("message"), idempotency_key, data.get("since"))
+
+# 由异步引擎直接处理的接口
+ASYNC_ROUTES = {
+    "/api/new_game": _new_game,
+    "/api/async/new_game": _new_game,
+    "/api/send_message": _send_message,
+    "/api/async/send_message": _send_message,
+}
+
+async def application(scope, receive, send):
+    """ASGI应用"""
+    if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in ASYNC_ROUTES:
+        response, status = await ASYNC_ROUTES[scope["path"]](scope, receive)
+        await _send_json(send, response, status)
+        return
+
+    await flask_application(scope, receive, send)
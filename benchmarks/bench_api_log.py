@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+API调用日志写入性能测试
+模拟一局100轮的游戏（每轮约4次LLM调用），比较旧的整文件读-改-写方式
+与JSONL追加写入方式的单次记录耗时
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api_log_store import append_api_log, read_api_logs
+
+TURNS = 100
+CALLS_PER_TURN = 4
+
+def make_log_data(index):
+    """构造一条接近真实大小的日志数据"""
+    return {
+        "timestamp": "2025-01-01 00:00:00",
+        "call_id": f"{index:08x}",
+        "is_duplicate": False,
+        "input": {
+            "system_message": "你是一位去医院就诊的病人。" * 20,
+            "user_message": "doctor: 您哪里不舒服？\npatient: 我头痛，还有点发烧。\n" * (index // 8 + 1)
+        },
+        "output": "医生，我这两天一直头痛，晚上还有点发烧。",
+        "model": "bench-model",
+        "from_cache": False
+    }
+
+def legacy_save(log_file, log_data):
+    """旧的写入方式：读取整个JSON数组，追加后整体重写"""
+    if os.path.exists(log_file):
+        with open(log_file, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+    else:
+        logs = []
+    logs.append(log_data)
+    with open(log_file, "w", encoding="utf-8") as f:
+        json.dump(logs, f, ensure_ascii=False, indent=2)
+
+def run(save_func, log_file):
+    """执行一局游戏的日志写入，返回每10轮的平均单次耗时（毫秒）"""
+    per_decile = []
+    total_calls = TURNS * CALLS_PER_TURN
+    bucket = total_calls // 10
+    elapsed = 0.0
+    for i in range(total_calls):
+        log_data = make_log_data(i)
+        start = time.perf_counter()
+        save_func(log_file, log_data)
+        elapsed += time.perf_counter() - start
+        if (i + 1) % bucket == 0:
+            per_decile.append(elapsed / bucket * 1000)
+            elapsed = 0.0
+    return per_decile
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = run(legacy_save, os.path.join(tmp, "legacy.json"))
+        jsonl_file = os.path.join(tmp, "api_calls.jsonl")
+        jsonl = run(append_api_log, jsonl_file)
+        assert len(read_api_logs(jsonl_file)) == TURNS * CALLS_PER_TURN
+
+    print(f"{TURNS}轮游戏，每轮{CALLS_PER_TURN}次调用，单次记录平均耗时(ms)")
+    print(f"{'轮次':<12}{'读-改-写':>12}{'JSONL追加':>12}")
+    for i, (a, b) in enumerate(zip(legacy, jsonl)):
+        turns = f"{i * TURNS // 10 + 1}-{(i + 1) * TURNS // 10}"
+        print(f"{turns:<12}{a:>12.3f}{b:>12.3f}")
+    print(f"最后10轮/最初10轮: 读-改-写 {legacy[-1] / legacy[0]:.1f}x, JSONL追加 {jsonl[-1] / jsonl[0]:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+长对话提示大小测试
+按脚本进行一局100轮的游戏（每3轮病人询问一次身体），统计每轮病人提示中对话历史的估计token数量：
+比较包含完整历史与使用上下文管理（最近消息窗口 + 滚动摘要 + token上限）的差别。
+摘要由固定长度的假摘要代替，不调用LLM
+"""
+
+import os
+import sys
+import asyncio
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt_history import PromptHistoryCache
+from context_window import ContextManager, estimate_tokens
+
+TURNS = 100
+SUMMARY = "病人描述了持续一周的头痛和夜间低烧，伴有食欲下降和乏力。" * 4
+
+async def fake_summarize(game_id, previous_summary, formatted_messages):
+    """固定长度的假摘要"""
+    return SUMMARY
+
+def script():
+    """逐轮产生新增的消息"""
+    yield [{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"},
+           {"sender": "patient", "content": "医生您好，我最近头一直很痛，晚上还有点发烧。"}]
+    for i in range(TURNS):
+        turn = [{"sender": "doctor", "content": f"第{i}个问题：头痛是什么时候开始的？有没有其他不舒服的地方？"}]
+        if i % 3 == 0:
+            turn.append({"sender": "patient", "content": f"[询问身体:问题{i}的感受]"})
+            turn.append({"sender": "body", "content": "额头两侧持续胀痛，下午体温37.8度，浑身乏力，没有胃口。"})
+        turn.append({"sender": "patient", "content": "大概一周前开始的，白天还好，晚上更严重，吃了止痛药也没什么用。"})
+        yield turn
+
+async def play(window_messages, max_history_tokens):
+    """返回 (每轮病人提示中对话历史的估计token数量, 上下文管理器)"""
+    manager = ContextManager(PromptHistoryCache(), fake_summarize, window_messages=window_messages,
+                             summary_interval_turns=5, max_history_tokens=max_history_tokens)
+    messages = []
+    sizes = []
+    for turn in script():
+        messages = messages + turn
+        history = await manager.abuild("bench", messages)
+        sizes.append(estimate_tokens(history))
+    return sizes, manager
+
+async def main():
+    full, _ = await play(window_messages=0, max_history_tokens=0)
+    managed, manager = await play(window_messages=40, max_history_tokens=3000)
+
+    print(f"{TURNS}轮游戏，病人提示中对话历史的估计token数量")
+    print(f"完整历史: 最后一轮 {full[-1]}，合计 {sum(full)}")
+    print(f"上下文管理: 最后一轮 {managed[-1]}，合计 {sum(managed)}，生成摘要 {manager.summaries} 次")
+    print(f"减少: {1 - sum(managed) / sum(full):.0%}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+本地诊断匹配节省的LLM裁判调用
+用法: python benchmarks/bench_diagnosis_matcher.py [API日志目录]
+
+读取API日志中记录的诊断判断调用（医生消息、正确诊断和LLM裁判的结论），统计本地规则能直接判断的比例，
+以及直接判断的结果与LLM裁判是否一致。本地规则只直接判断诊断不正确的消息，认为正确的消息也交给LLM裁判确认。没有API日志时使用内置的按脚本进行的问诊记录
+"""
+
+import os
+import re
+import sys
+import glob
+import json
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import GAME_CONFIG
+from diagnosis_matcher import DiagnosisMatcher
+
+# 内置的问诊记录：{疾病: [(医生消息, 诊断是否正确)]}
+SCRIPTED_GAMES = {
+    "流感": [("您好，哪里不舒服？", False), ("发烧几天了？最高多少度？", False), ("有没有咳嗽、嗓子疼？", False),
+           ("身上酸痛吗？", False), ("是不是感冒了", False), ("我不认为你得的是流感", False), ("很难说是流感", False),
+           ("我还不能确定你是流感", False), ("如果是流感会发烧", False), ("我判断你得了流感，多喝水多休息", True)],
+    "肺炎": [("咳嗽多久了？", False), ("痰是什么颜色的", False), ("呼吸的时候胸口疼吗", False),
+           ("可能是支气管炎或者肺炎", False), ("拍个胸片看看", False), ("你这是肺炎，需要用抗生素", True)],
+    "胃溃疡": [("哪里疼？", False), ("饭前疼还是饭后疼", False), ("大便颜色正常吗", False),
+            ("你得了胃炎", False), ("平时喝酒吗？", False), ("诊断为胃溃疡", True)],
+    "偏头痛": [("头哪个位置疼", False), ("疼的时候怕光吗", False), ("会不会是偏头痛", False),
+            ("疼之前眼前有闪光吗", False), ("你患的是偏头痛", True)],
+    "扁桃体炎": [("嗓子疼几天了", False), ("吞咽的时候疼不疼", False), ("张嘴我看看", False),
+             ("我觉得是咽炎", False), ("你这是扁桃体发炎了", True)],
+    "高血压": [("头晕多久了", False), ("家里有人血压高吗", False), ("量过血压没有？", False),
+            ("你不是低血糖", False), ("最近睡眠怎么样", False), ("你有高血压，需要长期服药", True)],
+    "糖尿病": [("最近是不是总口渴", False), ("每天喝多少水？", False), ("体重有变化吗", False),
+            ("你可能是糖尿病，也可能是甲亢", False), ("查个血糖吧", False), ("确诊是2型糖尿病", True)],
+    "关节炎": [("哪个关节疼", False), ("早上起来关节僵硬吗", False), ("疼了多长时间", False),
+            ("是痛风吗？", False), ("关节有没有红肿", False), ("你得的是关节炎", True)],
+    "哮喘": [("喘不上气是什么时候开始的", False), ("晚上会不会憋醒", False), ("对什么东西过敏吗", False),
+           ("不是心脏病", False), ("呼气的时候有哨音吗", False), ("我的诊断是支气管哮喘", True)],
+    "过敏性鼻炎": [("鼻塞多久了", False), ("打喷嚏多吗", False), ("是不是换季的时候更严重", False),
+              ("流清鼻涕还是黄鼻涕", False), ("你这是过敏性鼻炎", True)],
+}
+
+_DIAGNOSIS_PROMPT = re.compile(r'医生的消息: "(.*)"\s*正确的诊断: "(.*)"', re.S)
+
+def load_logged_calls(directory):
+    """从API日志中读取诊断判断调用，返回 [(医生消息, 正确诊断, LLM裁判是否判定正确)]"""
+    calls = []
+    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                found = _DIAGNOSIS_PROMPT.search(record.get("input", {}).get("user_message", ""))
+                if found and record.get("output"):
+                    calls.append((found.group(1), found.group(2), "诊断正确: 是" in record["output"]))
+    return calls
+
+def scripted_calls():
+    return [(message, disease, correct) for disease, turns in SCRIPTED_GAMES.items() for message, correct in turns]
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "api_logs"
+    calls = load_logged_calls(directory)
+    source = f"{directory}中记录的诊断判断调用"
+    if not calls:
+        calls = scripted_calls()
+        source = "内置的问诊记录"
+
+    matcher = DiagnosisMatcher(GAME_CONFIG["diseases"], threshold=GAME_CONFIG["diagnosis_matcher"]["confidence_threshold"])
+    start = time.perf_counter()
+    decisions = [(matcher.decide(message, diagnosis), correct) for message, diagnosis, correct in calls]
+    elapsed = time.perf_counter() - start
+
+    decided = [(match.correct, correct) for match, correct in decisions if match is not None]
+    agree = sum(1 for local, correct in decided if local == correct)
+    false_positive = sum(1 for local, correct in decided if local and not correct)
+    false_negative = sum(1 for local, correct in decided if not local and correct)
+
+    print(f"{source}: {len(calls)}条医生消息")
+    print(f"本地直接判断: {len(decided)}条，节省LLM裁判调用 {len(decided) / len(calls):.0%}")
+    print(f"与裁判结论一致: {agree}/{len(decided)}（误判为正确 {false_positive}，误判为不正确 {false_negative}）")
+    print(f"交给LLM裁判: {len(calls) - len(decided)}条（其中规则认为正确、等待确认的 {matcher.positives}条）")
+    print(f"本地判断耗时: 平均每条 {elapsed / len(calls) * 1e6:.1f}µs")
+
+if __name__ == "__main__":
+    main()
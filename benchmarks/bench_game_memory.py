@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+游戏状态内存占用测试
+构造10000个进行中的游戏（每局10轮对话），比较每局游戏的内存占用：
+原来的字典状态和字典消息（从JSON读取，每局都有自己的疾病名称、发送者字符串和系统笔记），
+与GameState、Message记录（__slots__、驻留的字符串、不保存系统笔记）
+"""
+
+import os
+import sys
+import json
+import tracemalloc
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from game_state import GameState
+
+GAMES = 10000
+TURNS = 10
+
+def make_json(i):
+    """第i局游戏的JSON格式状态，对话内容每局不同"""
+    messages = [{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}]
+    for turn in range(TURNS):
+        messages.append({"sender": "doctor", "content": f"第{turn}个问题：你哪里不舒服？({i})"})
+        messages.append({"sender": "patient", "content": f"医生，我这两天一直头痛，晚上还有点发烧。({i})"})
+    return json.dumps({
+        "messages": messages,
+        "current_sender": "doctor",
+        "diagnosis": "流感",
+        "game_over": False,
+        "turn_count": TURNS,
+        "system_notes": "跳过病人消息格式检查（已禁用）"
+    }, ensure_ascii=False)
+
+def measure(build):
+    """返回每局游戏占用的字节数"""
+    documents = [make_json(i) for i in range(GAMES)]
+    tracemalloc.start()
+    games = [build(document) for document in documents]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del games
+    return current / GAMES
+
+def main():
+    plain = measure(json.loads)
+    records = measure(lambda document: GameState.from_mapping(json.loads(document)))
+
+    print(f"{GAMES}局进行中的游戏（每局{TURNS}轮对话），每局游戏的内存占用(字节)")
+    print(f"字典: {plain:.0f}")
+    print(f"GameState/Message: {records:.0f}")
+    print(f"减少: {1 - records / plain:.0%}")
+
+if __name__ == "__main__":
+    main()
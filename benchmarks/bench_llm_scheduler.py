@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LLM调用调度测试
+模拟高负载：后台一次补充大量开局的同时，玩家的病人回复陆续到达，多个游戏同时发出相同的裁判调用。
+比较不经过调度（不限制并发、不合并相同调用）与经过调度（并发上限、优先级排队、合并相同调用）时：
+- 病人回复的耗时分位数
+- 实际发给模型服务的请求数量
+- 各类调用的排队时间分位数
+模拟的模型服务同时处理的请求越多，每个请求越慢（超过容量后按比例变慢）
+"""
+
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("API_KEY", "benchmark")
+
+import game_engine
+from llm_scheduler import LLMScheduler, percentile
+from singleflight import SingleFlight
+
+CAPACITY = 8  # 模型服务不变慢时能同时处理的请求数量
+BASE_LATENCY = 0.2  # 单个请求的耗时（秒）
+POOL_CALLS = 60  # 后台补充开局的调用数量
+PATIENT_CALLS = 20  # 陆续到达的病人回复数量
+PATIENT_INTERVAL = 0.02  # 病人回复到达的间隔（秒）
+REFEREE_CALLS = 20  # 同时发出的相同裁判调用数量
+
+class SimulatedLLM:
+    """超过容量后按同时处理的请求数量成比例变慢的模型服务"""
+
+    def __init__(self):
+        self.requests = 0
+        self.active = 0
+
+    async def create(self, model=None, messages=None, **kwargs):
+        self.requests += 1
+        self.active += 1
+        try:
+            await asyncio.sleep(BASE_LATENCY * max(1, self.active / CAPACITY))
+        finally:
+            self.active -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="诊断正确: 否"))])
+
+class NoSingleFlight:
+    """不合并相同的调用"""
+
+    async def do(self, key, make_call, timeout=None, retry_on=()):
+        return await make_call(), False
+
+async def workload(scheduler):
+    patient_latencies = []
+
+    async def pool_call(i):
+        with scheduler.background():
+            await game_engine.ainvoke_llm(f"开局{i}", "病人", use_cache=False, call_type="patient")
+
+    async def patient_call(i):
+        await asyncio.sleep(i * PATIENT_INTERVAL)
+        start = time.perf_counter()
+        await game_engine.ainvoke_llm(f"病人回复{i}", "病人", use_cache=False, call_type="patient")
+        patient_latencies.append(time.perf_counter() - start)
+
+    async def referee_call():
+        await game_engine.ainvoke_llm("相同的裁判提示", "裁判", call_type="referee")
+
+    await asyncio.gather(*(pool_call(i) for i in range(POOL_CALLS)),
+                         *(patient_call(i) for i in range(PATIENT_CALLS)),
+                         *(referee_call() for _ in range(REFEREE_CALLS)))
+    return sorted(patient_latencies)
+
+def measure(name, scheduler, singleflight):
+    llm = SimulatedLLM()
+    game_engine.llm_response_cache.clear()
+    with patch.object(game_engine.async_client.chat.completions, "create", llm.create), \
+            patch.object(game_engine, "llm_scheduler", scheduler), \
+            patch.object(game_engine, "llm_singleflight", singleflight):
+        latencies = game_engine.run_sync(workload(scheduler))
+    print(f"{name}: 病人回复 p50 {percentile(latencies, 50):.2f}s，p99 {percentile(latencies, 99):.2f}s，"
+          f"模型服务收到{llm.requests}个请求")
+    for call_type, delay in scheduler.stats()["queue_delay_ms"].items():
+        print(f"  {call_type} 排队时间: p50 {delay['p50']:.1f}ms，p90 {delay['p90']:.1f}ms，p99 {delay['p99']:.1f}ms")
+
+def main():
+    print(f"后台补充{POOL_CALLS}个开局，同时到达{PATIENT_CALLS}个病人回复和{REFEREE_CALLS}个相同的裁判调用"
+          f"（模型服务容量{CAPACITY}）")
+    measure("不经过调度", LLMScheduler(max_concurrency=0, background_window_seconds=0), NoSingleFlight())
+    measure("经过调度（并发上限8）", LLMScheduler(max_concurrency=CAPACITY), SingleFlight())
+
+if __name__ == "__main__":
+    main()
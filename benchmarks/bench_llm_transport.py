@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+上游不稳定时的回合耗时测试
+本地的模拟HTTP服务器对部分请求注入长时间卡住和服务器错误，比较：
+- 原来的客户端配置（OpenAI客户端默认的超时和重试）
+- 配置读取超时、带抖动的退避重试和回合时间预算的传输层（超出预算时使用兜底回复）
+每个回合包含两次串行的LLM调用（系统判断和病人回复）
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import statistics
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from openai import AsyncOpenAI
+from llm_transport import create_async_client, RetryPolicy, GameDeadlines, LLMTransport, LLMDeadlineExceeded
+
+TURNS = 40
+HANG_RATE = 0.1  # 卡住的请求比例
+HANG_SECONDS = 8.0  # 卡住的时间（秒）
+ERROR_RATE = 0.1  # 返回503的请求比例
+LATENCY = 0.05  # 正常请求的延迟（秒）
+READ_TIMEOUT = 1.0
+TURN_BUDGET = 3.0
+
+def start_server(seed):
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("content-length", 0)))
+            with lock:
+                roll = rng.random()
+            try:
+                if roll < ERROR_RATE:
+                    self._send(503, {"error": {"message": "overloaded"}})
+                    return
+                time.sleep(HANG_SECONDS if roll < ERROR_RATE + HANG_RATE else LATENCY)
+                self._send(200, {"id": "mock", "object": "chat.completion", "created": 0, "model": "mock",
+                                 "choices": [{"index": 0, "finish_reason": "stop",
+                                              "message": {"role": "assistant", "content": "医生，我头有点疼。"}}]})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def _send(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+async def run_turns(client, call):
+    """依次执行回合，返回 (每个回合的耗时, 失败的回合数, 使用兜底回复的回合数)"""
+    durations, failed, fallbacks = [], 0, 0
+    for i in range(TURNS):
+        start = time.perf_counter()
+        outcome = await call(client, f"game-{i}")
+        durations.append(time.perf_counter() - start)
+        failed += outcome == "failed"
+        fallbacks += outcome == "fallback"
+    return durations, failed, fallbacks
+
+async def request(client):
+    response = await client.chat.completions.create(model="mock", messages=[{"role": "user", "content": "你好"}])
+    return response.choices[0].message.content
+
+async def baseline_turn(client, game_id):
+    try:
+        for _ in range(2):
+            await request(client)
+        return "ok"
+    except Exception:
+        return "failed"
+
+def transport_turn(transport):
+    async def turn(client, game_id):
+        with transport.deadlines.scope(game_id):
+            outcome = "ok"
+            for _ in range(2):
+                try:
+                    await transport.call(lambda: request(client), game_id)
+                except LLMDeadlineExceeded:
+                    outcome = "fallback"
+                except Exception:
+                    return "failed"
+            return outcome
+    return turn
+
+def report(name, durations, failed, fallbacks):
+    ordered = sorted(durations)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{name}: 平均 {statistics.mean(durations):.2f}s  p50 {statistics.median(durations):.2f}s  "
+          f"p99 {p99:.2f}s  最长 {ordered[-1]:.2f}s  失败 {failed}  兜底 {fallbacks}")
+
+async def main():
+    print(f"{TURNS}个回合，{HANG_RATE:.0%}的请求卡住{HANG_SECONDS:.0f}秒，{ERROR_RATE:.0%}的请求返回503")
+
+    httpd = start_server(seed=1)
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    client = AsyncOpenAI(base_url=base_url, api_key="bench")
+    report("原来的客户端", *await run_turns(client, baseline_turn))
+    await client.close()
+    httpd.shutdown()
+
+    httpd = start_server(seed=1)
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}/v1"
+    client = create_async_client(base_url=base_url, api_key="bench", read_timeout=READ_TIMEOUT)
+    transport = LLMTransport(
+        retry_policy=RetryPolicy(max_retries=2, backoff_base=0.2, backoff_max=1.0),
+        deadlines=GameDeadlines(budget_seconds=TURN_BUDGET)
+    )
+    report(f"传输层（读取超时{READ_TIMEOUT:.0f}秒，回合预算{TURN_BUDGET:.0f}秒）", *await run_turns(client, transport_turn(transport)))
+    await client.close()
+    httpd.shutdown()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+消息列表复制性能测试
+模拟一局游戏：每轮医生消息、系统检查、病人回复、再次系统检查各产生一个新状态，
+比较普通列表每次"messages + [新消息]"复制整个历史与MessageLog共享底层存储的总耗时。
+普通列表的总耗时随轮数平方增长，MessageLog随轮数线性增长；对话较短时普通列表在C中的复制更快
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from message_log import Message, MessageLog
+
+TURNS = [100, 1000, 5000]
+ROUNDS = 5
+
+def play(messages, turns):
+    """每轮产生医生消息和病人回复，中间的系统检查返回同一个列表的新快照"""
+    for i in range(turns):
+        doctor = messages + [Message(sender="doctor", content=f"第{i}个问题：你哪里不舒服？")]
+        checked = doctor[:]
+        patient = checked + [Message(sender="patient", content="医生，我这两天一直头痛，晚上还有点发烧。")]
+        messages = patient[:]
+    return messages
+
+def measure(make_messages, turns):
+    """返回一局游戏的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        play(make_messages(), turns)
+    return (time.perf_counter() - start) / ROUNDS * 1e3
+
+def main():
+    initial = [Message(sender="system", content="游戏开始，请为来到诊室的病人诊断病情")]
+    print("一局游戏中消息列表复制的总耗时(ms)")
+    for turns in TURNS:
+        plain = measure(lambda: list(initial), turns)
+        log = measure(lambda: MessageLog(initial), turns)
+        print(f"{turns}轮: 普通列表 {plain:.2f}，MessageLog {log:.2f}，加速 {plain / log:.1f}x")
+
+if __name__ == "__main__":
+    main()
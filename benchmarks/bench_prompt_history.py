@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+对话历史格式化性能测试
+模拟一局200条消息的游戏：每新增一条消息，病人节点和身体节点各格式化一次对话历史。
+比较每次重新格式化全部历史与增量格式化的总耗时
+"""
+
+import os
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from prompt_history import PromptHistory
+from sanitizer import SanitizedText
+
+MESSAGES = 200
+ROUNDS = 20
+
+def make_history():
+    """构造医生、病人交替的对话历史，病人消息都已清理过询问身体标记"""
+    messages = [{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}]
+    for i in range(MESSAGES // 2):
+        messages.append({"sender": "doctor", "content": f"第{i}个问题：你哪里不舒服？最近睡眠怎么样？"})
+        messages.append({"sender": "patient",
+                         "content": SanitizedText("医生，我这两天一直头痛，晚上还有点发烧，吃不下饭。")})
+    return messages[:MESSAGES]
+
+def full_format(messages):
+    """原来的方式：每次重新格式化全部历史"""
+    return "\n".join([f"{msg['sender']}: {msg['content']}" for msg in messages])
+
+def play(format_func, history):
+    """逐条追加消息，每条消息之后格式化两次"""
+    messages = []
+    for msg in history:
+        messages = messages + [msg]
+        format_func(messages)
+        format_func(messages)
+
+def measure(make_format_func, history):
+    """返回一局游戏的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        play(make_format_func(), history)
+    return (time.perf_counter() - start) / ROUNDS * 1e3
+
+def main():
+    history = make_history()
+    full = measure(lambda: full_format, history)
+    incremental = measure(lambda: PromptHistory().format, history)
+
+    print(f"{MESSAGES}条消息的一局游戏，格式化对话历史的总耗时(ms)")
+    print(f"每次重新格式化: {full:.2f}")
+    print(f"增量格式化: {incremental:.2f}")
+    print(f"加速: {full / incremental:.1f}x")
+
+if __name__ == "__main__":
+    main()
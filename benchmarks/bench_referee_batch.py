@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+批量裁判测试
+比较逐条调用LLM裁判与批量裁判检查同一组消息（例如重新检查保存的对话记录）时的调用次数、提示token数量和总耗时。
+用模拟的LLM接口代替真实服务：每次调用的延迟为固定的往返时间加上按输入、输出token计算的时间，
+同时进行的调用数量有上限（模型服务的并发限制）
+"""
+
+import os
+import sys
+import time
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("API_KEY", "benchmark")
+
+import game_engine
+from config import GAME_CONFIG
+from context_window import estimate_tokens
+from bench_diagnosis_matcher import SCRIPTED_GAMES
+
+ROUND_TRIP = 0.3  # 每次调用固定的往返时间（秒）
+PREFILL_PER_TOKEN = 0.0002  # 每个输入token的处理时间（秒）
+DECODE_PER_TOKEN = 0.01  # 每个输出token的生成时间（秒）
+MAX_CONCURRENCY = 4  # 模型服务允许同时进行的调用数量
+
+PATIENT_REPLIES = ["我头疼得厉害", "发烧三天了，最高三十九度", "晚上咳得睡不着", "饭后胃里一阵阵地疼",
+                   "关节早上起来特别僵", "嗓子疼，咽口水都疼", "总是口渴，一天喝好多水"]
+
+class SimulatedLLM:
+    """按token数量模拟延迟的LLM接口，回复总是"诊断不正确"和"符合要求\""""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.semaphore = None
+
+    async def create(self, model=None, messages=None, **kwargs):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+        prompt = messages[0]["content"] + messages[-1]["content"]
+        if '"verdicts"' in prompt:
+            count = prompt.count("] 发送者: ")
+            content = '{"verdicts": [' + ", ".join(f'{{"index": {i}, "ok": true}}' for i in range(count)) + ']}'
+        elif '"correct"' in prompt:
+            content = '{"correct": false}'
+        else:
+            content = '{"valid": true}'
+        async with self.semaphore:
+            self.calls += 1
+            self.prompt_tokens += estimate_tokens(prompt)
+            await asyncio.sleep(ROUND_TRIP + estimate_tokens(prompt) * PREFILL_PER_TOKEN
+                                + estimate_tokens(content) * DECODE_PER_TOKEN)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def build_items():
+    """内置问诊记录中的医生消息，每条医生消息后面跟一条病人回复"""
+    items = []
+    for disease, turns in SCRIPTED_GAMES.items():
+        for n, (message, _) in enumerate(turns):
+            items.append((message, "doctor", disease))
+            items.append((PATIENT_REPLIES[n % len(PATIENT_REPLIES)], "patient", disease))
+    return items
+
+async def judge_individually(items):
+    async def judge_one(message, sender, diagnosis):
+        if sender == "doctor":
+            return (await game_engine.ajudge_diagnosis(message, diagnosis))[0]
+        return (await game_engine.ajudge_format(message, diagnosis))[0]
+    return await asyncio.gather(*(judge_one(*item) for item in items))
+
+def measure(name, judge, items):
+    llm = SimulatedLLM()
+    game_engine.llm_response_cache.clear()
+    with patch.object(game_engine.async_client.chat.completions, "create", llm.create):
+        start = time.perf_counter()
+        game_engine.run_sync(judge(items))
+        elapsed = time.perf_counter() - start
+    print(f"{name}: {llm.calls}次调用，提示约{llm.prompt_tokens}个token，耗时 {elapsed:.2f}s")
+
+def main():
+    # 两种方式都不使用本地诊断匹配，只比较LLM调用
+    GAME_CONFIG["diagnosis_matcher"]["enabled"] = False
+    items = build_items()
+    print(f"检查{len(items)}条消息（每批最多{GAME_CONFIG['referee']['batch_max_items']}条，"
+          f"模型服务最多同时处理{MAX_CONCURRENCY}个调用）")
+    measure("逐条裁判", judge_individually, items)
+    measure("批量裁判", game_engine.ajudge_batch, items)
+
+if __name__ == "__main__":
+    main()
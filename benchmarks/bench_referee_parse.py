@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+裁判结论解析测试
+比较原来的文本匹配（精确匹配加逐条正则）解析自由文本回复，与要求输出JSON后的严格解析：
+- 每次解析的耗时
+- 误判的比例：格式检查的回复本意是"符合要求"却被解析为不符合时，病人回复会被重新生成并再次检查，
+  api.py中每轮最多因此多出3次系统节点调用
+自由文本回复是模型在"符合要求: 是/否"格式要求下常见的几种写法
+"""
+
+import os
+import re
+import sys
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from referee_verdict import VerdictParser
+
+ROUNDS = 20000
+
+# 本意都是"符合要求"的自由文本回复
+FREE_TEXT_REPLIES = [
+    "符合要求: 是",
+    "符合要求：是",
+    "发送者为病人时:\n符合要求: 是",
+    "是，符合要求",
+    "该回复符合格式要求。",
+    "病人的回复没有透露疾病名称，符合要求",
+    "**符合要求**: 是",
+    "符合要求: 是（病人只描述了症状，没有问题）",
+    "回复合理，可以发给医生",
+    "没有问题",
+]
+
+# 要求输出JSON后的回复
+JSON_REPLIES = [
+    '{"valid": true}',
+    '{"valid":true}',
+    '```json\n{"valid": true}\n```',
+    '{\n  "valid": true\n}',
+    '检查结果：{"valid": true}',
+]
+
+def original_parse(system_response):
+    """原来game_engine.py中格式检查的解析方式"""
+    is_reasonable = "符合要求: 是" in system_response
+    if not is_reasonable:
+        reasonable_patterns = [
+            r'符合要求\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+            r'符合规则\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+            r'合理性\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+            r'(合理|正确|恰当|适当)\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+            r'回复(合理|正确|恰当|适当)',
+            r'没有问题',
+            r'可以接受'
+        ]
+        unreasonable_patterns = [
+            r'符合要求\s*[:：]?\s*(否|不正确|不合理|不可以|有问题|不通过)',
+            r'不符合要求',
+            r'不合理',
+            r'有问题',
+            r'不恰当',
+            r'不适当'
+        ]
+        has_negative = any(re.search(pattern, system_response, re.IGNORECASE) for pattern in unreasonable_patterns)
+        if not has_negative:
+            is_reasonable = any(re.search(pattern, system_response, re.IGNORECASE) for pattern in reasonable_patterns)
+    return is_reasonable
+
+def measure(parse, replies):
+    """返回 (每次解析的平均耗时(微秒), 误判的比例)"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS // len(replies)):
+        for reply in replies:
+            parse(reply)
+    elapsed = (time.perf_counter() - start) / (ROUNDS // len(replies) * len(replies))
+    misparsed = sum(1 for reply in replies if not parse(reply)) / len(replies)
+    return elapsed * 1e6, misparsed
+
+def main():
+    parser = VerdictParser()
+    rows = [
+        ("原来的文本匹配，自由文本回复", measure(original_parse, FREE_TEXT_REPLIES)),
+        ("新的解析（退回文本匹配），自由文本回复", measure(parser.format, FREE_TEXT_REPLIES)),
+        ("新的解析，JSON回复", measure(parser.format, JSON_REPLIES)),
+    ]
+    print(f"格式检查结论的解析（每种方式{ROUNDS}次）")
+    for name, (micros, misparsed) in rows:
+        print(f"{name}: 平均 {micros:.2f}µs，误判为不符合要求 {misparsed:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+询问身体标记清理性能测试
+在200条消息的对话历史上比较系统节点每次调用的清理耗时：
+原来每次对全部病人消息做两次re.sub；合并为一次预编译的替换；
+以及已清理过的消息不再重新匹配
+"""
+
+import os
+import re
+import sys
+import copy
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sanitizer import INQUIRY_PATTERN, sanitize_history
+
+MESSAGES = 200
+ROUNDS = 2000
+
+def make_history():
+    """构造医生、病人交替的对话历史，其中部分病人消息带有询问身体标记"""
+    messages = [{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}]
+    for i in range(MESSAGES // 2):
+        messages.append({"sender": "doctor", "content": f"第{i}个问题：你哪里不舒服？最近睡眠怎么样？"})
+        if i % 3 == 0:
+            messages.append({"sender": "patient", "content": f"[询问身体：问题{i}的感受]"})
+        else:
+            messages.append({"sender": "patient", "content": "医生，我这两天一直头痛，晚上还有点发烧，吃不下饭。"})
+    return messages[:MESSAGES]
+
+def legacy_sanitize(messages):
+    """原来的清理方式：每次对所有病人消息做两次替换"""
+    for i, msg in enumerate(messages):
+        if msg["sender"] == "patient":
+            content = msg["content"]
+            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', content)
+            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', cleaned_content)
+            cleaned_content = cleaned_content.strip()
+            if cleaned_content != content:
+                messages[i]["content"] = cleaned_content
+
+def single_pass_sanitize(messages):
+    """合并为一次预编译的替换，但每次仍匹配所有病人消息"""
+    for msg in messages:
+        if msg["sender"] == "patient":
+            msg["content"] = INQUIRY_PATTERN.sub('', msg["content"]).strip()
+
+def measure(func, messages):
+    """返回单次调用的平均耗时（微秒）"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        func(messages)
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+def main():
+    history = make_history()
+    legacy = measure(legacy_sanitize, copy.deepcopy(history))
+    single = measure(single_pass_sanitize, copy.deepcopy(history))
+
+    cached_history = copy.deepcopy(history)
+    sanitize_history(cached_history)
+    cached = measure(sanitize_history, cached_history)
+
+    print(f"{MESSAGES}条消息的对话历史，系统节点单次清理平均耗时(μs)")
+    print(f"两次re.sub: {legacy:.1f}")
+    print(f"一次预编译替换: {single:.1f}")
+    print(f"已清理的消息不再匹配: {cached:.1f}")
+    print(f"加速: {legacy / cached:.1f}x")
+
+if __name__ == "__main__":
+    main()
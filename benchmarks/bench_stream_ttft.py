@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+流式接口首字延迟测试
+用模拟的LLM接口（固定的首包延迟和逐字延迟）比较：
+- /api/send_message：等待整个处理链完成后才返回
+- /api/send_message_stream：第一个病人回复片段到达的时间
+"""
+
+import os
+import sys
+import time
+import asyncio
+import statistics
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("API_KEY", "bench")
+
+import game_engine
+from api import app, active_games, api_logs
+
+FIRST_CHUNK_DELAY = 0.4  # 每次调用的首包延迟（秒）
+TOKEN_DELAY = 0.03  # 每个字的生成延迟（秒）
+ROUNDS = 5
+
+def reply_for(prompt):
+    if "诊断正确" in prompt:
+        return "诊断正确: 否"
+    return "医生，我从前天开始头痛，晚上还发烧到三十八度多，浑身没劲。"
+
+async def fake_create(model=None, messages=None, stream=False, **kwargs):
+    content = reply_for(messages[-1]["content"])
+    await asyncio.sleep(FIRST_CHUNK_DELAY)
+    if stream:
+        async def chunks():
+            for char in content:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=char))])
+                await asyncio.sleep(TOKEN_DELAY)
+        return chunks()
+    await asyncio.sleep(TOKEN_DELAY * len(content))
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def new_game_state(game_id):
+    active_games[game_id] = {
+        "messages": [
+            {"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"},
+            {"sender": "patient", "content": "医生您好，我感到不舒服"}
+        ],
+        "current_sender": "doctor",
+        "diagnosis": "流感",
+        "game_over": False,
+        "turn_count": 0
+    }
+    api_logs[game_id] = []
+
+def measure_blocking(client, game_id, message):
+    start = time.perf_counter()
+    client.post('/api/send_message', json={'game_id': game_id, 'message': message})
+    return time.perf_counter() - start
+
+def measure_stream(client, game_id, message):
+    start = time.perf_counter()
+    response = client.post('/api/send_message_stream', json={'game_id': game_id, 'message': message},
+                           buffered=False)
+    first_token = None
+    for chunk in response.response:
+        if first_token is None and b"event: token" in chunk:
+            first_token = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return first_token, total
+
+def main():
+    blocking, ttft, stream_total = [], [], []
+    with patch.object(game_engine.async_client.chat.completions, "create", fake_create), app.test_client() as client:
+        for i in range(ROUNDS):
+            game_engine.llm_response_cache.clear()
+            new_game_state(f"bench-blocking-{i}")
+            blocking.append(measure_blocking(client, f"bench-blocking-{i}", f"您哪里不舒服？{i}"))
+
+            new_game_state(f"bench-stream-{i}")
+            game_engine.llm_response_cache.clear()
+            first, total = measure_stream(client, f"bench-stream-{i}", f"您哪里不舒服？{i}")
+            ttft.append(first)
+            stream_total.append(total)
+
+    print(f"模拟LLM：首包延迟{FIRST_CHUNK_DELAY * 1000:.0f}ms，逐字延迟{TOKEN_DELAY * 1000:.0f}ms，{ROUNDS}轮中位数")
+    print(f"阻塞接口 完整响应:     {statistics.median(blocking) * 1000:8.0f} ms")
+    print(f"流式接口 首个回复片段: {statistics.median(ttft) * 1000:8.0f} ms")
+    print(f"流式接口 完整响应:     {statistics.median(stream_total) * 1000:8.0f} ms")
+
+if __name__ == "__main__":
+    main()
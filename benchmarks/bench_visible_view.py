@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+响应消息过滤性能测试
+模拟一局100轮的游戏，每轮响应时：原来每次重新过滤整个历史并返回全部消息；
+使用按游戏缓存的消息视图并只返回客户端还没有的消息（增量响应）。
+比较每局游戏过滤和JSON序列化的总耗时，以及响应的总字节数
+"""
+
+import os
+import sys
+import json
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from game_state import json_default
+from message_log import MessageLog
+from sanitizer import visible_messages
+from visible_view import VisibleMessageView
+
+TURNS = 100
+ROUNDS = 20
+
+def turns():
+    """逐轮产生新增的消息，每3轮病人询问一次身体"""
+    for i in range(TURNS):
+        turn = [{"sender": "doctor", "content": f"第{i}个问题：头痛是什么时候开始的？"}]
+        if i % 3 == 0:
+            turn.append({"sender": "patient", "content": f"[询问身体:问题{i}的感受]"})
+            turn.append({"sender": "body", "content": "额头两侧持续胀痛，下午体温37.8度。"})
+        turn.append({"sender": "patient", "content": "大概一周前开始的，白天还好，晚上更严重。"})
+        yield turn
+
+def play(delta):
+    """返回一局游戏所有响应的总字节数"""
+    messages = MessageLog([{"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"}])
+    view = VisibleMessageView()
+    seen = 0
+    total = 0
+    for turn in turns():
+        messages = messages + turn
+        if delta:
+            new_messages = view.messages(messages, seen)
+            seen += len(new_messages)
+        else:
+            new_messages = visible_messages(messages)
+        total += len(json.dumps({"messages": new_messages}, ensure_ascii=False, default=json_default).encode("utf-8"))
+    return total
+
+def measure(delta):
+    """返回 (一局游戏的平均耗时(ms), 响应总字节数)"""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        size = play(delta)
+    return (time.perf_counter() - start) / ROUNDS * 1e3, size
+
+def main():
+    full_time, full_size = measure(delta=False)
+    delta_time, delta_size = measure(delta=True)
+
+    print(f"{TURNS}轮游戏，所有响应的消息过滤和序列化")
+    print(f"每次过滤全部历史: {full_time:.2f}ms，{full_size}字节")
+    print(f"缓存视图+增量响应: {delta_time:.2f}ms，{delta_size}字节")
+    print(f"耗时减少 {1 - delta_time / full_time:.0%}，响应大小减少 {1 - delta_size / full_size:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,29 @@ GAME_CONFIG = {
     # 是否使用关键词判断医生回复是否包含诊断（如果为false，则每次医生回复都由系统判断诊断是否正确）
     "use_keyword_diagnosis_check": os.getenv("USE_KEYWORD_DIAGNOSIS_CHECK", "false").lower() == "true",
 
+    # 本地的诊断匹配：医生消息先用同义词、否定和不确定表述的规则判断，置信度足够高时不调用LLM裁判
+    "diagnosis_matcher": {
+        # 是否启用
+        "enabled": os.getenv("DIAGNOSIS_MATCHER", "true").lower() == "true",
+        # 直接采用本地判断的最低置信度（0~1），低于这个值的消息交给LLM裁判
+        "confidence_threshold": float(os.getenv("DIAGNOSIS_MATCHER_THRESHOLD", "0.8")),
+    },
+
+    # 裁判的输出方式
+    "referee": {
+        # off：原来的文本格式（"诊断正确: 是/否"）；prompt：在提示中要求输出JSON；
+        # json_schema：同时要求API按JSON Schema输出（需要模型服务支持response_format）
+        "output": os.getenv("REFEREE_OUTPUT", "prompt"),
+        # 同时进行的病人消息格式检查达到这个数量时，新的检查在短时间窗口内合并为一次批量裁判（0表示不合并）
+        "batch_min_concurrency": int(os.getenv("REFEREE_BATCH_MIN_CONCURRENCY", "16")),
+        "batch_window_ms": float(os.getenv("REFEREE_BATCH_WINDOW_MS", "20")),  # 收集同一批检查的时间窗口（毫秒）
+        "batch_max_items": int(os.getenv("REFEREE_BATCH_MAX_ITEMS", "20")),  # 每次批量裁判最多的消息数量
+        "batch_max_tokens": int(os.getenv("REFEREE_BATCH_MAX_TOKENS", "3000")),  # 每次批量裁判中消息部分的token上限（粗略估计）
+    },
+
+    # 是否推测执行：系统判断医生消息是否为正确诊断的同时生成病人回复（判定诊断正确时丢弃病人回复）
+    "speculative_patient_reply": os.getenv("SPECULATIVE_PATIENT_REPLY", "false").lower() == "true",
+
     # 可选的疾病列表
     "diseases": [
         "流感", "肺炎", "胃溃疡", "偏头痛", "扁桃体炎",
@@ -29,6 +52,124 @@ GAME_CONFIG = {
     # 对话轮数限制
     "max_conversation_turns": int(os.getenv("MAX_CONVERSATION_TURNS", "100")),
 
+    # 长对话的上下文管理：提示中只保留最近消息的原文，更早的对话用滚动摘要代替
+    "context": {
+        # 保留原文的最近消息数量（为0时不启用摘要，提示中包含完整的对话历史）
+        "window_messages": int(os.getenv("CONTEXT_WINDOW_MESSAGES", "40")),
+        # 窗口之外累积多少轮对话后重新生成摘要
+        "summary_interval_turns": int(os.getenv("CONTEXT_SUMMARY_INTERVAL", "5")),
+        # 提示中对话历史的token上限（为0时不限制）
+        "max_history_tokens": int(os.getenv("CONTEXT_MAX_HISTORY_TOKENS", "3000")),
+    },
+
+    # 游戏状态存储配置：限制内存中的游戏数量，淘汰长时间无人访问和已结束的游戏
+    "game_store": {
+        # 存储后端：memory（进程内）或 sqlite（保存到本地数据库，同一台机器上的多个工作进程共享）
+        "backend": os.getenv("GAME_STORE_BACKEND", "memory"),
+        # SQLite数据库文件路径
+        "path": os.getenv("GAME_STORE_FILE", "cache/game_store.sqlite3"),
+        # 最多同时保存的游戏数量
+        "max_games": int(os.getenv("MAX_ACTIVE_GAMES", "1000")),
+        # 游戏无人访问多久后淘汰（秒）
+        "idle_timeout_seconds": int(os.getenv("GAME_IDLE_TIMEOUT", "1800")),
+        # 游戏结束后多久淘汰（秒）
+        "finished_ttl_seconds": int(os.getenv("FINISHED_GAME_TTL", "300")),
+        # 后台清理的间隔（秒）
+        "reap_interval_seconds": int(os.getenv("GAME_REAP_INTERVAL", "60")),
+    },
+
+    # 发送消息的幂等键配置：相同幂等键的重复请求返回第一次请求的结果
+    "idempotency": {
+        # 已完成结果的保留时间（秒）
+        "ttl_seconds": int(os.getenv("IDEMPOTENCY_TTL", "300")),
+        # 最多保留的已完成结果数量
+        "max_results": int(os.getenv("IDEMPOTENCY_MAX_RESULTS", "1000")),
+    },
+
+    # LLM响应缓存配置（只缓存裁判判断等确定性的调用，病人对话不缓存）
+    "llm_cache": {
+        # 缓存后端：memory（进程内）或 sqlite（保存到本地数据库，重启后保留，多个工作进程共享）
+        "backend": os.getenv("LLM_CACHE_BACKEND", "memory"),
+        # SQLite数据库文件路径
+        "path": os.getenv("LLM_CACHE_FILE", "cache/llm_cache.sqlite3"),
+        # 最多缓存的响应数量
+        "max_entries": int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+        # 缓存内容的内存占用上限（字节）
+        "max_bytes": int(os.getenv("LLM_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+        # 缓存的有效期（秒）
+        "ttl_seconds": int(os.getenv("LLM_CACHE_TTL", "3600")),
+    },
+
+    # 初始症状缓存配置：每种疾病缓存若干个症状描述变体，跨游戏随机复用
+    "initial_symptoms_cache": {
+        # 每种疾病的变体数量
+        "variants_per_disease": int(os.getenv("SYMPTOM_CACHE_VARIANTS", "3")),
+        # 变体的有效期（秒）
+        "ttl_seconds": int(os.getenv("SYMPTOM_CACHE_TTL", "86400")),
+        # 最多缓存的疾病数量
+        "max_diseases": int(os.getenv("SYMPTOM_CACHE_MAX_DISEASES", "100")),
+        # 持久化文件路径（为空时不保存到磁盘）
+        "persist_path": os.getenv("SYMPTOM_CACHE_FILE", ""),
+    },
+
+    # 开局池配置：后台为每种疾病预先生成开局，创建新游戏时直接取用
+    "opening_pool": {
+        # 每种疾病保留的开局数量（为0时不启用）
+        "size_per_disease": int(os.getenv("OPENING_POOL_SIZE", "0")),
+        # 开局的有效期（秒）
+        "ttl_seconds": int(os.getenv("OPENING_POOL_TTL", "3600")),
+        # 补充开局时同时进行的生成数量
+        "refill_concurrency": int(os.getenv("OPENING_POOL_REFILL_CONCURRENCY", "2")),
+    },
+
+    # API调用日志配置
+    "api_log": {
+        # 是否由后台线程异步写入日志（false时在请求中同步写入）
+        "async": os.getenv("API_LOG_ASYNC", "true").lower() == "true",
+        # 每批最多写入的日志条数
+        "batch_size": int(os.getenv("API_LOG_BATCH_SIZE", "50")),
+        # 最长写入间隔（毫秒）
+        "flush_interval_ms": int(os.getenv("API_LOG_FLUSH_INTERVAL_MS", "200")),
+        # 日志队列上限
+        "max_queue_size": int(os.getenv("API_LOG_MAX_QUEUE_SIZE", "10000")),
+        # 队列写满时的策略：drop（丢弃新日志）或block（阻塞调用方）
+        "overflow_policy": os.getenv("API_LOG_OVERFLOW_POLICY", "drop"),
+    },
+
+    # LLM传输层配置：连接池、超时、重试和每个回合的时间预算
+    "llm_transport": {
+        # 连接池的最大连接数
+        "max_connections": int(os.getenv("LLM_MAX_CONNECTIONS", "100")),
+        # 最多保持的空闲连接数
+        "max_keepalive_connections": int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        # 空闲连接保持的时间（秒）
+        "keepalive_expiry": float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30")),
+        # 建立连接的超时（秒）
+        "connect_timeout": float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+        # 读取响应的超时（秒），流式调用时是两段回复之间的超时
+        "read_timeout": float(os.getenv("LLM_READ_TIMEOUT", "60")),
+        # 发送请求的超时（秒）
+        "write_timeout": float(os.getenv("LLM_WRITE_TIMEOUT", "10")),
+        # 等待连接池空闲连接的超时（秒）
+        "pool_timeout": float(os.getenv("LLM_POOL_TIMEOUT", "10")),
+        # 连接错误、超时、限流和服务器错误的最多重试次数
+        "max_retries": int(os.getenv("LLM_MAX_RETRIES", "2")),
+        # 第一次重试前等待时间的上限（秒），之后每次翻倍，实际等待时间在0到上限之间随机取值
+        "backoff_base": float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+        # 每次重试前等待时间的上限（秒）
+        "backoff_max": float(os.getenv("LLM_BACKOFF_MAX", "8")),
+        # 每个回合所有LLM调用的总时间预算（秒，为0时不限制），用完后使用兜底回复
+        "turn_budget_seconds": float(os.getenv("LLM_TURN_BUDGET", "90")),
+    },
+
+    # LLM调用的调度配置
+    "llm_scheduler": {
+        # 同时进行的LLM调用数量上限（0表示不限制），超过时按调用类型的优先级排队
+        "max_concurrency": int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+        # 后台调用（补充开局池）排队前等待的时间窗口（毫秒），窗口内到达的前台调用优先
+        "background_window_ms": float(os.getenv("LLM_BACKGROUND_WINDOW_MS", "20")),
+    },
+
     # API相关配置
     "api": {
         "base_url": os.getenv("API_BASE_URL"),
@@ -0,0 +1,157 @@
+"""
+长对话的上下文管理
+提示中只保留最近若干条消息的原文，更早的对话用滚动摘要代替；摘要不是每轮都重新生成，
+窗口之外累积了一定轮数的对话后才把这些对话合并进摘要。对话历史超过token上限时从最早的消息开始截断
+"""
+
+from collections import OrderedDict
+
+def estimate_tokens(text):
+    """
+    粗略估计文本的token数量：中文等非ASCII字符按每个字符1个token，ASCII字符按每4个字符1个token
+
+    Args:
+        text: 文本
+
+    Returns:
+        估计的token数量
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return len(text) - ascii_chars + (ascii_chars + 3) // 4
+
+class ContextManager:
+    """
+    按游戏构建提示中的对话历史：滚动摘要 + 最近消息的原文，并限制总token数量
+
+    摘要由summarize生成：summarize(game_id, 之前的摘要, 需要合并的对话文本) 是返回新摘要的协程函数。
+    生成摘要失败时保留之前的摘要，尚未合并的对话继续以原文出现在提示中
+    """
+
+    def __init__(self, histories, summarize, window_messages=40, summary_interval_turns=5,
+                 max_history_tokens=3000, max_games=1000):
+        """
+        Args:
+            histories: 格式化对话历史的PromptHistoryCache
+            summarize: 生成摘要的协程函数
+            window_messages: 保留原文的最近消息数量，为0时不启用摘要
+            summary_interval_turns: 窗口之外累积多少轮对话（医生消息数）后重新生成摘要
+            max_history_tokens: 对话历史的token上限，为0时不限制
+            max_games: 最多保存摘要的游戏数量
+        """
+        self.histories = histories
+        self.summarize = summarize
+        self.window_messages = window_messages
+        self.summary_interval_turns = max(1, summary_interval_turns)
+        self.max_history_tokens = max_history_tokens
+        self.max_games = max(1, max_games)
+
+        # 统计数据
+        self.summaries = 0  # 生成摘要的次数
+        self.summary_failures = 0  # 生成摘要失败的次数
+        self.trimmed = 0  # 因超过token上限截断对话历史的次数
+
+        # {游戏ID: (摘要, 摘要覆盖的消息数量, 最后一条被覆盖消息的(发送者, 内容))}
+        self._summaries = OrderedDict()
+
+    async def abuild(self, game_id, messages, include_body=True, count=None):
+        """
+        构建提示中使用的对话历史
+
+        Args:
+            game_id: 游戏ID，为空时不生成摘要
+            messages: 消息列表
+            include_body: 是否包含身体消息
+            count: 只使用前count条消息，默认为全部
+
+        Returns:
+            对话历史文本
+        """
+        if count is None:
+            count = len(messages)
+
+        summary, covered = "", 0
+        if self.window_messages and game_id is not None:
+            summary, covered = self._get_summary(game_id, messages, count)
+            window_start = count - self.window_messages
+            if window_start > covered and self._turns(messages, covered, window_start) >= self.summary_interval_turns:
+                summary, covered = await self._update_summary(game_id, messages, summary, covered, window_start)
+
+        start = self._trim(messages, include_body, summary, covered, count)
+        recent = self.histories.format(game_id, messages, include_body, count, start)
+        if summary:
+            return f"[之前对话的摘要]\n{summary}\n\n[最近的对话]\n{recent}"
+        if start > 0:
+            return f"（更早的对话已省略）\n{recent}"
+        return recent
+
+    def release(self, game_id):
+        """游戏结束或被淘汰后删除摘要"""
+        self._summaries.pop(game_id, None)
+
+    def stats(self):
+        """上下文管理的统计数据"""
+        return {
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "trimmed": self.trimmed,
+            "games_with_summary": len(self._summaries)
+        }
+
+    def _get_summary(self, game_id, messages, count):
+        """取出仍然适用于当前消息列表的摘要，返回 (摘要, 覆盖的消息数量)"""
+        entry = self._summaries.get(game_id)
+        if entry is None:
+            return "", 0
+        summary, covered, last = entry
+        # 摘要按内容校验：消息被替换或换成另一局对话时不再使用
+        if covered > count or (messages[covered - 1]["sender"], messages[covered - 1]["content"]) != last:
+            return "", 0
+        self._summaries.move_to_end(game_id)
+        return summary, covered
+
+    async def _update_summary(self, game_id, messages, summary, covered, end):
+        """把第covered到end条消息合并进摘要，失败时返回原来的摘要"""
+        text = self.histories.format(game_id, messages, True, end, covered)
+        try:
+            new_summary = (await self.summarize(game_id, summary, text) or "").strip()
+        except Exception as e:
+            print(f"生成对话摘要失败: {str(e)}")
+            self.summary_failures += 1
+            return summary, covered
+        if not new_summary:
+            self.summary_failures += 1
+            return summary, covered
+
+        self.summaries += 1
+        last = messages[end - 1]
+        self._summaries[game_id] = (new_summary, end, (last["sender"], last["content"]))
+        self._summaries.move_to_end(game_id)
+        while len(self._summaries) > self.max_games:
+            self._summaries.popitem(last=False)
+        return new_summary, end
+
+    def _trim(self, messages, include_body, summary, start, count):
+        """对话历史超过token上限时从最早的消息开始去掉，至少保留最后一条消息，返回保留的第一条消息的下标"""
+        if not self.max_history_tokens:
+            return start
+        budget = self.max_history_tokens - estimate_tokens(summary)
+        costs = [estimate_tokens(f"{msg['sender']}: {msg['content']}") + 1
+                 if include_body or msg["sender"] != "body" else 0
+                 for msg in messages[start:count]]
+        total = sum(costs)
+        if total <= budget:
+            return start
+
+        self.trimmed += 1
+        index = start
+        for cost in costs[:-1]:
+            if total <= budget:
+                break
+            total -= cost
+            index += 1
+        return index
+
+    @staticmethod
+    def _turns(messages, start, end):
+        """第start到end条消息中的对话轮数（医生消息数）"""
+        return sum(1 for msg in messages[start:end] if msg["sender"] == "doctor")
@@ -0,0 +1,212 @@
+"""
+基于规则的诊断匹配
+在调用LLM裁判之前先在本地判断医生消息是否给出了正确诊断：
+识别疾病名称及其别名，检测否定（"不是流感"）和不确定的表述（"可能是A或B"、"是流感吗？"），
+给出判断和置信度。大多数医生消息是问诊问题，能确定诊断不正确时直接采用本地判断；
+判断为正确的消息会结束游戏，规则漏掉一个否定就会让说错的医生获胜，所以总是交给LLM裁判确认
+"""
+
+import re
+import threading
+from collections import namedtuple
+
+# 游戏中各疾病的同义词和别名（英文别名匹配时不区分大小写）
+DISEASE_ALIASES = {
+    "流感": ["流行性感冒", "流感", "甲流", "乙流", "甲型流感", "乙型流感", "influenza", "flu"],
+    "肺炎": ["肺炎", "肺部感染", "肺部炎症", "肺感染", "pneumonia"],
+    "胃溃疡": ["胃溃疡", "消化性溃疡", "胃部溃疡", "胃黏膜溃疡", "gastriculcer", "pepticulcer"],
+    "偏头痛": ["偏头痛", "偏头疼", "血管性头痛", "migraine"],
+    "扁桃体炎": ["扁桃体炎", "扁桃腺炎", "扁桃体发炎", "扁桃腺发炎", "扁桃体感染", "tonsillitis"],
+    "高血压": ["高血压", "血压高", "血压偏高", "血压过高", "hypertension"],
+    "糖尿病": ["糖尿病", "消渴症", "diabetes"],
+    "关节炎": ["关节炎", "关节发炎", "关节炎症", "arthritis"],
+    "哮喘": ["哮喘", "气喘病", "asthma"],
+    "过敏性鼻炎": ["过敏性鼻炎", "变应性鼻炎", "花粉症", "鼻子过敏", "鼻过敏", "allergicrhinitis", "hayfever"],
+}
+
+# 与某种疾病相近但不能据此判断对错的说法（例如"感冒"和"流感"），出现时交给LLM裁判
+RELATED_TERMS = {
+    "流感": ["感冒", "病毒感染"],
+    "肺炎": ["支气管炎", "呼吸道感染"],
+    "胃溃疡": ["胃病", "胃炎", "胃出血"],
+    "偏头痛": ["头痛病", "神经性头痛"],
+    "扁桃体炎": ["咽炎", "咽喉炎", "喉咙发炎", "嗓子发炎"],
+    "高血压": ["血压"],
+    "糖尿病": ["血糖"],
+    "关节炎": ["风湿", "痛风"],
+    "哮喘": ["气喘", "支气管痉挛"],
+    "过敏性鼻炎": ["鼻炎", "过敏"],
+}
+
+# 游戏之外的常见疾病名称，医生说出这些疾病时可以确定诊断不正确
+OTHER_DISEASES = [
+    "中耳炎", "结膜炎", "肠胃炎", "阑尾炎", "胆囊炎", "胰腺炎", "肝炎", "肾炎", "膀胱炎", "尿路感染",
+    "心脏病", "冠心病", "心肌炎", "心梗", "中风", "脑梗", "癫痫", "贫血", "甲亢", "甲减",
+    "抑郁症", "焦虑症", "失眠症", "颈椎病", "腰椎间盘突出", "骨折", "湿疹", "荨麻疹", "水痘", "麻疹",
+    "结核", "新冠", "食物中毒", "肿瘤", "癌症",
+]
+
+# 给出诊断时常用的说法
+DIAGNOSIS_CUES = re.compile(r"诊断|确诊|得了|得的是|患了|患有|患的是|应该是|属于|判断为|结论|我认为|我觉得|病因")
+
+# 疾病名称之前表示断定的字（"你这是流感"、"你有糖尿病"）
+ASSERTIONS = re.compile(r"[是得患有]")
+
+# 不确定的表述，出现在提到疾病的分句中时交给LLM裁判
+HEDGES = re.compile(
+    r"可能|也许|或许|大概|估计|疑似|怀疑|不确定|不一定|不排除|待查|排查|考虑|倾向|像是|好像|似乎|还是|或者|或是|以及|要么"
+    r"|如果|假如|假设|要是|若是|万一|难说|不好说|说不准|说不好|不能确定|不敢确定|无法确定|没法|无法|还不能|暂时不能"
+)
+
+# 提问的表述
+QUESTIONS = re.compile(r"是不是|会不会|是否|有没有|有无|[吗呢嘛][？?]?$|[？?]$")
+
+# 否定的表述，出现在疾病名称之前不远处时表示排除这种疾病（"是不是"、"有没有"等提问不算否定）
+NEGATIONS = re.compile(
+    r"((?<!是)不是|不像|(?<!会)不会是|(?<!有)没有|没得|并非|(?<!不)排除|否认|不可能是|不太可能是"
+    r"|不认为|不觉得|不相信|不同意|不能确定|不敢确定|无法确定|不能诊断|没法|无法|难说|不好说|说不准).{0,6}$"
+)
+
+# 疾病名称常见的结尾字：没有匹配到已知的疾病名称但出现这些字时，可能是别名表中没有的说法
+DISEASE_SUFFIXES = re.compile(r"[炎病症痛]")
+
+# 常见的繁体字（疾病名称和诊断表述中用到的），匹配前转换为简体
+TRADITIONAL_TO_SIMPLIFIED = str.maketrans(
+    "頭潰瘍體壓關節過發燒診斷應該屬論為認覺確這種腸癥氣嗎麼沒會說難無還並個們結傾計許腦脹風濕腎膽經傷熱嚨來時裡裏後樣變療檢查腫癇貧鬱慮頸椎盤濕蕁結腫癌",
+    "头溃疡体压关节过发烧诊断应该属论为认觉确这种肠症气吗么没会说难无还并个们结倾计许脑胀风湿肾胆经伤热咙来时里里后样变疗检查肿痫贫郁虑颈椎盘湿荨结肿癌"
+)
+
+# 列举多种可能性的连接词
+ALTERNATIVES = re.compile(r"或者|或是|还是|或|要么|以及|和|跟|与")
+
+_CLAUSE = re.compile(r"[^，。；！？,.;!?\n]+[，。；！？,.;!?\n]*")
+_NORMALIZE = re.compile(r"[\s\"'“”‘’「」『』《》()（）【】\[\]]+")
+
+# 匹配结果：correct为更可能的判断，confidence为置信度（0~1），reason为判断依据
+DiagnosisMatch = namedtuple("DiagnosisMatch", ["correct", "confidence", "reason"])
+
+class DiagnosisMatcher:
+    """
+    判断医生消息是否明确说出了正确的疾病名称
+
+    诊断不正确且置信度不低于threshold时可以直接采用判断结果；判断为正确的消息和置信度不够的消息都应交给LLM裁判
+    """
+
+    def __init__(self, diseases, aliases=None, related=None, other_diseases=None, threshold=0.8):
+        """
+        Args:
+            diseases: 游戏中的疾病列表
+            aliases: {疾病: [别名]}，未提供别名的疾病只匹配疾病名称本身
+            related: {疾病: [相近的说法]}
+            other_diseases: 游戏之外的疾病名称
+            threshold: 直接采用"诊断不正确"判断的最低置信度
+        """
+        aliases = DISEASE_ALIASES if aliases is None else aliases
+        related = RELATED_TERMS if related is None else related
+        other_diseases = OTHER_DISEASES if other_diseases is None else other_diseases
+        self.threshold = threshold
+
+        # 统计数据
+        self.negatives = 0  # 本地判定诊断不正确的次数
+        self.positives = 0  # 规则认为诊断正确、交给LLM裁判确认的次数
+        self.deferred = 0  # 交给LLM裁判的次数（包括positives）
+        self._lock = threading.Lock()
+
+        # {名称: 疾病}，疾病为None时表示游戏之外的疾病
+        self._names = {}
+        for name in other_diseases:
+            self._names[self._normalize(name)] = None
+        for disease in diseases:
+            for name in [disease] + list(aliases.get(disease, [])):
+                self._names[self._normalize(name)] = disease
+        self._related = {disease: [self._normalize(term) for term in related.get(disease, [])]
+                         for disease in diseases}
+        # 较长的名称优先匹配，"过敏性鼻炎"不会被当作"鼻炎"，"流行性感冒"不会被当作"感冒"
+        names = sorted(self._names, key=len, reverse=True)
+        self._pattern = re.compile("|".join(re.escape(name) for name in names)) if names else None
+
+    @staticmethod
+    def _normalize(text):
+        return _NORMALIZE.sub("", text).translate(TRADITIONAL_TO_SIMPLIFIED).lower()
+
+    def match(self, message, diagnosis):
+        """
+        判断医生消息是否给出了正确诊断
+
+        Args:
+            message: 医生消息
+            diagnosis: 正确的疾病名称
+
+        Returns:
+            DiagnosisMatch
+        """
+        text = self._normalize(message)
+        target_hits, other_hits = [], []
+        for clause in _CLAUSE.findall(text):
+            for found in (self._pattern.finditer(clause) if self._pattern else ()):
+                disease = self._names[found.group()]
+                hit = (clause, found.start())
+                (target_hits if disease == diagnosis else other_hits).append(hit)
+
+        if not target_hits:
+            related = [term for term in self._related.get(diagnosis, []) if term in text]
+            if related:
+                return DiagnosisMatch(False, 0.5, f"提到了相近的说法: {related[0]}")
+            if any(not self._negated(clause, start) for clause, start in other_hits):
+                return DiagnosisMatch(False, 0.95, "说出了其他疾病")
+            # 别名表中没有的说法不能确定对错
+            if DIAGNOSIS_CUES.search(text) or DISEASE_SUFFIXES.search(text):
+                return DiagnosisMatch(False, 0.6, "像是在给出诊断，但没有提到已知的疾病名称")
+            return DiagnosisMatch(False, 0.95, "没有提到正确的疾病")
+
+        affirmed = [(clause, start) for clause, start in target_hits if not self._negated(clause, start)]
+        if not affirmed:
+            return DiagnosisMatch(False, 0.9, "否定了正确的疾病")
+
+        others = [(clause, start) for clause, start in other_hits if not self._negated(clause, start)]
+        if others:
+            if any(ALTERNATIVES.search(clause) or HEDGES.search(clause) for clause, _ in affirmed + others):
+                return DiagnosisMatch(False, 0.9, "列举了多种可能的疾病")
+            return DiagnosisMatch(False, 0.5, "同时提到了多种疾病")
+
+        clause, start = affirmed[0]
+        if HEDGES.search(clause):
+            return DiagnosisMatch(False, 0.6, "诊断的表述不确定")
+        if QUESTIONS.search(clause):
+            return DiagnosisMatch(False, 0.6, "以提问的方式提到了疾病")
+        if DIAGNOSIS_CUES.search(text) or ASSERTIONS.search(clause[:start]):
+            return DiagnosisMatch(True, 0.95, "明确说出了正确的疾病")
+        return DiagnosisMatch(True, 0.7, "提到了正确的疾病，但没有明确的诊断表述")
+
+    def decide(self, message, diagnosis):
+        """
+        能确定诊断不正确时返回匹配结果，否则返回None，表示需要交给LLM裁判
+
+        规则认为诊断正确时也返回None：只有LLM裁判能结束游戏
+        """
+        result = self.match(message, diagnosis)
+        decided = not result.correct and result.confidence >= self.threshold
+        with self._lock:
+            if decided:
+                self.negatives += 1
+            else:
+                self.deferred += 1
+                if result.correct:
+                    self.positives += 1
+        return result if decided else None
+
+    def stats(self):
+        """本地判断的统计数据"""
+        with self._lock:
+            total = self.negatives + self.deferred
+            return {
+                "negatives": self.negatives,
+                "positives": self.positives,
+                "deferred": self.deferred,
+                "llm_calls_avoided_rate": self.negatives / total if total else 0.0
+            }
+
+    @staticmethod
+    def _negated(clause, start):
+        """疾病名称之前的同一分句中是否有否定的表述"""
+        return bool(NEGATIONS.search(clause[:start]))
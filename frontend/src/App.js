@@ -97,6 +97,8 @@ function App() {
   });
 
   const chatContainerRef = useRef(null);
+  // 服务器上的消息数量（最近一次成功响应中的message_count），不包括先添加到UI的消息
+  const serverMessageCount = useRef(0);
 
   // 获取游戏配置
   useEffect(() => {
@@ -122,6 +124,7 @@ function App() {
 
       setGameId(response.data.game_id);
       setMessages(response.data.messages);
+      serverMessageCount.current = response.data.messages.length;
       // 确保current_sender存在，否则默认为doctor
       setCurrentSender(response.data.current_sender || "doctor");
       setGameOver(response.data.game_over);
@@ -143,6 +146,9 @@ function App() {
       setIsLoading(true);
       setError("");
 
+      // 已有的服务器消息数量，服务器只返回之后的新消息
+      const since = serverMessageCount.current;
+
       // 先添加消息到UI，优化体验
       setMessages((prevMessages) => [
         ...prevMessages,
@@ -155,10 +161,17 @@ function App() {
       const response = await api.post("/api/send_message", {
         game_id: gameId,
         message: message,
+        since: since,
       });
 
-      // 更新状态
-      setMessages(response.data.messages);
+      // 更新状态：用新消息替换message_offset之后的内容（包括先添加的医生消息）
+      const offset = response.data.message_offset ?? 0;
+      setMessages((prevMessages) => [
+        ...prevMessages.slice(0, offset),
+        ...response.data.messages,
+      ]);
+      serverMessageCount.current =
+        response.data.message_count ?? offset + response.data.messages.length;
       // 确保current_sender存在，否则默认为doctor
       setCurrentSender(response.data.current_sender || "doctor");
       setGameOver(response.data.game_over);
@@ -167,6 +180,11 @@ function App() {
         setDiagnosis(response.data.diagnosis);
       }
     } catch (err) {
+      // 移除先添加的医生消息，恢复为服务器上的消息
+      setMessages((prevMessages) =>
+        prevMessages.slice(0, serverMessageCount.current)
+      );
+      setCurrentSender("doctor");
       setError("发送消息失败，请重试！");
       console.error("发送消息失败:", err);
     } finally {
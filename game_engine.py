@@ -1,10 +1,14 @@
 import os
+import asyncio
+import threading
+from collections import deque
 from datetime import datetime
-from typing import Dict, List, Any, Optional, TypedDict, Literal
+from typing import Dict
 import hashlib
+import json
+import glob
 
 from langchain.prompts import PromptTemplate
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -12,143 +16,323 @@ load_dotenv(override=True)
 
 # 导入配置
 from config import GAME_CONFIG
-
-# 定义状态类型
-class GameState(TypedDict):
-    messages: List[Dict[str, Any]]  # 对话历史
-    current_sender: Literal["patient", "body", "doctor", "system"]  # 当前消息发送者
-    diagnosis: Optional[str]  # 正确的诊断
-    game_over: bool  # 游戏是否结束
-    turn_count: int  # 对话轮数计数
-
-# 创建OpenAI客户端
-client = OpenAI(
+from api_log_store import append_api_log, get_log_sink
+from symptom_cache import SymptomCache
+from llm_cache import LLMResponseCache, create_response_cache
+from sanitizer import INQUIRY_CONTENT_PATTERN, strip_inquiry, extract_inquiry, sanitize_history
+from prompt_history import PromptHistoryCache
+from game_state import GameState
+from context_window import ContextManager, estimate_tokens
+from diagnosis_matcher import DiagnosisMatcher
+from referee_verdict import VerdictParser, DIAGNOSIS_SCHEMA, FORMAT_SCHEMA, BATCH_SCHEMA
+from referee_batch import RefereeBatcher
+from llm_transport import create_async_client, RetryPolicy, GameDeadlines, LLMTransport, LLMDeadlineExceeded
+from llm_scheduler import LLMScheduler
+from singleflight import SingleFlight
+
+# 创建OpenAI异步客户端，所有LLM调用都在引擎事件循环中共用这个客户端的连接池
+async_client = create_async_client(
     base_url=os.getenv("API_BASE_URL"),
     api_key=os.getenv("API_KEY"),
+    max_connections=GAME_CONFIG["llm_transport"]["max_connections"],
+    max_keepalive_connections=GAME_CONFIG["llm_transport"]["max_keepalive_connections"],
+    keepalive_expiry=GAME_CONFIG["llm_transport"]["keepalive_expiry"],
+    connect_timeout=GAME_CONFIG["llm_transport"]["connect_timeout"],
+    read_timeout=GAME_CONFIG["llm_transport"]["read_timeout"],
+    write_timeout=GAME_CONFIG["llm_transport"]["write_timeout"],
+    pool_timeout=GAME_CONFIG["llm_transport"]["pool_timeout"]
+)
+
+# LLM调用的重试策略和每个回合的时间预算
+llm_transport = LLMTransport(
+    retry_policy=RetryPolicy(
+        max_retries=GAME_CONFIG["llm_transport"]["max_retries"],
+        backoff_base=GAME_CONFIG["llm_transport"]["backoff_base"],
+        backoff_max=GAME_CONFIG["llm_transport"]["backoff_max"]
+    ),
+    deadlines=GameDeadlines(budget_seconds=GAME_CONFIG["llm_transport"]["turn_budget_seconds"])
+)
+
+# LLM调用的并发上限和优先级排队
+llm_scheduler = LLMScheduler(
+    max_concurrency=GAME_CONFIG["llm_scheduler"]["max_concurrency"],
+    background_window_seconds=GAME_CONFIG["llm_scheduler"]["background_window_ms"] / 1000
 )
 
-# 自定义LLM函数，使用OpenAI客户端
-def invoke_llm(prompt, system_message="你是一个AI助手", game_id=None):
+# 合并同时进行的相同LLM调用（按缓存键），可以在任何线程和事件循环中使用
+llm_singleflight = SingleFlight()
+
+# 按疾病缓存的初始症状变体，跨游戏复用
+initial_symptoms_cache = SymptomCache(
+    variants_per_disease=GAME_CONFIG["initial_symptoms_cache"]["variants_per_disease"],
+    ttl_seconds=GAME_CONFIG["initial_symptoms_cache"]["ttl_seconds"],
+    max_diseases=GAME_CONFIG["initial_symptoms_cache"]["max_diseases"],
+    persist_path=GAME_CONFIG["initial_symptoms_cache"]["persist_path"] or None
+)
+
+# LLM响应缓存
+llm_response_cache = create_response_cache(
+    backend=GAME_CONFIG["llm_cache"]["backend"],
+    path=GAME_CONFIG["llm_cache"]["path"],
+    max_entries=GAME_CONFIG["llm_cache"]["max_entries"],
+    max_bytes=GAME_CONFIG["llm_cache"]["max_bytes"],
+    ttl_seconds=GAME_CONFIG["llm_cache"]["ttl_seconds"]
+)
+
+# 最近的API调用记录（文本形式，只保留最近的若干条）
+recent_api_calls = deque(maxlen=200)
+
+# 引擎事件循环，在后台线程中运行
+_engine_loop = None
+_engine_thread = None
+_engine_lock = threading.Lock()
+
+def get_engine_loop():
+    """获取引擎事件循环，首次调用时在后台线程中启动"""
+    global _engine_loop, _engine_thread
+    if _engine_loop is None:
+        with _engine_lock:
+            if _engine_loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="game-engine-loop", daemon=True)
+                thread.start()
+                _engine_thread = thread
+                _engine_loop = loop
+    return _engine_loop
+
+def run_sync(coro):
+    """
+    在引擎事件循环中执行协程并阻塞等待结果，供同步接口使用
+
+    Args:
+        coro: 要执行的协程
+
+    Returns:
+        协程的返回值
+    """
+    loop = get_engine_loop()
+    if threading.current_thread() is _engine_thread:
+        coro.close()
+        raise RuntimeError("不能在引擎事件循环中调用同步接口，请改用对应的异步函数")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+async def run_in_engine(coro):
+    """
+    在任意事件循环中等待引擎事件循环执行协程
+    异步客户端的连接绑定在引擎事件循环上，其他事件循环（如Flask异步视图、ASGI服务器）
+    需要通过这个函数调用引擎
+
+    Args:
+        coro: 要执行的协程
+
+    Returns:
+        协程的返回值
+    """
+    loop = get_engine_loop()
+    if asyncio.get_running_loop() is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+def invoke_llm(prompt, system_message="你是一个AI助手", game_id=None, use_cache=True, fallback=None,
+               response_format=None, call_type=None):
+    """调用LLM API并记录日志（同步接口），参数与返回值同ainvoke_llm"""
+    return run_sync(ainvoke_llm(prompt, system_message, game_id, use_cache=use_cache, fallback=fallback,
+                                response_format=response_format, call_type=call_type))
+
+# 自定义LLM函数，使用OpenAI异步客户端
+async def ainvoke_llm(prompt, system_message="你是一个AI助手", game_id=None, on_token=None, use_cache=True,
+                      fallback=None, response_format=None, call_type=None, log_game_ids=None):
     """
     调用LLM API并记录日志
 
     Args:
         prompt: 用户消息
         system_message: 系统消息
-        game_id: 游戏ID，用于关联API调用日志到特定游戏
+        game_id: 游戏ID，用于关联API调用日志到特定游戏，游戏回合的时间预算也按游戏ID查找
+        on_token: 可选的回调函数，提供时以流式方式调用API，每收到一段回复内容就调用一次
+        use_cache: 是否使用响应缓存。裁判判断等确定性的调用可以缓存，病人对话等需要多样性的调用应传False
+        fallback: 回合的时间预算用完时返回的兜底回复，为None时抛出LLMDeadlineExceeded
+        response_format: 可选的结构化输出格式（如{"type": "json_schema", ...}），原样传给API
+        call_type: 调用类型（patient、body、referee、summary），并发调用达到上限时决定排队的优先级
+        log_game_ids: 记录API调用日志的游戏ID列表（合并了多个游戏的批量裁判），为空时记录到game_id
 
     Returns:
         API响应内容
     """
-    import json
-    import threading
-
-    # 确保api_logs文件夹存在
-    os.makedirs("api_logs", exist_ok=True)
+    model = os.getenv("MODEL_ID")
 
-    # 生成调用ID用于追踪请求
-    call_id = hashlib.md5((prompt + system_message).encode()).hexdigest()[:8]
+    # 生成调用ID用于追踪请求，同时作为缓存键
+    call_id = LLMResponseCache.make_key(model, system_message, prompt)
 
     # 记录API调用请求
     api_call_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     api_call_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    api_log = f"[{api_call_time}] API请求 ID:{call_id}\n系统消息: {system_message}\n用户消息: {prompt}\n"
-
-    # 检查是否已经有相同的调用（防止重复请求）
-    if "api_logs_ids" not in globals():
-        globals()["api_logs_ids"] = set()
 
     # 使用缓存避免重复API调用
-    if "api_response_cache" not in globals():
-        globals()["api_response_cache"] = {}
-
-    # 如果相同的请求已经发过，则使用缓存的结果
-    is_duplicate = False
-    if call_id in globals()["api_logs_ids"]:
-        api_log = f"[{api_call_time}] ‼️ 重复API请求 ID:{call_id}\n系统消息: {system_message}\n用户消息: {prompt}\n"
-        print(f"警告：检测到重复API调用 ID:{call_id}，使用缓存结果")
-        is_duplicate = True
-
-        # 如果有缓存的响应，直接使用
-        if call_id in globals()["api_response_cache"]:
-            response_content = globals()["api_response_cache"][call_id]
-            print(f"使用缓存的API响应: {call_id}")
-
-            # 记录API返回结果（从缓存）
-            api_log += f"API返回(缓存): {response_content}\n{'='*50}\n"
-
-            # 将API调用记录添加到全局日志
-            if "api_logs" not in globals():
-                globals()["api_logs"] = []
-            globals()["api_logs"].append(api_log)
-
-            # 创建详细的API调用日志数据
-            log_data = {
-                "timestamp": api_call_time,
-                "call_id": call_id,
-                "is_duplicate": is_duplicate,
-                "input": {
-                    "system_message": system_message,
-                    "user_message": prompt
-                },
-                "output": response_content,
-                "model": os.getenv("MODEL_ID", "未指定模型"),
-                "from_cache": True
-            }
-
-            # 保存日志到文件
-            save_api_log(log_data, game_id, call_id, api_call_timestamp)
-
-            return response_content
-
-    # 将调用ID添加到已调用集合
-    globals()["api_logs_ids"].add(call_id)
+    response_content = llm_response_cache.get(call_id) if use_cache else None
+    from_cache = response_content is not None
+    used_fallback = False
+    coalesced = False
+
+    if from_cache:
+        api_log = f"[{api_call_time}] ‼️ 重复API请求 ID:{call_id[:8]}\n系统消息: {system_message}\n用户消息: {prompt}\n"
+        print(f"使用缓存的API响应: {call_id[:8]}")
+        if on_token:
+            on_token(response_content)
+    else:
+        api_log = f"[{api_call_time}] API请求 ID:{call_id[:8]}\n系统消息: {system_message}\n用户消息: {prompt}\n"
 
-    # 调用API
-    response = client.chat.completions.create(
-        model=os.getenv("MODEL_ID"),
-        messages=[
+        chat_messages = [
             {"role": "system", "content": system_message},
             {"role": "user", "content": prompt}
         ]
-    )
-
-    # 获取回复内容
-    response_content = response.choices[0].message.content
+        options = {"response_format": response_format} if response_format else {}
+        chunks = []
+
+        async def request_stream():
+            # 流式调用，边接收边回调
+            stream = await async_client.chat.completions.create(model=model, messages=chat_messages, stream=True,
+                                                                **options)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    chunks.append(delta)
+                    on_token(delta)
+            return "".join(chunks)
+
+        async def request():
+            response = await async_client.chat.completions.create(model=model, messages=chat_messages, **options)
+            # 获取回复内容
+            return response.choices[0].message.content
+
+        # 调用API，临时性错误按退避策略重试；流式回复已经输出部分内容后不再重试
+        # 每次请求都经过调度器排队，退避等待时不占用并发位置
+        async def call():
+            if on_token:
+                return await llm_transport.call(lambda: llm_scheduler.run(request_stream, call_type), game_id,
+                                                can_retry=lambda: not chunks)
+            return await llm_transport.call(lambda: llm_scheduler.run(request, call_type), game_id)
+
+        async def cached_call():
+            # 成为第一个调用方之前，其他调用方可能刚好完成并写入了缓存
+            content = llm_response_cache.get(call_id)
+            if content is None:
+                content = await call()
+                # 在移除正在进行的记录之前写入缓存，之后到达的调用方直接使用缓存
+                llm_response_cache.set(call_id, content)
+            return content
+
+        async def coalesced_call():
+            # 相同的调用正在进行时等待它的结果，不重复调用API；调用失败时所有等待者都收到异常。
+            # 每个调用方只等待自己游戏回合剩余的预算，第一个调用方的预算用完时等待者用自己的预算重新调用
+            try:
+                return await llm_singleflight.do(call_id, cached_call, timeout=llm_transport.deadlines.remaining(game_id),
+                                                 retry_on=LLMDeadlineExceeded)
+            except asyncio.TimeoutError:
+                raise LLMDeadlineExceeded(f"等待相同调用的结果时游戏回合的时间预算已用完: {game_id}") from None
+
+        try:
+            if use_cache and not on_token:
+                response_content, coalesced = await coalesced_call()
+            else:
+                response_content = await call()
+        except LLMDeadlineExceeded:
+            if fallback is None:
+                raise
+            llm_transport.record_fallback()
+            used_fallback = True
+            print(f"LLM调用超出回合的时间预算，使用兜底回复: {call_id[:8]}")
+            if chunks:
+                # 已经输出的部分回复比兜底回复更连贯
+                response_content = "".join(chunks)
+            else:
+                response_content = fallback
+                if on_token and fallback:
+                    on_token(fallback)
 
-    # 缓存响应
-    globals()["api_response_cache"][call_id] = response_content
+        # 缓存流式调用的响应（非流式调用已在cached_call中缓存，兜底回复不缓存）
+        if use_cache and on_token and not used_fallback:
+            llm_response_cache.set(call_id, response_content)
 
     # 记录API返回结果
-    api_log += f"API返回: {response_content}\n{'='*50}\n"
+    api_log += f"API返回{'(缓存)' if from_cache else '(兜底)' if used_fallback else '(合并)' if coalesced else ''}: {response_content}\n{'='*50}\n"
 
-    # 将API调用记录添加到全局日志
-    if "api_logs" not in globals():
-        globals()["api_logs"] = []
-    globals()["api_logs"].append(api_log)
+    # 将API调用记录添加到最近调用记录
+    recent_api_calls.append(api_log)
 
     # 创建详细的API调用日志数据
     log_data = {
         "timestamp": api_call_time,
         "call_id": call_id,
-        "is_duplicate": is_duplicate,
+        "is_duplicate": from_cache,
         "input": {
             "system_message": system_message,
             "user_message": prompt
         },
         "output": response_content,
-        "model": os.getenv("MODEL_ID", "未指定模型"),
-        "from_cache": False  # 标记这是一个新的API调用，不是从缓存获取的
+        "model": model or "未指定模型",
+        "from_cache": from_cache,  # 标记是否从缓存获取
+        "coalesced": coalesced,  # 标记是否合并到了同时进行的相同调用
+        "fallback": used_fallback  # 标记是否因回合预算用完使用了兜底回复
     }
 
-    # 保存日志到文件
-    save_api_log(log_data, game_id, call_id, api_call_timestamp)
+    # 保存日志到文件，合并了多个游戏的调用记录到每个游戏的日志中
+    for log_game_id in log_game_ids or [game_id]:
+        save_api_log(log_data, log_game_id, call_id, api_call_timestamp)
 
     return response_content
 
+# 游戏ID到API日志文件名的字典，游戏从游戏状态存储中淘汰时删除
+game_log_files = {}
+
+# 按游戏增量格式化的对话历史，每轮只格式化新增的消息
+prompt_histories = PromptHistoryCache(max_games=GAME_CONFIG["game_store"]["max_games"])
+
+async def asummarize_history(game_id, previous_summary, formatted_messages):
+    """把较早的对话合并进摘要，供上下文管理使用"""
+    prompt = f"""
+以下是一场问诊对话中较早的部分，请把它们合并进已有的摘要。
+
+已有的摘要:
+{previous_summary or "（无）"}
+
+需要合并的对话:
+{formatted_messages}
+
+请用不超过200字概括：病人已经描述过的症状和感受、医生已经问过的问题和给出的判断。
+只输出摘要内容，不要猜测疾病名称。
+"""
+    return await ainvoke_llm(prompt, "你是一个负责整理问诊记录的助手，摘要简洁、客观。", game_id, call_type="summary")
+
+# 本地的诊断匹配，能确定结果的医生消息不再调用LLM裁判
+diagnosis_matcher = DiagnosisMatcher(
+    GAME_CONFIG["diseases"],
+    threshold=GAME_CONFIG["diagnosis_matcher"]["confidence_threshold"]
+)
+
+# 裁判结论的解析，统计按JSON和按文本匹配解析的次数
+referee_parser = VerdictParser()
+
+# 长对话的上下文管理：最近的消息保留原文，更早的对话用摘要代替
+context_manager = ContextManager(
+    prompt_histories,
+    asummarize_history,
+    window_messages=GAME_CONFIG["context"]["window_messages"],
+    summary_interval_turns=GAME_CONFIG["context"]["summary_interval_turns"],
+    max_history_tokens=GAME_CONFIG["context"]["max_history_tokens"],
+    max_games=GAME_CONFIG["game_store"]["max_games"]
+)
+
+def release_game(game_id):
+    """游戏淘汰后释放按游戏保存的日志文件名、格式化的对话历史和摘要，之后如有新日志会重新查找文件"""
+    game_log_files.pop(game_id, None)
+    prompt_histories.release(game_id)
+    context_manager.release(game_id)
+
 def save_api_log(log_data, game_id=None, call_id=None, timestamp=None):
     """
     保存API调用日志到文件
+    开启异步日志时只把记录放入后台写入队列，由写入线程批量写盘
 
     Args:
         log_data: 日志数据
@@ -156,10 +340,6 @@ def save_api_log(log_data, game_id=None, call_id=None, timestamp=None):
         call_id: 调用ID
         timestamp: 时间戳
     """
-    import json
-    import threading
-    import glob
-
     # 确保api_logs文件夹存在
     os.makedirs("api_logs", exist_ok=True)
 
@@ -167,73 +347,56 @@ def save_api_log(log_data, game_id=None, call_id=None, timestamp=None):
     if not call_id:
         call_id = hashlib.md5(str(log_data).encode()).hexdigest()[:8]
 
-    # 使用线程锁防止并发写入冲突
-    lock = threading.Lock()
-
-    with lock:
-        if game_id:
-            # 存储游戏会话日志文件名的全局字典
-            if "game_log_files" not in globals():
-                globals()["game_log_files"] = {}
+    if game_id:
+        # 检查是否已经有该游戏ID的日志文件
+        if game_id in game_log_files:
+            # 使用已存在的日志文件
+            log_file = game_log_files[game_id]
+        else:
+            # 查找是否已经存在该游戏ID的日志文件
+            existing_files = glob.glob(f"api_logs/api_calls_*_{game_id}.jsonl")
 
-            # 检查是否已经有该游戏ID的日志文件
-            if game_id in globals()["game_log_files"]:
-                # 使用已存在的日志文件
-                log_file = globals()["game_log_files"][game_id]
+            if existing_files:
+                # 如果找到现有文件，使用第一个找到的文件
+                log_file = existing_files[0]
             else:
-                # 查找是否已经存在该游戏ID的日志文件
-                existing_files = glob.glob(f"api_logs/api_calls_*_{game_id}.json")
-
-                if existing_files:
-                    # 如果找到现有文件，使用第一个找到的文件
-                    log_file = existing_files[0]
-                else:
-                    # 如果没有提供时间戳，生成一个新的
-                    if not timestamp:
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-                    # 创建新的日志文件名
-                    log_file = f"api_logs/api_calls_{timestamp}_{game_id}.json"
+                # 如果没有提供时间戳，生成一个新的
+                if not timestamp:
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-                # 保存到全局字典中
-                globals()["game_log_files"][game_id] = log_file
+                # 创建新的日志文件名（JSONL格式，每次调用追加一行）
+                log_file = f"api_logs/api_calls_{timestamp}_{game_id}.jsonl"
 
-            try:
-                # 读取现有日志（如果存在）
-                if os.path.exists(log_file):
-                    with open(log_file, "r", encoding="utf-8") as f:
-                        try:
-                            logs = json.load(f)
-                            if not isinstance(logs, list):
-                                logs = [logs]  # 确保logs是一个列表
-                        except json.JSONDecodeError:
-                            # 如果文件为空或格式不正确，创建新的日志列表
-                            logs = []
-                else:
-                    logs = []
+            # 保存到全局字典中
+            game_log_files[game_id] = log_file
 
-                # 添加新的日志
-                logs.append(log_data)
+        if GAME_CONFIG["api_log"]["async"]:
+            # 交给后台写入线程，请求中不再等待文件写入
+            get_log_sink().submit(log_file, log_data)
+            return
 
-                # 写入更新后的日志
-                with open(log_file, "w", encoding="utf-8") as f:
-                    json.dump(logs, f, ensure_ascii=False, indent=2)
+        try:
+            # 只追加新的日志记录，不再读取和重写整个文件
+            append_api_log(log_file, log_data)
 
-            except Exception as e:
-                print(f"保存游戏API日志时出错: {e}")
-                # 如果保存失败，回退到使用调用ID的文件名
-                if not timestamp:
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                fallback_file = f"api_logs/api_call_{timestamp}_{call_id}.json"
-                with open(fallback_file, "w", encoding="utf-8") as f:
-                    json.dump(log_data, f, ensure_ascii=False, indent=2)
-        else:
-            # 如果没有提供游戏ID，保存为单独的日志文件
+        except Exception as e:
+            print(f"保存游戏API日志时出错: {e}")
+            # 如果保存失败，回退到使用调用ID的文件名
             if not timestamp:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            log_file = f"api_logs/api_call_{timestamp}_{call_id}.json"
-            with open(log_file, "w", encoding="utf-8") as f:
+            fallback_file = f"api_logs/api_call_{timestamp}_{call_id}.json"
+            with open(fallback_file, "w", encoding="utf-8") as f:
                 json.dump(log_data, f, ensure_ascii=False, indent=2)
+    else:
+        # 如果没有提供游戏ID，保存为单独的日志文件
+        if not timestamp:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        log_file = f"api_logs/api_call_{timestamp}_{call_id}.json"
+        if GAME_CONFIG["api_log"]["async"]:
+            get_log_sink().submit(log_file, log_data)
+            return
+        with open(log_file, "w", encoding="utf-8") as f:
+            json.dump(log_data, f, ensure_ascii=False, indent=2)
 
 # 病人角色
 patient_prompt = PromptTemplate.from_template("""
@@ -263,6 +426,28 @@ system_prompt = PromptTemplate.from_template("""
 诊断正确: 是/否
 """)
 
+# 系统角色（要求输出JSON）
+system_json_prompt = PromptTemplate.from_template("""
+当前消息: {current_message}
+发送者: {sender}
+
+请检查这条病人消息是否符合格式要求（正确的诊断是：{diagnosis}，病人不能透露疾病名称）。
+
+请只输出JSON：符合要求时输出{{"valid": true}}，否则输出{{"valid": false}}。
+""")
+
+def _referee_request(schema):
+    """
+    按配置决定裁判的输出方式
+
+    Returns:
+        (提示中是否要求输出JSON, 调用API时的response_format，不需要时为None)
+    """
+    mode = GAME_CONFIG["referee"]["output"]
+    if mode == "json_schema":
+        return True, {"type": "json_schema", "json_schema": schema}
+    return mode == "prompt", None
+
 # 病人角色提示系统消息
 PATIENT_SYSTEM_MESSAGE = """
 你是一位去医院就诊的病人。你不知道自己得了什么病，但你能感受到身体的症状。
@@ -311,10 +496,248 @@ SYSTEM_REFEREE_MESSAGE = """
 - 医生说出完全不同的疾病名称
 """
 
+# 批量裁判（消息按编号排列，要求按编号输出JSON）
+BATCH_REFEREE_PROMPT = """
+下面是问诊游戏中的{count}条消息，请逐条判断：
+- 发送者为医生时，判断医生是否明确说出了正确的疾病名称。只列举可能性、使用模糊的描述或说出其他疾病都不算正确
+- 发送者为病人时，检查消息是否符合格式要求：不能透露疾病名称，不能包含[询问身体]等特殊格式
+
+{items}
+
+请只输出JSON：{{"verdicts": [{{"index": 编号, "ok": true或false}}, ...]}}，每条消息一项。
+医生消息的ok表示诊断正确，病人消息的ok表示符合要求。
+"""
+
+_BATCH_SENDER_NAMES = {"doctor": "医生", "patient": "病人"}
+
+async def ajudge_diagnosis(message, diagnosis, game_id=None):
+    """
+    LLM裁判判断医生的一条消息是否正确诊断出了疾病
+
+    Returns:
+        (诊断是否正确, 裁判的回复)
+    """
+    # 构建特殊提示来检查诊断是否正确
+    use_json, response_format = _referee_request(DIAGNOSIS_SCHEMA)
+    answer_format = ('请只输出JSON：诊断正确时输出{"correct": true}，否则输出{"correct": false}。' if use_json
+                     else '请输出"诊断正确: 是/否"。')
+    diagnosis_prompt = f"""
+医生的消息: "{message}"
+正确的诊断: "{diagnosis}"
+
+医生是否正确诊断出了疾病？请分析医生的回复是否明确指出了正确的疾病名称。
+只有当医生明确指出正确疾病名称时才算正确，如果医生提到了错误的疾病，一定是不正确的。
+{answer_format}
+"""
+    # 回合预算用完时无法判断，按"存在疑问时默认为诊断不正确"处理，医生可以再次给出诊断
+    diagnosis_result = await ainvoke_llm(diagnosis_prompt, "你是医学诊断评估专家，判断医生的诊断是否与标准诊断匹配。", game_id,
+                                         fallback="诊断正确: 否", response_format=response_format, call_type="referee")
+
+    # 解析诊断结果：优先按JSON解析，不是JSON时退回文本匹配
+    return referee_parser.diagnosis(diagnosis_result), diagnosis_result
+
+async def ajudge_format(message, diagnosis, game_id=None):
+    """
+    LLM裁判检查病人的一条消息是否符合格式要求
+
+    Returns:
+        (是否符合要求, 裁判的回复)
+    """
+    # 构建提示
+    use_json, response_format = _referee_request(FORMAT_SCHEMA)
+    prompt = (system_json_prompt if use_json else system_prompt).format(
+        current_message=message,
+        sender="patient",
+        diagnosis=diagnosis
+    )
+
+    # 获取系统判断
+    # 回合预算用完时跳过检查，与关闭格式检查时相同
+    system_response = await ainvoke_llm(prompt, SYSTEM_REFEREE_MESSAGE + f"\n正确的诊断是：{diagnosis}", game_id,
+                                        fallback="符合要求: 是", response_format=response_format, call_type="referee")
+
+    # 解析系统回复：优先按JSON解析，不是JSON时退回文本匹配
+    return referee_parser.format(system_response), system_response
+
+def _batch_line(index, item):
+    """批量裁判提示中的一条消息"""
+    message, sender, diagnosis = item
+    return (f"[{index}] 发送者: {_BATCH_SENDER_NAMES[sender]} | 正确的诊断: {diagnosis} | "
+            f"消息: {json.dumps(message, ensure_ascii=False)}")
+
+def _pack_batches(items, indices, max_tokens, max_items):
+    """
+    按token预算把待判断的消息分批，超过预算的单条消息单独成为一批
+
+    Returns:
+        [[消息在items中的下标]]
+    """
+    batches, current, tokens = [], [], 0
+    for i in indices:
+        cost = estimate_tokens(_batch_line(len(current), items[i]))
+        if current and (tokens + cost > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+async def _ajudge_chunk(items, game_ids):
+    """
+    在一次LLM调用中判断一批消息
+
+    Returns:
+        每项为(结论, 裁判对这条消息的回复)，回复中缺少结论的项为None
+    """
+    lines = "\n".join(_batch_line(n, item) for n, item in enumerate(items))
+    response_format = {"type": "json_schema", "json_schema": BATCH_SCHEMA} if GAME_CONFIG["referee"]["output"] == "json_schema" else None
+    # 都属于同一个游戏时按这个游戏的回合预算调用；合并了多个游戏时不设预算，由各个等待者按自己的预算等待，
+    # 日志记录到每个游戏中
+    owners = list(dict.fromkeys(game_id for game_id in game_ids if game_id))
+    game_id = owners[0] if len(owners) == 1 and None not in game_ids else None
+    # 回合预算用完时返回空回复，所有消息都会逐条重新判断（逐条判断有各自的默认结论）
+    result = await ainvoke_llm(BATCH_REFEREE_PROMPT.format(count=len(items), items=lines), SYSTEM_REFEREE_MESSAGE, game_id,
+                               fallback="", response_format=response_format, call_type="referee", log_game_ids=owners)
+    return [None if entry is None else (entry["ok"], json.dumps(entry, ensure_ascii=False))
+            for entry in referee_parser.batch(result, len(items))]
+
+async def ajudge_batch_responses(items, game_ids=None):
+    """
+    批量裁判，同时返回裁判对每条消息的回复
+
+    Args:
+        items: [(消息, 发送者, 正确的诊断)]，发送者为"doctor"或"patient"
+        game_ids: 与items一一对应的游戏ID列表，用于记录日志和回合预算；为None时都不属于任何游戏
+
+    Returns:
+        与items一一对应的(结论, 裁判的回复)列表，结论见ajudge_batch
+    """
+    game_ids = list(game_ids) if game_ids is not None else [None] * len(items)
+    results = [None] * len(items)
+    pending = []
+    for i, (message, sender, diagnosis) in enumerate(items):
+        if sender not in _BATCH_SENDER_NAMES:
+            raise ValueError(f"批量裁判不支持的发送者: {sender}")
+        if sender == "doctor" and GAME_CONFIG["diagnosis_matcher"]["enabled"]:
+            local_match = diagnosis_matcher.decide(message, diagnosis)
+            if local_match is not None:
+                results[i] = (local_match.correct,
+                              f"规则判断诊断不正确: {local_match.reason}（置信度{local_match.confidence:.2f}）")
+                continue
+        pending.append(i)
+
+    config = GAME_CONFIG["referee"]
+    batches = _pack_batches(items, pending, config["batch_max_tokens"], config["batch_max_items"])
+    chunks = await asyncio.gather(*(_ajudge_chunk([items[i] for i in batch], [game_ids[i] for i in batch])
+                                    for batch in batches))
+    for batch, chunk in zip(batches, chunks):
+        for i, result in zip(batch, chunk):
+            results[i] = result
+
+    async def judge_one(item, game_id):
+        message, sender, diagnosis = item
+        if sender == "doctor":
+            return await ajudge_diagnosis(message, diagnosis, game_id)
+        return await ajudge_format(message, diagnosis, game_id)
+
+    missing = [i for i in pending if results[i] is None]
+    if missing:
+        for i, result in zip(missing, await asyncio.gather(*(judge_one(items[i], game_ids[i]) for i in missing))):
+            results[i] = result
+    return results
+
+async def ajudge_batch(items, game_id=None):
+    """
+    批量裁判：在一次LLM调用中判断多条消息
+
+    医生消息判断是否正确诊断出了疾病（本地规则能确定的不交给LLM），病人消息检查是否符合格式要求。
+    消息按token预算自动分批，各批并行调用；回复中缺少结论的消息逐条重新判断。
+    批量裁判总是要求输出带编号的JSON，不受REFEREE_OUTPUT=off的影响
+
+    Args:
+        items: [(消息, 发送者, 正确的诊断)]，发送者为"doctor"或"patient"
+        game_id: 游戏ID，用于记录日志和回合预算
+
+    Returns:
+        与items一一对应的结论列表：医生消息为诊断是否正确，病人消息为是否符合要求
+    """
+    return [verdict for verdict, _ in await ajudge_batch_responses(items, [game_id] * len(items))]
+
+def judge_batch(items, game_id=None):
+    """批量裁判的同步版本，见ajudge_batch"""
+    return run_sync(ajudge_batch(items, game_id))
+
+# 高负载时合并各游戏的病人消息格式检查
+referee_batcher = RefereeBatcher(
+    ajudge_batch_responses,
+    min_concurrency=GAME_CONFIG["referee"]["batch_min_concurrency"],
+    window_seconds=GAME_CONFIG["referee"]["batch_window_ms"] / 1000,
+    max_items=GAME_CONFIG["referee"]["batch_max_items"]
+)
+
 # 定义节点函数
+# 节点逻辑以异步函数实现（a开头），同名的同步函数只是在引擎事件循环中执行它们的薄封装
 def patient_node(state: GameState, game_id=None) -> Dict:
-    """病人节点，生成病人回复"""
-    import re
+    """病人节点，生成病人回复（同步接口）"""
+    return run_sync(apatient_node(state, game_id))
+
+def body_node(state: GameState, game_id=None) -> Dict:
+    """身体节点，生成身体感官响应（同步接口）"""
+    return run_sync(abody_node(state, game_id))
+
+def system_node(state: GameState, game_id=None) -> Dict:
+    """系统节点，负责检查消息格式和游戏状态（同步接口）"""
+    return run_sync(asystem_node(state, game_id))
+
+def system_and_patient_node(state: GameState, game_id=None):
+    """推测执行系统判断和病人回复（同步接口）"""
+    return run_sync(asystem_and_patient_node(state, game_id))
+
+def get_initial_symptoms(diagnosis: str, game_id=None) -> str:
+    """获取初始症状信息（同步接口）"""
+    return run_sync(aget_initial_symptoms(diagnosis, game_id))
+
+class _InquiryTokenFilter:
+    """
+    过滤流式病人回复中的询问身体内容
+
+    回复开头可能是"[询问身体:xxx]"，这种回复不能发给医生。
+    开头的内容先缓存，确认不是询问身体后再连同后续内容一起转发
+    """
+
+    MARKER = "[询问身体"
+
+    def __init__(self, on_token):
+        self.on_token = on_token
+        self.buffer = ""
+        self.decided = False
+        self.suppressed = False
+
+    def __call__(self, delta):
+        if self.decided:
+            if not self.suppressed:
+                self.on_token(delta)
+            return
+
+        self.buffer += delta
+        head = self.buffer.lstrip().replace(" ", "")
+        if not head or self.MARKER.startswith(head):
+            # 还无法判断，继续缓存
+            return
+
+        self.decided = True
+        self.suppressed = head.startswith(self.MARKER)
+        if not self.suppressed:
+            self.on_token(self.buffer.lstrip())
+
+async def apatient_node(state: GameState, game_id=None, on_token=None) -> Dict:
+    """
+    病人节点，生成病人回复
+
+    on_token: 可选的回调函数，提供时病人回复以流式方式生成，每段可以展示给医生的内容都会回调
+    """
     messages = state["messages"]
     diagnosis = state.get("diagnosis", "")
 
@@ -334,11 +757,7 @@ def patient_node(state: GameState, game_id=None) -> Dict:
         body_response = last_message["content"]
 
         # 格式化完整的对话历史，排除身体消息
-        formatted_messages = []
-        for msg in messages:
-            if msg["sender"] != "body":
-                formatted_messages.append(f"{msg['sender']}: {msg['content']}")
-        formatted_history = "\n".join(formatted_messages)
+        formatted_history = await context_manager.abuild(game_id, messages, include_body=False)
 
         special_prompt = f"""
 你是一位病人，刚才询问了自己的身体感受，得到了以下反馈:
@@ -361,16 +780,16 @@ def patient_node(state: GameState, game_id=None) -> Dict:
 8. 不要在回复中包含任何[询问身体:xxx]格式的内容
 9. 保持与之前对话的连贯性
 """
-        content = invoke_llm(special_prompt, PATIENT_SYSTEM_MESSAGE, game_id)
+        # 回合预算用完时返回空回复，由下面的默认回复兜底
+        content = await ainvoke_llm(special_prompt, PATIENT_SYSTEM_MESSAGE, game_id, on_token=on_token, use_cache=False,
+                                    fallback="", call_type="patient")
 
         # 确保内容不为空
         if not content.strip():
             content = "医生，我最近感觉身体确实不太舒服，具体症状有点复杂，能否请您详细问诊？"
 
         # 再次检查并清理可能的询问身体内容
-        content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', content)
-        content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', content)
-        content = content.strip()
+        content = strip_inquiry(content)
 
         # 如果清理后内容为空，提供默认回复
         if not content.strip():
@@ -390,7 +809,7 @@ def patient_node(state: GameState, game_id=None) -> Dict:
     # 不再检查医生是否给出诊断，让患者自己判断如何回应
 
     # 构建提示
-    formatted_messages = "\n".join([f"{msg['sender']}: {msg['content']}" for msg in messages])
+    formatted_messages = await context_manager.abuild(game_id, messages)
 
     # 不再添加特殊指令，让患者自己判断如何回应医生
     prompt = patient_prompt.format(messages=formatted_messages)
@@ -398,11 +817,7 @@ def patient_node(state: GameState, game_id=None) -> Dict:
     # 如果是游戏第一次开始，确保病人有一个友好的问候，并基于初始症状
     if len(messages) <= 1:
         # 获取初始症状信息
-        initial_symptoms = get_initial_symptoms(diagnosis, game_id)
-
-        # 记录初始症状到日志（如果有game_id）
-        if game_id and "api_logs" in globals() and game_id in globals()["api_logs"]:
-            globals()["api_logs"][game_id].append(f"初始症状信息:\n{initial_symptoms}")
+        initial_symptoms = await aget_initial_symptoms(diagnosis, game_id)
 
         # 构建包含初始症状的问候提示
         greeting_prompt = f"""
@@ -413,26 +828,26 @@ def patient_node(state: GameState, game_id=None) -> Dict:
 请用1句话友好地向医生问好，并简要描述你的主要症状。不要列出所有症状，只提及最明显的1-2个。
 不要使用[询问身体:xxx]格式。不要直接复制症状列表，要用自然的语言描述。
 """
-        content = invoke_llm(greeting_prompt, PATIENT_SYSTEM_MESSAGE, game_id)
+        content = await ainvoke_llm(greeting_prompt, PATIENT_SYSTEM_MESSAGE, game_id, use_cache=False, fallback="",
+                                    call_type="patient")
     else:
         # 获取病人回复
-        content = invoke_llm(prompt, PATIENT_SYSTEM_MESSAGE, game_id)
+        content = await ainvoke_llm(prompt, PATIENT_SYSTEM_MESSAGE, game_id,
+                                    on_token=_InquiryTokenFilter(on_token) if on_token else None,
+                                    use_cache=False, fallback="", call_type="patient")
 
-    # 确保内容不为空
+    # 确保内容不为空（包括回合预算用完时的空回复）
     if not content.strip():
         content = "医生，我能再详细说明一下我的症状吗？"
 
     # 检查是否需要询问身体 - 使用更严格的格式匹配
     # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-    inquiry_match = re.search(r'\s*\[\s*询问身体\s*[：:]\s*(.*?)\]\s*', content)
+    inquiry_match = INQUIRY_CONTENT_PATTERN.search(content)
 
     # 初始消息不应该直接询问身体
     if len(messages) <= 1 and inquiry_match:
         # 如果是初始消息却包含询问身体，去掉询问部分
-        content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', content)
-        # 匹配旧格式[询问身体]
-        content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', content)
-        content = content.strip()
+        content = strip_inquiry(content)
         new_message = {"sender": "patient", "content": content}
         return {
             "messages": messages + [new_message],
@@ -456,8 +871,8 @@ def patient_node(state: GameState, game_id=None) -> Dict:
             "game_over": False
         }
     else:
-        # 不询问身体，直接进入系统检查
-        new_message = {"sender": "patient", "content": content}
+        # 不询问身体，直接进入系统检查；清理可能残留的标记，系统节点不需要再检查这条消息
+        new_message = {"sender": "patient", "content": strip_inquiry(content)}
         return {
             "messages": messages + [new_message],
             "current_sender": "system",
@@ -465,25 +880,23 @@ def patient_node(state: GameState, game_id=None) -> Dict:
             "game_over": False
         }
 
-def get_initial_symptoms(diagnosis: str, game_id=None) -> str:
+async def aget_initial_symptoms(diagnosis: str, game_id=None) -> str:
     """获取初始症状信息，用于游戏开始时"""
-    # 使用缓存避免重复调用
-    if "initial_symptoms_cache" not in globals():
-        globals()["initial_symptoms_cache"] = {}
-
-    # 生成缓存键
-    cache_key = f"{diagnosis}_{game_id}" if game_id else diagnosis
+    # 每种疾病的变体数量足够后，直接从缓存中随机取用一个
+    cached = initial_symptoms_cache.get(diagnosis)
+    if cached is not None:
+        print(f"使用缓存的初始症状: {diagnosis}")
+        return cached
 
-    # 检查缓存中是否已有结果
-    if cache_key in globals()["initial_symptoms_cache"]:
-        print(f"使用缓存的初始症状: {cache_key}")
-        return globals()["initial_symptoms_cache"][cache_key]
+    # 变体序号写入提示，使同一疾病的多次生成得到不同的症状描述
+    variant = initial_symptoms_cache.variant_count(diagnosis) + 1
 
     # 构建提示
     prompt = f"""
 你代表病人的身体感官系统。病人得了{diagnosis}，但病人不知道自己的疾病名称。
 请提供与{diagnosis}相关的初始症状描述，使用简洁的要点形式。
 这些症状将作为病人的基础感受，帮助病人在游戏开始时能够描述自己的不适。
+这是第{variant}个{diagnosis}病例，症状的侧重点可以与其他病例有所不同。
 请确保症状描述：
 1. 典型且明显，能够引导医生进行诊断
 2. 不要直接透露疾病名称
@@ -491,50 +904,39 @@ def get_initial_symptoms(diagnosis: str, game_id=None) -> str:
 """
 
     # 获取身体回复
-    content = invoke_llm(prompt, BODY_SYSTEM_MESSAGE + f"\n当前病名是：{diagnosis}。请描述初始症状。", game_id)
+    content = await ainvoke_llm(prompt, BODY_SYSTEM_MESSAGE + f"\n当前病名是：{diagnosis}。请描述初始症状。", game_id,
+                                fallback="", call_type="body")
 
     # 确保内容不为空
     if not content.strip():
         content = f"- 与{diagnosis}相关的典型症状\n- 具体表现为常见的不适感"
-
-    # 保存到缓存
-    globals()["initial_symptoms_cache"][cache_key] = content
+    else:
+        # 保存到缓存
+        initial_symptoms_cache.add(diagnosis, content)
 
     return content
 
-def body_node(state: GameState, game_id=None) -> Dict:
+async def abody_node(state: GameState, game_id=None) -> Dict:
     """身体节点，生成身体感官响应"""
-    import re
     messages = state["messages"]
     diagnosis = state.get("diagnosis", "")
 
     # 获取病人的询问 - 使用严格的格式匹配
     patient_message = messages[-1]["content"]
 
-    # 提取方括号内的内容，使用更严格的正则表达式
-    # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-    inquiry_match = re.search(r'\s*\[\s*询问身体\s*[：:]\s*(.*?)\]\s*', patient_message)
-
-    if inquiry_match and inquiry_match.group(1).strip():
-        patient_query = inquiry_match.group(1).strip()
-    else:
-        # 尝试匹配旧格式[询问身体]
-        old_format_match = re.search(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*(.*)', patient_message)
-        if old_format_match and old_format_match.group(1).strip():
-            patient_query = old_format_match.group(1).strip()
-        else:
-            # 如果都没匹配到，使用默认查询
-            patient_query = "我的症状是什么？"
+    # 提取询问内容（支持新旧两种格式），没有匹配到时使用默认查询
+    patient_query = extract_inquiry(patient_message) or "我的症状是什么？"
 
     # 构建提示
-    formatted_messages = "\n".join([f"{msg['sender']}: {msg['content']}" for msg in messages])
+    formatted_messages = await context_manager.abuild(game_id, messages)
     prompt = body_prompt.format(
         messages=formatted_messages,
         diagnosis=diagnosis
     )
 
     # 获取身体回复
-    content = invoke_llm(prompt, BODY_SYSTEM_MESSAGE + f"\n当前病名是：{diagnosis}。针对'{patient_query}'请描述相关的身体感受。", game_id)
+    content = await ainvoke_llm(prompt, BODY_SYSTEM_MESSAGE + f"\n当前病名是：{diagnosis}。针对'{patient_query}'请描述相关的身体感受。", game_id,
+                                use_cache=False, fallback="", call_type="body")
 
     # 确保内容不为空
     if not content.strip():
@@ -550,7 +952,7 @@ def body_node(state: GameState, game_id=None) -> Dict:
         "game_over": False
     }
 
-def system_node(state: GameState, game_id=None) -> Dict:
+async def asystem_node(state: GameState, game_id=None) -> Dict:
     """系统节点，负责检查消息格式和游戏状态"""
     messages = state["messages"]
     diagnosis = state["diagnosis"]
@@ -559,22 +961,8 @@ def system_node(state: GameState, game_id=None) -> Dict:
     if not messages:
         return state
 
-    # 首先清理所有病人消息中的询问身体内容
-    import re
-    for i, msg in enumerate(messages):
-        if msg["sender"] == "patient":
-            content = msg["content"]
-            # 使用更严格的正则表达式清理询问身体格式
-            # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', content)
-            # 匹配旧格式[询问身体]
-            cleaned_content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', cleaned_content)
-            # 去除可能的多余空格
-            cleaned_content = cleaned_content.strip()
-
-            # 只在内容有变化时更新
-            if cleaned_content != content:
-                messages[i]["content"] = cleaned_content
+    # 首先清理本轮病人消息中的询问身体内容（之前已清理过的消息不会重新匹配，只替换需要清理的消息）
+    messages = sanitize_history(messages)
 
     # 获取最新的消息
     current_message = messages[-1]
@@ -593,58 +981,21 @@ def system_node(state: GameState, game_id=None) -> Dict:
         # 根据配置决定是否使用关键词判断或直接使用LLM判断
         should_check_diagnosis = True
 
-        if GAME_CONFIG["use_keyword_diagnosis_check"]:
+        # 先用本地规则判断，能确定诊断不正确时不调用LLM裁判；诊断正确会结束游戏，总是由LLM裁判确认
+        local_match = None
+        if GAME_CONFIG["diagnosis_matcher"]["enabled"]:
+            local_match = diagnosis_matcher.decide(current_message["content"], diagnosis)
+
+        if local_match is not None:
+            should_check_diagnosis = False
+        elif GAME_CONFIG["use_keyword_diagnosis_check"]:
             # 使用关键词判断是否包含诊断相关词语
             message_text = current_message["content"].lower()
             should_check_diagnosis = (diagnosis.lower() in message_text) or any(term in message_text for term in ["诊断", "判断", "认为", "确定", "可能是", "应该是", "我觉得是", "你有", "你患了"])
 
         # 如果需要检查诊断（关键词判断为真或配置为不使用关键词判断）
         if should_check_diagnosis:
-            # 构建特殊提示来检查诊断是否正确
-            diagnosis_prompt = f"""
-医生的消息: "{current_message['content']}"
-正确的诊断: "{diagnosis}"
-
-医生是否正确诊断出了疾病？请分析医生的回复是否明确指出了正确的疾病名称。
-只有当医生明确指出正确疾病名称时才算正确，如果医生提到了错误的疾病，一定是不正确的。
-请输出"诊断正确: 是/否"。
-"""
-            diagnosis_result = invoke_llm(diagnosis_prompt, "你是医学诊断评估专家，判断医生的诊断是否与标准诊断匹配。", game_id)
-
-            # 解析诊断结果 - 使用更鲁棒的方法
-            # 1. 首先尝试精确匹配标准格式
-            is_correct_diagnosis = "诊断正确: 是" in diagnosis_result
-
-            # 2. 如果没有精确匹配，尝试更宽松的匹配
-            if not is_correct_diagnosis:
-                import re
-                # 匹配"诊断正确"或"正确诊断"等相关表述后跟着肯定词
-                correct_patterns = [
-                    r'诊断正确\s*[:：]?\s*(是|正确|对|没错|确实|肯定)',
-                    r'正确诊断\s*[:：]?\s*(是|正确|对|没错|确实|肯定)',
-                    r'诊断(是|正确|对|没错|确实|肯定)(正确|对|没错)',
-                    r'医生(正确|准确)地?诊断',
-                    r'医生的诊断是正确的',
-                    r'诊断结果(正确|准确|符合)',
-                    r'(正确|准确)地?判断出了?疾病'
-                ]
-
-                # 匹配否定表述
-                incorrect_patterns = [
-                    r'诊断正确\s*[:：]?\s*(否|不正确|不对|错误|不准确)',
-                    r'诊断不正确',
-                    r'诊断错误',
-                    r'没有正确诊断',
-                    r'医生没有(正确|准确)诊断',
-                    r'医生的诊断(不正确|不准确|有误|错误)'
-                ]
-
-                # 先检查是否有明确的否定表述
-                has_negative = any(re.search(pattern, diagnosis_result, re.IGNORECASE) for pattern in incorrect_patterns)
-
-                # 如果没有否定表述，再检查是否有肯定表述
-                if not has_negative:
-                    is_correct_diagnosis = any(re.search(pattern, diagnosis_result, re.IGNORECASE) for pattern in correct_patterns)
+            is_correct_diagnosis, diagnosis_result = await ajudge_diagnosis(current_message["content"], diagnosis, game_id)
             if is_correct_diagnosis:
                 return {
                     "messages": messages + [{"sender": "system", "content": f"恭喜！你正确诊断出了病人的疾病：{diagnosis}。"}],
@@ -683,55 +1034,25 @@ def system_node(state: GameState, game_id=None) -> Dict:
 
         # 根据配置决定是否进行LLM检查
         if GAME_CONFIG["check_patient_response"]:
-            # 构建提示
-            formatted_messages = "\n".join([f"{msg['sender']}: {msg['content']}" for msg in messages[:-1]])
-            prompt = system_prompt.format(
-                current_message=current_message["content"],
-                sender=current_message["sender"],
-                diagnosis=diagnosis
-            )
-
-            # 获取系统判断
-            system_response = invoke_llm(prompt, SYSTEM_REFEREE_MESSAGE + f"\n正确的诊断是：{diagnosis}", game_id)
-
-            # 解析系统回复 - 使用更鲁棒的方法
-            # 1. 首先尝试精确匹配标准格式
-            is_reasonable = "符合要求: 是" in system_response
-
-            # 2. 如果没有精确匹配，尝试更宽松的匹配
-            if not is_reasonable:
-                import re
-                # 匹配"符合要求"或"符合规则"或"合理"等相关表述后跟着肯定词
-                reasonable_patterns = [
-                    r'符合要求\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
-                    r'符合规则\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
-                    r'合理性\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
-                    r'(合理|正确|恰当|适当)\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
-                    r'回复(合理|正确|恰当|适当)',
-                    r'没有问题',
-                    r'可以接受'
-                ]
-
-                # 匹配否定表述
-                unreasonable_patterns = [
-                    r'符合要求\s*[:：]?\s*(否|不正确|不合理|不可以|有问题|不通过)',
-                    r'不符合要求',
-                    r'不合理',
-                    r'有问题',
-                    r'不恰当',
-                    r'不适当'
-                ]
-
-                # 先检查是否有明确的否定表述
-                has_negative = any(re.search(pattern, system_response, re.IGNORECASE) for pattern in unreasonable_patterns)
-
-                # 如果没有否定表述，再检查是否有肯定表述
-                if not has_negative:
-                    is_reasonable = any(re.search(pattern, system_response, re.IGNORECASE) for pattern in reasonable_patterns)
+            # 高负载时与其他游戏同时进行的格式检查合并为一次批量裁判
+            with referee_batcher.track():
+                if referee_batcher.busy():
+                    try:
+                        # 只等待这个游戏回合剩余的预算
+                        is_reasonable, system_response = await referee_batcher.submit(
+                            (current_message["content"], "patient", diagnosis), game_id,
+                            timeout=llm_transport.deadlines.remaining(game_id))
+                    except asyncio.TimeoutError:
+                        # 回合预算用完时跳过检查，与逐条检查的兜底相同
+                        llm_transport.record_fallback()
+                        is_reasonable, system_response = True, "符合要求: 是"
+                else:
+                    is_reasonable, system_response = await ajudge_format(current_message["content"], diagnosis, game_id)
 
             if not is_reasonable:
                 # 病人消息不合理，需要重新生成
-                # 创建一个特殊提示来生成更合理的病人回复
+                # 创建一个特殊提示来生成更合理的病人回复，对话历史不包含被判断为不合理的这条消息
+                formatted_messages = await context_manager.abuild(game_id, messages, count=len(messages) - 1)
                 fix_prompt = f"""
 前一条病人消息被系统判断为不合理，系统的回复是:{system_response}
 
@@ -747,19 +1068,15 @@ def system_node(state: GameState, game_id=None) -> Dict:
 6. 确保回复有实际内容，不能为空
 """
                 # 生成修正后的病人回复
-                fixed_content = invoke_llm(fix_prompt, PATIENT_SYSTEM_MESSAGE + "\n请确保生成合理的病人回复，避免之前的问题。", game_id)
+                fixed_content = await ainvoke_llm(fix_prompt, PATIENT_SYSTEM_MESSAGE + "\n请确保生成合理的病人回复，避免之前的问题。", game_id,
+                                                  use_cache=False, fallback="", call_type="patient")
 
                 # 确保内容不为空
                 if not fixed_content.strip():
                     fixed_content = "医生，我想再详细说明一下我的症状，我确实感到不舒服，但很难用专业术语描述。"
 
                 # 再次清理询问身体内容和特殊格式
-                # 匹配[询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号
-                fixed_content = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', fixed_content)
-                # 匹配旧格式[询问身体]
-                fixed_content = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', fixed_content)
-                # 去除可能的多余空格
-                fixed_content = fixed_content.strip()
+                fixed_content = strip_inquiry(fixed_content)
 
                 # 创建修正后的消息，替换原来的消息
                 fixed_message = {"sender": "patient", "content": fixed_content}
@@ -791,4 +1108,43 @@ def system_node(state: GameState, game_id=None) -> Dict:
             }
 
     # 其他情况，直接返回当前状态
-    return state
\ No newline at end of file
+    return state
+
+async def asystem_and_patient_node(state: GameState, game_id=None, on_token=None):
+    """
+    推测执行：系统判断医生消息的同时生成病人回复
+
+    医生消息大多不是正确诊断，这时并行生成的病人回复可以直接使用，省去一次串行的LLM调用；
+    如果系统判定诊断正确或不轮到病人回复，进行中的病人回复会被取消，结果被丢弃
+
+    Args:
+        state: 刚加入医生消息的游戏状态
+        game_id: 游戏ID
+        on_token: 可选的回调函数，用于流式输出病人回复
+
+    Returns:
+        (系统节点返回的状态, 病人节点返回的状态，被丢弃时为None)
+    """
+    # 消息列表和消息都不会被原地修改，病人节点和系统节点可以共享同一个消息列表
+    patient_input = {**state, "current_sender": "patient"}
+
+    system_task = asyncio.create_task(asystem_node(state, game_id))
+    patient_task = asyncio.create_task(apatient_node(patient_input, game_id, on_token=on_token))
+
+    try:
+        system_state = await system_task
+    except BaseException:
+        patient_task.cancel()
+        raise
+
+    if system_state.get("game_over", False) or system_state.get("current_sender") != "patient":
+        patient_task.cancel()
+        try:
+            await patient_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"已丢弃的推测病人回复出错: {e}")
+        return system_state, None
+
+    return system_state, await patient_task
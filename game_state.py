@@ -0,0 +1,113 @@
+"""
+紧凑的游戏状态记录
+游戏状态存储中每个进行中的游戏都保存一份状态，同时进行的游戏很多时每局的固定开销很重要。
+GameState用__slots__保存字段，疾病名称和发送者使用驻留的字符串，消息保存为MessageLog；
+系统笔记(system_notes)只在节点之间传递，不保存在游戏状态中。
+GameState可以按字典的方式读写，与原来的JSON格式互相转换
+"""
+
+import sys
+from collections.abc import Mapping, MutableMapping
+
+from message_log import MessageLog, Message, as_message_log
+
+# 表示字段不存在
+_MISSING = object()
+
+# 只在节点之间传递、不需要保存在游戏状态中的字段
+TRANSIENT_FIELDS = frozenset({"system_notes"})
+
+def _intern(value):
+    """字符串驻留，同名的疾病和发送者在所有游戏之间共享同一个字符串对象"""
+    return sys.intern(value) if type(value) is str else value
+
+class GameState(MutableMapping):
+    """
+    游戏状态：messages、current_sender、diagnosis、game_over、turn_count
+    其他字段保存在额外的字典中，只有用到时才创建
+    """
+
+    __slots__ = ("_messages", "_current_sender", "_diagnosis", "_game_over", "_turn_count", "_extra")
+    # 字段名到保存它的slot
+    _FIELDS = {key: "_" + key for key in ("messages", "current_sender", "diagnosis", "game_over", "turn_count")}
+
+    def __init__(self, data=(), **fields):
+        self._messages = self._current_sender = self._diagnosis = _MISSING
+        self._game_over = self._turn_count = _MISSING
+        self._extra = None
+        for key, value in dict(data, **fields).items():
+            self[key] = value
+
+    @classmethod
+    def from_mapping(cls, state):
+        """从节点返回的状态字典（或JSON格式的字典）创建，丢弃只在节点之间传递的字段"""
+        if isinstance(state, GameState):
+            return state
+        return cls({key: value for key, value in state.items() if key not in TRANSIENT_FIELDS})
+
+    def __getitem__(self, key):
+        if key in self._FIELDS:
+            value = getattr(self, self._FIELDS[key])
+        elif self._extra is not None:
+            value = self._extra.get(key, _MISSING)
+        else:
+            value = _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == "messages":
+            value = as_message_log(value)
+        elif key in ("current_sender", "diagnosis"):
+            value = _intern(value)
+        if key in self._FIELDS:
+            setattr(self, self._FIELDS[key], value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._FIELDS:
+            if getattr(self, self._FIELDS[key]) is _MISSING:
+                raise KeyError(key)
+            setattr(self, self._FIELDS[key], _MISSING)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self._FIELDS:
+            if getattr(self, self._FIELDS[key]) is not _MISSING:
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        count = sum(1 for key in self._FIELDS if getattr(self, self._FIELDS[key]) is not _MISSING)
+        return count + (len(self._extra) if self._extra else 0)
+
+    def __repr__(self):
+        return f"GameState({dict(self)!r})"
+
+    def __reduce__(self):
+        return (GameState, (dict(self),))
+
+    def to_dict(self):
+        """转换为原来的JSON格式"""
+        data = dict(self)
+        if "messages" in data:
+            data["messages"] = data["messages"].to_list()
+        return data
+
+def json_default(value):
+    """json.dumps的default参数：游戏状态、消息列表和消息转换为原来的JSON格式"""
+    if isinstance(value, (GameState, Message)):
+        return value.to_dict()
+    if isinstance(value, MessageLog):
+        return value.to_list()
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"无法序列化 {type(value).__name__}")
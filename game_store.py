@@ -0,0 +1,703 @@
+"""
+游戏状态存储
+按游戏ID保存游戏状态和游戏日志，限制同时保存的游戏数量，并淘汰长时间无人访问的游戏，
+长时间运行的服务器内存占用不再随游戏数量持续增长。
+提供进程内存和SQLite两种后端，SQLite后端让同一台机器上的多个工作进程共享游戏状态
+"""
+
+import os
+import copy
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+from game_state import GameState, json_default
+
+class GameConflictError(Exception):
+    """保存游戏状态时发现游戏已被其他请求修改"""
+
+class GameStore(MutableMapping):
+    """
+    游戏状态存储接口
+
+    以字典方式按游戏ID存取游戏状态（store[game_id] = state），
+    每个游戏另有游戏日志和附加信息（例如对话文件路径），游戏被删除或淘汰时一并清除。
+    子类需要实现字典接口以及下面的方法
+    """
+
+    def load(self, game_id):
+        """
+        读取游戏状态及其版本号
+
+        Returns:
+            (游戏状态, 版本号)，游戏不存在时返回(None, None)
+        """
+        raise NotImplementedError
+
+    def save(self, game_id, state, expected_version=None):
+        """
+        保存游戏状态（乐观锁）
+
+        Args:
+            game_id: 游戏ID
+            state: 游戏状态
+            expected_version: 读取时的版本号，提供时如果游戏已被其他请求修改则抛出GameConflictError
+
+        Returns:
+            保存后的版本号
+        """
+        raise NotImplementedError
+
+    def shared_dict(self, name):
+        """获取与游戏状态保存在一起的字典（用于疾病统计、请求去重等），支持modify原子修改"""
+        raise NotImplementedError
+
+    @property
+    def logs(self):
+        """按游戏ID访问游戏日志列表的字典视图"""
+        return _GameLogs(self)
+
+    def get_logs(self, game_id):
+        """获取游戏日志列表，游戏不存在时返回None"""
+        raise NotImplementedError
+
+    def set_logs(self, game_id, logs):
+        """替换游戏日志列表，游戏不存在时抛出KeyError"""
+        raise NotImplementedError
+
+    def append_log(self, game_id, entry):
+        """追加一条游戏日志，游戏不存在（例如已被淘汰）时忽略"""
+        raise NotImplementedError
+
+    def get_meta(self, game_id, key, default=None):
+        """获取游戏的附加信息"""
+        raise NotImplementedError
+
+    def set_meta(self, game_id, key, value):
+        """设置游戏的附加信息，游戏不存在时忽略"""
+        raise NotImplementedError
+
+    def reap(self):
+        """淘汰过期的游戏，返回淘汰的数量"""
+        raise NotImplementedError
+
+    def stats(self):
+        """存储的统计数据"""
+        raise NotImplementedError
+
+class _GameLogs(MutableMapping):
+    """GameStore中游戏日志的字典视图，兼容原来的 api_logs[game_id] 用法"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, game_id):
+        logs = self._store.get_logs(game_id)
+        if logs is None:
+            raise KeyError(game_id)
+        return logs
+
+    def __setitem__(self, game_id, logs):
+        self._store.set_logs(game_id, list(logs))
+
+    def __delitem__(self, game_id):
+        self._store.set_logs(game_id, [])
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __len__(self):
+        return len(self._store)
+
+class InMemoryGameStore(GameStore):
+    """
+    保存在进程内存中的游戏状态存储
+
+    超过idle_timeout_seconds未被访问的游戏、结束超过finished_ttl_seconds的游戏会被淘汰；
+    游戏数量超过max_games时优先淘汰已结束的游戏，再淘汰最久未访问的游戏。
+    淘汰前调用on_evict(game_id, state, logs, meta)，用于把游戏写入磁盘
+    """
+
+    def __init__(self, max_games=1000, idle_timeout_seconds=1800, finished_ttl_seconds=300,
+                 reap_interval_seconds=60, on_evict=None):
+        """
+        Args:
+            max_games: 最多保存的游戏数量
+            idle_timeout_seconds: 游戏无人访问多久后淘汰（秒）
+            finished_ttl_seconds: 游戏结束后多久淘汰（秒）
+            reap_interval_seconds: 后台清理的间隔（秒），为0时不启动后台清理
+            on_evict: 淘汰游戏前的回调函数
+        """
+        self.max_games = max(1, max_games)
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.finished_ttl_seconds = finished_ttl_seconds
+        self.reap_interval_seconds = reap_interval_seconds
+        self.on_evict = on_evict
+
+        # 按淘汰原因统计的淘汰数量
+        self.evictions = {"idle": 0, "finished": 0, "capacity": 0}
+        self.flush_failures = 0
+
+        # {游戏ID: {"state", "version", "logs", "meta", "last_active", "finished_at"}}，按最近访问排序
+        self._records = OrderedDict()
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._stop_reaper = threading.Event()
+
+    def __getitem__(self, game_id):
+        with self._lock:
+            record = self._records[game_id]
+            record["last_active"] = time.monotonic()
+            self._records.move_to_end(game_id)
+            return record["state"]
+
+    def __setitem__(self, game_id, state):
+        self.save(game_id, state)
+
+    def __delitem__(self, game_id):
+        with self._lock:
+            del self._records[game_id]
+
+    def __contains__(self, game_id):
+        # 只判断是否存在，不算作访问
+        with self._lock:
+            return game_id in self._records
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._records))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def load(self, game_id):
+        with self._lock:
+            record = self._records.get(game_id)
+            if record is None:
+                return None, None
+            record["last_active"] = time.monotonic()
+            self._records.move_to_end(game_id)
+            return record["state"], record["version"]
+
+    def save(self, game_id, state, expected_version=None):
+        now = time.monotonic()
+        with self._lock:
+            record = self._records.get(game_id)
+            if record is None:
+                # 新游戏，或者处理过程中被淘汰的游戏，重新保存
+                record = {"version": 0, "logs": [], "meta": {}, "finished_at": None}
+                self._records[game_id] = record
+            elif expected_version is not None and record["version"] != expected_version:
+                raise GameConflictError(game_id)
+            record["state"] = GameState.from_mapping(state)
+            record["version"] += 1
+            record["last_active"] = now
+            if state.get("game_over", False) and record["finished_at"] is None:
+                record["finished_at"] = now
+            self._records.move_to_end(game_id)
+            version = record["version"]
+            victims = self._select_over_capacity(keep=game_id)
+
+        self._evict(victims, "capacity")
+        self._ensure_reaper()
+        return version
+
+    def shared_dict(self, name):
+        return LockedDict()
+
+    def items(self):
+        """游戏ID和状态的快照，遍历时不算作访问"""
+        with self._lock:
+            return [(game_id, record["state"]) for game_id, record in self._records.items()]
+
+    def get_logs(self, game_id):
+        with self._lock:
+            record = self._records.get(game_id)
+            return record["logs"] if record else None
+
+    def set_logs(self, game_id, logs):
+        with self._lock:
+            self._records[game_id]["logs"] = logs
+
+    def append_log(self, game_id, entry):
+        with self._lock:
+            record = self._records.get(game_id)
+            if record:
+                record["logs"].append(entry)
+
+    def get_meta(self, game_id, key, default=None):
+        with self._lock:
+            record = self._records.get(game_id)
+            return record["meta"].get(key, default) if record else default
+
+    def set_meta(self, game_id, key, value):
+        with self._lock:
+            record = self._records.get(game_id)
+            if record:
+                record["meta"][key] = value
+
+    def reap(self):
+        """淘汰无人访问和已结束超时的游戏，以及超出数量上限的游戏"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                game_id for game_id, record in self._records.items()
+                if now - record["last_active"] > self.idle_timeout_seconds
+            ]
+            finished = [
+                game_id for game_id, record in self._records.items()
+                if record["finished_at"] is not None and game_id not in idle
+                and now - record["finished_at"] > self.finished_ttl_seconds
+            ]
+            victims = {"idle": self._detach(idle), "finished": self._detach(finished),
+                       "capacity": self._select_over_capacity()}
+
+        for reason, records in victims.items():
+            self._evict(records, reason)
+        return sum(len(records) for records in victims.values())
+
+    def stats(self):
+        with self._lock:
+            finished = sum(1 for record in self._records.values() if record["finished_at"] is not None)
+            return {
+                "backend": "memory",
+                "games": len(self._records),
+                "finished_games": finished,
+                "max_games": self.max_games,
+                "evictions": dict(self.evictions),
+                "flush_failures": self.flush_failures
+            }
+
+    def close(self):
+        """停止后台清理线程"""
+        self._stop_reaper.set()
+
+    def _select_over_capacity(self, keep=None):
+        """取出超出数量上限需要淘汰的游戏（先淘汰已结束的，再淘汰最久未访问的），调用方需持有锁"""
+        excess = len(self._records) - self.max_games
+        if excess <= 0:
+            return []
+        candidates = [game_id for game_id in self._records if game_id != keep]
+        finished = [game_id for game_id in candidates if self._records[game_id]["finished_at"] is not None]
+        unfinished = [game_id for game_id in candidates if self._records[game_id]["finished_at"] is None]
+        return self._detach((finished + unfinished)[:excess])
+
+    def _detach(self, game_ids):
+        """从存储中取出指定的游戏，调用方需持有锁"""
+        return [(game_id, self._records.pop(game_id)) for game_id in game_ids]
+
+    def _evict(self, records, reason):
+        """把已取出的游戏交给on_evict写入磁盘，并计入淘汰统计"""
+        for game_id, record in records:
+            if self.on_evict:
+                try:
+                    self.on_evict(game_id, record["state"], record["logs"], record["meta"])
+                except Exception as e:
+                    self.flush_failures += 1
+                    print(f"淘汰游戏前保存失败: {game_id}: {e}")
+            with self._lock:
+                self.evictions[reason] += 1
+        if records:
+            print(f"已淘汰{len(records)}个游戏（{reason}）")
+
+    def _ensure_reaper(self):
+        """首次保存游戏时启动后台清理线程"""
+        if self._reaper is not None or self.reap_interval_seconds <= 0:
+            return
+        with self._lock:
+            if self._reaper is None:
+                thread = threading.Thread(target=self._run_reaper, name="game-store-reaper", daemon=True)
+                thread.start()
+                self._reaper = thread
+
+    def _run_reaper(self):
+        """后台清理线程主循环"""
+        while not self._stop_reaper.wait(self.reap_interval_seconds):
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"清理过期游戏时出错: {e}")
+
+class LockedDict(dict):
+    """进程内的字典，提供与SQLiteDict相同的modify原子修改接口"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def modify(self, key, func, default=None):
+        """
+        原子地修改一个值
+
+        Args:
+            key: 键
+            func: 修改函数 func(旧值) -> 新值，键不存在时旧值为default的副本
+            default: 键不存在时的默认值
+
+        Returns:
+            新值
+        """
+        with self._lock:
+            value = func(copy.deepcopy(self.get(key, default)))
+            self[key] = value
+            return value
+
+def _dumps(data):
+    """紧凑地序列化数据，较大的数据再用zlib压缩"""
+    encoded = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=json_default).encode("utf-8")
+    if len(encoded) >= 512:
+        return b"z" + zlib.compress(encoded, 1)
+    return b"j" + encoded
+
+def _loads(blob):
+    """反序列化_dumps的结果"""
+    blob = bytes(blob)
+    if blob[:1] == b"z":
+        return json.loads(zlib.decompress(blob[1:]).decode("utf-8"))
+    return json.loads(blob[1:].decode("utf-8"))
+
+class _SQLiteConnections:
+    """按线程管理SQLite连接（sqlite3连接不能跨线程使用），数据库使用WAL模式以支持多进程并发读写"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None时由代码显式开启事务，等待其他进程释放写锁而不是立即报错
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        """开启写事务（BEGIN IMMEDIATE立即获取写锁，避免读后写的死锁）"""
+        return _Transaction(self._connect())
+
+class _Transaction:
+    """SQLite写事务的上下文管理器"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
+
+class SQLiteDict(_SQLiteConnections, MutableMapping):
+    """
+    保存在SQLite表中的字典，多个进程共享
+
+    值以JSON保存，读出的是副本，修改值需要重新赋值或使用modify；
+    按插入顺序遍历，设置max_entries时只保留最新写入的若干条
+    """
+
+    def __init__(self, path, table, max_entries=None):
+        _SQLiteConnections.__init__(self, path)
+        self.table = table
+        self.max_entries = max_entries
+        self._connect().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            f"key TEXT UNIQUE NOT NULL, value BLOB NOT NULL)"
+        )
+
+    def __getitem__(self, key):
+        row = self._connect().execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return _loads(row[0])
+
+    def __setitem__(self, key, value):
+        with self._transaction() as conn:
+            self._put(conn, key, value)
+
+    def __delitem__(self, key):
+        with self._transaction() as conn:
+            if conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,)).rowcount == 0:
+                raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._connect().execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        rows = self._connect().execute(f"SELECT key FROM {self.table} ORDER BY seq").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def modify(self, key, func, default=None):
+        """原子地修改一个值，用法与LockedDict.modify相同"""
+        with self._transaction() as conn:
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            value = func(_loads(row[0]) if row else copy.deepcopy(default))
+            self._put(conn, key, value)
+            return value
+
+    def _put(self, conn, key, value):
+        """写入一个值并删除超出max_entries的旧条目，调用方需在事务中"""
+        conn.execute(
+            f"INSERT INTO {self.table} (key, value) VALUES (?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, _dumps(value))
+        )
+        if self.max_entries:
+            conn.execute(
+                f"DELETE FROM {self.table} WHERE seq <= "
+                f"(SELECT seq FROM {self.table} ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+class SQLiteGameStore(_SQLiteConnections, GameStore):
+    """
+    保存在本地SQLite数据库中的游戏状态存储，同一台机器上的多个工作进程共享
+
+    淘汰规则与InMemoryGameStore相同。游戏状态带有版本号，save提供expected_version时
+    使用乐观锁，游戏已被其他进程修改则抛出GameConflictError。
+    游戏日志逐条保存在单独的表中，追加日志不需要重写整个游戏状态
+    """
+
+    def __init__(self, path, max_games=1000, idle_timeout_seconds=1800, finished_ttl_seconds=300,
+                 reap_interval_seconds=60, on_evict=None):
+        """
+        Args:
+            path: 数据库文件路径
+            其余参数与InMemoryGameStore相同
+        """
+        _SQLiteConnections.__init__(self, path)
+        self.max_games = max(1, max_games)
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.finished_ttl_seconds = finished_ttl_seconds
+        self.reap_interval_seconds = reap_interval_seconds
+        self.on_evict = on_evict
+
+        # 按淘汰原因统计的淘汰数量（只统计当前进程）
+        self.evictions = {"idle": 0, "finished": 0, "capacity": 0}
+        self.flush_failures = 0
+
+        self._lock = threading.RLock()
+        self._reaper = None
+        self._stop_reaper = threading.Event()
+
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS games (game_id TEXT PRIMARY KEY, state BLOB NOT NULL, "
+            "version INTEGER NOT NULL, meta BLOB NOT NULL, last_active REAL NOT NULL, finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_games_last_active ON games(last_active)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS game_logs (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "game_id TEXT NOT NULL, entry TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_game_logs_game_id ON game_logs(game_id)")
+
+    def __getitem__(self, game_id):
+        state, _ = self.load(game_id)
+        if state is None:
+            raise KeyError(game_id)
+        return state
+
+    def __setitem__(self, game_id, state):
+        self.save(game_id, state)
+
+    def __delitem__(self, game_id):
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,)).rowcount == 0:
+                raise KeyError(game_id)
+            conn.execute("DELETE FROM game_logs WHERE game_id = ?", (game_id,))
+
+    def __contains__(self, game_id):
+        # 只判断是否存在，不算作访问
+        return self._connect().execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None
+
+    def __iter__(self):
+        rows = self._connect().execute("SELECT game_id FROM games ORDER BY last_active").fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def items(self):
+        """游戏ID和状态的快照，遍历时不算作访问"""
+        rows = self._connect().execute("SELECT game_id, state FROM games ORDER BY last_active").fetchall()
+        return [(game_id, GameState.from_mapping(_loads(state))) for game_id, state in rows]
+
+    def load(self, game_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT state, version FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                return None, None
+            conn.execute("UPDATE games SET last_active = ? WHERE game_id = ?", (time.time(), game_id))
+        return GameState.from_mapping(_loads(row[0])), row[1]
+
+    def save(self, game_id, state, expected_version=None):
+        now = time.time()
+        finished_at = now if state.get("game_over", False) else None
+        with self._transaction() as conn:
+            row = conn.execute("SELECT version FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                # 新游戏，或者处理过程中被淘汰的游戏，重新保存
+                version = 1
+                conn.execute(
+                    "INSERT INTO games (game_id, state, version, meta, last_active, finished_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (game_id, _dumps(state), version, _dumps({}), now, finished_at)
+                )
+            else:
+                if expected_version is not None and row[0] != expected_version:
+                    raise GameConflictError(game_id)
+                version = row[0] + 1
+                conn.execute(
+                    "UPDATE games SET state = ?, version = ?, last_active = ?, "
+                    "finished_at = COALESCE(finished_at, ?) WHERE game_id = ?",
+                    (_dumps(state), version, now, finished_at, game_id)
+                )
+            victims = self._select_over_capacity(conn, keep=game_id)
+
+        self._evict(victims, "capacity")
+        self._ensure_reaper()
+        return version
+
+    def shared_dict(self, name):
+        return SQLiteDict(self.path, f"shared_{name}")
+
+    def get_logs(self, game_id):
+        conn = self._connect()
+        if game_id not in self:
+            return None
+        rows = conn.execute("SELECT entry FROM game_logs WHERE game_id = ? ORDER BY seq", (game_id,)).fetchall()
+        return [row[0] for row in rows]
+
+    def set_logs(self, game_id, logs):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is None:
+                raise KeyError(game_id)
+            conn.execute("DELETE FROM game_logs WHERE game_id = ?", (game_id,))
+            conn.executemany("INSERT INTO game_logs (game_id, entry) VALUES (?, ?)",
+                             [(game_id, entry) for entry in logs])
+
+    def append_log(self, game_id, entry):
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM games WHERE game_id = ?", (game_id,)).fetchone() is not None:
+                conn.execute("INSERT INTO game_logs (game_id, entry) VALUES (?, ?)", (game_id, entry))
+
+    def get_meta(self, game_id, key, default=None):
+        row = self._connect().execute("SELECT meta FROM games WHERE game_id = ?", (game_id,)).fetchone()
+        return _loads(row[0]).get(key, default) if row else default
+
+    def set_meta(self, game_id, key, value):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT meta FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row:
+                meta = _loads(row[0])
+                meta[key] = value
+                conn.execute("UPDATE games SET meta = ? WHERE game_id = ?", (_dumps(meta), game_id))
+
+    def reap(self):
+        """淘汰无人访问和已结束超时的游戏，以及超出数量上限的游戏；多个进程同时清理时每个游戏只会被淘汰一次"""
+        now = time.time()
+        with self._transaction() as conn:
+            idle = [row[0] for row in conn.execute(
+                "SELECT game_id FROM games WHERE last_active < ?", (now - self.idle_timeout_seconds,)
+            )]
+            finished = [row[0] for row in conn.execute(
+                "SELECT game_id FROM games WHERE finished_at IS NOT NULL AND finished_at < ? AND last_active >= ?",
+                (now - self.finished_ttl_seconds, now - self.idle_timeout_seconds)
+            )]
+            victims = {"idle": self._detach(conn, idle), "finished": self._detach(conn, finished),
+                       "capacity": self._select_over_capacity(conn)}
+
+        for reason, records in victims.items():
+            self._evict(records, reason)
+        return sum(len(records) for records in victims.values())
+
+    def stats(self):
+        games, finished = self._connect().execute(
+            "SELECT COUNT(*), COUNT(finished_at) FROM games"
+        ).fetchone()
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "games": games,
+                "finished_games": finished,
+                "max_games": self.max_games,
+                "evictions": dict(self.evictions),
+                "flush_failures": self.flush_failures
+            }
+
+    def close(self):
+        """停止后台清理线程"""
+        self._stop_reaper.set()
+
+    def _select_over_capacity(self, conn, keep=None):
+        """取出超出数量上限需要淘汰的游戏（先淘汰已结束的，再淘汰最久未访问的），调用方需在事务中"""
+        excess = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0] - self.max_games
+        if excess <= 0:
+            return []
+        rows = conn.execute(
+            "SELECT game_id FROM games WHERE game_id != ? "
+            "ORDER BY finished_at IS NULL, last_active LIMIT ?",
+            (keep or "", excess)
+        ).fetchall()
+        return self._detach(conn, [row[0] for row in rows])
+
+    def _detach(self, conn, game_ids):
+        """从数据库中取出并删除指定的游戏，调用方需在事务中"""
+        records = []
+        for game_id in game_ids:
+            row = conn.execute("SELECT state, meta FROM games WHERE game_id = ?", (game_id,)).fetchone()
+            if row is None:
+                continue
+            logs = [entry for (entry,) in conn.execute(
+                "SELECT entry FROM game_logs WHERE game_id = ? ORDER BY seq", (game_id,)
+            )]
+            conn.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM game_logs WHERE game_id = ?", (game_id,))
+            records.append((game_id, {"state": GameState.from_mapping(_loads(row[0])), "logs": logs, "meta": _loads(row[1])}))
+        return records
+
+    # 淘汰游戏和后台清理的流程与InMemoryGameStore相同
+    _evict = InMemoryGameStore._evict
+    _ensure_reaper = InMemoryGameStore._ensure_reaper
+    _run_reaper = InMemoryGameStore._run_reaper
+
+def create_game_store(backend="memory", path=None, **kwargs):
+    """
+    按配置创建游戏状态存储
+
+    Args:
+        backend: "memory"为进程内存储，"sqlite"为保存在path的SQLite存储
+        path: SQLite数据库文件路径
+        **kwargs: 传给存储的其余参数（数量上限、淘汰时间、淘汰回调等）
+
+    Returns:
+        InMemoryGameStore或SQLiteGameStore
+    """
+    if backend == "memory":
+        return InMemoryGameStore(**kwargs)
+    if backend == "sqlite":
+        if not path:
+            raise ValueError("SQLite游戏状态存储需要设置数据库文件路径")
+        return SQLiteGameStore(path, **kwargs)
+    raise ValueError(f"未知的游戏状态存储后端: {backend}")
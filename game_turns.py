@@ -0,0 +1,170 @@
+"""
+游戏回合协调
+同一个游戏的回合依次处理，避免并发请求读到相同的状态、重复调用LLM并互相覆盖结果；
+带有幂等键的重复请求直接返回进行中或已完成的结果，不会重新处理
+"""
+
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+class TurnCoordinator:
+    """
+    按游戏串行执行回合，并按幂等键合并重复请求
+
+    同一个游戏的回合按到达顺序排队，前一个回合完成后才开始下一个。
+    排队用concurrent.futures.Future实现，既可以在请求线程中同步等待，
+    也可以在引擎事件循环中异步等待而不阻塞其他游戏
+    """
+
+    def __init__(self, result_ttl_seconds=300, max_results=1000):
+        """
+        Args:
+            result_ttl_seconds: 已完成结果按幂等键保留的时间（秒）
+            max_results: 最多保留的已完成结果数量
+        """
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_results = max(1, max_results)
+
+        # 统计数据
+        self.turns = 0  # 实际执行的回合数
+        self.waits = 0  # 需要排队等待前一个回合的次数
+        self.replays = 0  # 按幂等键直接返回结果的次数
+
+        # {游戏ID: 排在最后的回合完成时设置的Future}
+        self._tails = {}
+        # {(游戏ID, 幂等键): (结果Future, 完成时间)}，按完成顺序排序
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def run(self, game_id, idempotency_key, func):
+        """
+        在请求线程中执行一个回合
+
+        Args:
+            game_id: 游戏ID
+            idempotency_key: 幂等键，为空时不合并重复请求
+            func: 执行回合的函数，返回 (响应数据, HTTP状态码)
+
+        Returns:
+            (响应数据, HTTP状态码)
+        """
+        result, owner = self._claim(game_id, idempotency_key)
+        if not owner:
+            return result.result()
+
+        previous, done = self._enqueue(game_id)
+        try:
+            if previous is not None:
+                previous.result()
+            value = func()
+        except BaseException as e:
+            self._fail(game_id, idempotency_key, result, e)
+            raise
+        finally:
+            self._dequeue(game_id, previous, done)
+        self._complete(game_id, idempotency_key, result, value)
+        return value
+
+    async def arun(self, game_id, idempotency_key, coro_func):
+        """
+        在事件循环中执行一个回合，用法与run相同，coro_func返回执行回合的协程
+        """
+        result, owner = self._claim(game_id, idempotency_key)
+        if not owner:
+            return await asyncio.wrap_future(result)
+
+        previous, done = self._enqueue(game_id)
+        try:
+            if previous is not None:
+                await asyncio.wrap_future(previous)
+            value = await coro_func()
+        except BaseException as e:
+            self._fail(game_id, idempotency_key, result, e)
+            raise
+        finally:
+            self._dequeue(game_id, previous, done)
+        self._complete(game_id, idempotency_key, result, value)
+        return value
+
+    def stats(self):
+        """回合协调的统计数据"""
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "waits": self.waits,
+                "replays": self.replays,
+                "games_in_progress": len(self._tails),
+                "cached_results": len(self._results)
+            }
+
+    def _claim(self, game_id, idempotency_key):
+        """
+        按幂等键登记请求
+
+        Returns:
+            (结果Future, 是否由当前请求执行回合)；已有相同幂等键的请求时返回它的结果Future
+        """
+        result = Future()
+        if not idempotency_key:
+            return result, True
+
+        with self._lock:
+            self._drop_expired()
+            key = (game_id, idempotency_key)
+            existing = self._results.get(key)
+            if existing is not None:
+                self.replays += 1
+                return existing[0], False
+            self._results[key] = (result, None)
+            return result, True
+
+    def _enqueue(self, game_id):
+        """排到游戏回合队列的末尾，返回 (需要等待的前一个回合, 当前回合完成时设置的Future)"""
+        done = Future()
+        with self._lock:
+            previous = self._tails.get(game_id)
+            self._tails[game_id] = done
+            self.turns += 1
+            if previous is not None:
+                self.waits += 1
+        return previous, done
+
+    def _dequeue(self, game_id, previous, done):
+        """当前回合结束，让下一个回合开始"""
+        if previous is not None and not previous.done():
+            # 等待前一个回合时被取消，仍需等前一个回合结束后才能放行下一个回合
+            previous.add_done_callback(lambda _: self._dequeue(game_id, None, done))
+            return
+        with self._lock:
+            if self._tails.get(game_id) is done:
+                del self._tails[game_id]
+        done.set_result(None)
+
+    def _complete(self, game_id, idempotency_key, result, value):
+        """记录回合结果，唤醒等待相同幂等键的请求"""
+        if idempotency_key:
+            key = (game_id, idempotency_key)
+            with self._lock:
+                self._results[key] = (result, time.monotonic())
+                self._results.move_to_end(key)
+        result.set_result(value)
+
+    def _fail(self, game_id, idempotency_key, result, error):
+        """回合出错时不保留结果，之后的重试会重新执行"""
+        if idempotency_key:
+            with self._lock:
+                self._results.pop((game_id, idempotency_key), None)
+        result.set_exception(error)
+
+    def _drop_expired(self):
+        """丢弃过期和超出数量上限的已完成结果，调用方需持有锁"""
+        deadline = time.monotonic() - self.result_ttl_seconds
+        completed = [key for key, (_, finished_at) in self._results.items() if finished_at is not None]
+        excess = len(completed) - self.max_results
+        for key in completed:
+            if excess > 0 or self._results[key][1] < deadline:
+                del self._results[key]
+                excess -= 1
@@ -0,0 +1,341 @@
+"""
+LLM响应缓存
+有条目数量、内存占用和有效期上限的LRU缓存，长时间运行的服务器内存占用保持稳定。
+提供内存和SQLite两种后端，SQLite后端的缓存在重启后保留，并在同一台机器的多个工作进程间共享
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+class LLMResponseCache:
+    """
+    LLM响应的LRU缓存
+
+    缓存键是模型ID、系统消息和用户消息的完整SHA-256哈希；
+    条目数量超过max_entries或估算的内存占用超过max_bytes时淘汰最久未使用的条目，
+    超过ttl_seconds的条目视为过期
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+        """
+        Args:
+            max_entries: 最多缓存的条目数量
+            max_bytes: 缓存内容的内存占用上限（字节，按Python字符串对象大小估算）
+            ttl_seconds: 条目的有效期（秒）
+        """
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        # 统计数据
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # {缓存键: (响应内容, 过期时间, 占用字节数)}，按最近使用排序
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, system_message, prompt):
+        """
+        生成缓存键
+
+        Args:
+            model: 模型ID
+            system_message: 系统消息
+            prompt: 用户消息
+
+        Returns:
+            64位十六进制的SHA-256哈希
+        """
+        digest = hashlib.sha256()
+        for part in (model or "", system_message, prompt):
+            encoded = part.encode("utf-8")
+            # 写入长度前缀，避免不同的分段方式拼出相同的内容
+            digest.update(len(encoded).to_bytes(8, "big"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        获取缓存的响应
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            响应内容，未命中或已过期时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        缓存一条响应
+
+        Args:
+            key: 缓存键
+            value: 响应内容
+        """
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """缓存的统计数据"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _remove(self, key):
+        """删除一个条目，调用方需持有锁"""
+        value, expires_at, size = self._entries.pop(key)
+        self._bytes -= size
+
+class SQLiteResponseCache:
+    """
+    保存在本地SQLite数据库中的LLM响应缓存
+
+    接口与LLMResponseCache相同。数据库使用WAL模式，多个进程可以同时读写；
+    条目数量超过max_entries或内容总大小超过max_bytes时按最近使用时间淘汰，
+    超过ttl_seconds的条目视为过期。数据库出错时按未命中处理，不影响游戏进行
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl_seconds=86400):
+        """
+        Args:
+            path: 数据库文件路径
+            max_entries: 最多缓存的条目数量
+            max_bytes: 缓存内容的总大小上限（字节，按UTF-8编码计算）
+            ttl_seconds: 条目的有效期（秒）
+        """
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        # 统计数据（只统计当前进程）
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # sqlite3连接不能跨线程使用，每个线程使用自己的连接
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+
+    make_key = staticmethod(LLMResponseCache.make_key)
+
+    def get(self, key):
+        """
+        获取缓存的响应
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            响应内容，未命中、已过期或数据库出错时返回None
+        """
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] < now:
+                with conn:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count("expirations")
+                row = None
+            elif row is not None:
+                with conn:
+                    conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"读取LLM响应缓存失败: {e}")
+            row = None
+
+        if row is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return row[0]
+
+    def set(self, key, value):
+        """
+        缓存一条响应
+
+        Args:
+            key: 缓存键
+            value: 响应内容
+        """
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now + self.ttl_seconds, now)
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"写入LLM响应缓存失败: {e}")
+
+    def clear(self):
+        """清空缓存"""
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            print(f"清空LLM响应缓存失败: {e}")
+
+    def stats(self):
+        """缓存的统计数据"""
+        try:
+            entries, total_bytes = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        except sqlite3.Error:
+            entries, total_bytes = None, None
+
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "sqlite",
+                "path": self.path,
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 等待其他进程释放写锁，而不是立即报错
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _evict(self, conn, now):
+        """删除过期条目，再按最近使用时间淘汰超出上限的条目，调用方需在事务中"""
+        expired = conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,)).rowcount
+        if expired:
+            self._count("expirations", expired)
+
+        entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        evicted = 0
+        while entries > self.max_entries or total_bytes > self.max_bytes:
+            # 每次淘汰一批最久未使用的条目，直到满足上限
+            batch = max(1, entries - self.max_entries, entries // 10 if total_bytes > self.max_bytes else 0)
+            rows = conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT ?", (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key, _ in rows])
+            entries -= len(rows)
+            total_bytes -= sum(size for _, size in rows)
+            evicted += len(rows)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _count(self, name, amount=1):
+        """累加统计数据"""
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+def create_response_cache(backend="memory", path=None, max_entries=1000, max_bytes=16 * 1024 * 1024, ttl_seconds=3600):
+    """
+    按配置创建LLM响应缓存
+
+    Args:
+        backend: "memory"为进程内缓存，"sqlite"为保存在path的SQLite缓存
+        path: SQLite数据库文件路径
+        max_entries: 最多缓存的条目数量
+        max_bytes: 缓存内容的大小上限（字节）
+        ttl_seconds: 条目的有效期（秒）
+
+    Returns:
+        LLMResponseCache或SQLiteResponseCache
+    """
+    if backend == "memory":
+        return LLMResponseCache(max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    if backend == "sqlite":
+        if not path:
+            raise ValueError("SQLite缓存需要设置数据库文件路径")
+        return SQLiteResponseCache(path, max_entries=max_entries, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+    raise ValueError(f"未知的LLM缓存后端: {backend}")
@@ -0,0 +1,155 @@
+"""
+LLM调用的调度
+所有LLM调用在发出前经过调度器：
+- 全局并发上限：同时进行的调用达到上限时排队，空出位置后按调用类型的优先级放行（病人回复最先，后台补充开局池最后）
+- 后台调用的时间窗口：后台调用先等待一个很短的窗口再排队，窗口内到达的前台调用先得到位置
+排队时间按调用类型（后台调用统一为background）记录，可以查看各分位数。
+调度器只在引擎事件循环中使用，内部状态不需要加锁
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# 调用类型的优先级，数值小的先放行；未列出的类型按1处理
+CALL_PRIORITIES = {"patient": 0, "body": 0, "referee": 1, "summary": 2}
+DEFAULT_PRIORITY = 1
+# 后台调用（补充开局池等）的优先级，低于所有前台调用
+BACKGROUND_PRIORITY = 3
+
+# 当前任务中的调用是否为后台调用
+_background = contextvars.ContextVar("llm_background", default=False)
+
+def percentile(sorted_values, q):
+    """按最近秩取分位数，sorted_values为升序列表"""
+    if not sorted_values:
+        return 0
+    index = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class LLMScheduler:
+    """LLM调用的并发上限和优先级排队"""
+
+    def __init__(self, max_concurrency=64, background_window_seconds=0.02, priorities=None,
+                 history_size=1000, clock=time.monotonic):
+        """
+        Args:
+            max_concurrency: 同时进行的调用数量上限，0表示不限制
+            background_window_seconds: 后台调用排队前等待的时间窗口（秒）
+            priorities: 调用类型到优先级的字典，默认为CALL_PRIORITIES
+            history_size: 每种调用类型保留的排队时间记录数量
+            clock: 时钟函数，用于测试
+        """
+        self.max_concurrency = max_concurrency
+        self.background_window_seconds = background_window_seconds
+        self.priorities = dict(CALL_PRIORITIES if priorities is None else priorities)
+        self.history_size = history_size
+        self.clock = clock
+
+        # 统计数据
+        self.calls = 0
+        self.queued_calls = 0  # 需要排队的调用次数
+
+        self._active = 0
+        self._waiting = []  # 堆：(优先级, 序号, future)
+        self._sequence = itertools.count()
+        self._delays = {}  # 调用类型 -> 最近的排队时间（秒）
+
+    @contextmanager
+    def background(self):
+        """在这个上下文中（包括其中创建的任务）发出的调用都按后台调用处理"""
+        token = _background.set(True)
+        try:
+            yield
+        finally:
+            _background.reset(token)
+
+    def priority(self, call_type):
+        """调用类型的优先级，后台调用统一为BACKGROUND_PRIORITY"""
+        if _background.get():
+            return BACKGROUND_PRIORITY
+        return self.priorities.get(call_type, DEFAULT_PRIORITY)
+
+    async def run(self, make_request, call_type=None):
+        """
+        在并发上限内执行一次请求
+
+        Args:
+            make_request: 无参数的协程函数，发出一次请求
+            call_type: 调用类型，决定排队时的优先级
+
+        Returns:
+            make_request的返回值
+        """
+        await self._acquire(call_type)
+        try:
+            return await make_request()
+        finally:
+            self._release()
+
+    def stats(self):
+        """调度的统计数据，排队时间为毫秒"""
+        queue_delay = {}
+        for call_type, delays in self._delays.items():
+            values = sorted(delays)
+            queue_delay[call_type] = {
+                "count": len(values),
+                "p50": round(percentile(values, 50) * 1000, 2),
+                "p90": round(percentile(values, 90) * 1000, 2),
+                "p99": round(percentile(values, 99) * 1000, 2),
+                "max": round(values[-1] * 1000, 2)
+            }
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "waiting": len(self._waiting),
+            "calls": self.calls,
+            "queued_calls": self.queued_calls,
+            "queue_delay_ms": queue_delay
+        }
+
+    def _has_slot(self):
+        return self.max_concurrency <= 0 or self._active < self.max_concurrency
+
+    async def _acquire(self, call_type):
+        """等待一个并发位置"""
+        start = self.clock()
+        priority = self.priority(call_type)
+        if priority >= BACKGROUND_PRIORITY and self.background_window_seconds > 0:
+            await asyncio.sleep(self.background_window_seconds)
+
+        self.calls += 1
+        if self._has_slot() and not self._waiting:
+            self._active += 1
+        else:
+            self.queued_calls += 1
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (priority, next(self._sequence), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 已经得到位置但调用被取消，把位置让给下一个
+                    self._release()
+                raise
+
+        # 后台调用的排队时间单独记录
+        label = "background" if _background.get() else call_type or "other"
+        delays = self._delays.get(label)
+        if delays is None:
+            delays = self._delays[label] = deque(maxlen=self.history_size)
+        delays.append(self.clock() - start)
+
+    def _release(self):
+        """释放一个并发位置，按优先级放行排队的调用"""
+        self._active -= 1
+        while self._waiting and self._has_slot():
+            _, _, future = heapq.heappop(self._waiting)
+            # 排队时被取消的调用直接跳过
+            if not future.done():
+                self._active += 1
+                future.set_result(None)
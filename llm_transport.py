@@ -0,0 +1,240 @@
+"""
+LLM传输层
+配置OpenAI客户端的连接池、连接保持和超时，按带随机抖动的指数退避重试临时性错误，
+并给每个游戏的回合设置总的时间预算：回合中的所有LLM调用共用这个预算，
+预算用完后不再等待上游，由调用方返回预设的兜底回复，一次卡住的上游调用不会一直占用工作线程
+"""
+
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+# 可以重试的HTTP状态码
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+class LLMDeadlineExceeded(Exception):
+    """游戏回合的时间预算已用完"""
+
+def create_async_client(base_url=None, api_key=None, max_connections=100, max_keepalive_connections=20,
+                        keepalive_expiry=30.0, connect_timeout=5.0, read_timeout=60.0,
+                        write_timeout=10.0, pool_timeout=10.0):
+    """
+    创建使用指定连接池和超时的OpenAI异步客户端
+    客户端自身不重试，重试由LLMTransport按退避策略和回合预算处理
+
+    Args:
+        base_url: API地址
+        api_key: API密钥
+        max_connections: 连接池的最大连接数
+        max_keepalive_connections: 最多保持的空闲连接数
+        keepalive_expiry: 空闲连接保持的时间（秒）
+        connect_timeout: 建立连接的超时（秒）
+        read_timeout: 两次读到数据之间的超时（秒），流式调用时是两段回复之间的超时
+        write_timeout: 发送请求的超时（秒）
+        pool_timeout: 等待连接池空闲连接的超时（秒）
+
+    Returns:
+        AsyncOpenAI客户端
+    """
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=httpx.Timeout(connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout)
+    )
+    return AsyncOpenAI(base_url=base_url, api_key=api_key, max_retries=0, http_client=http_client)
+
+class RetryPolicy:
+    """带随机抖动的指数退避重试策略"""
+
+    def __init__(self, max_retries=2, backoff_base=0.5, backoff_max=8.0, rng=None):
+        """
+        Args:
+            max_retries: 最多重试次数（不含第一次调用）
+            backoff_base: 第一次重试前等待时间的上限（秒），之后每次翻倍
+            backoff_max: 每次等待时间的上限（秒）
+            rng: 随机数生成器，测试时可以传入固定种子的生成器
+        """
+        self.max_retries = max(0, max_retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt, retry_after=None):
+        """
+        第attempt次重试（从0开始）前等待的时间：在0到指数增长的上限之间随机取值，
+        避免大量请求同时失败后又同时重试；服务器返回Retry-After时至少等待这么久
+
+        Args:
+            attempt: 重试序号
+            retry_after: 服务器要求的等待时间（秒）
+
+        Returns:
+            等待时间（秒）
+        """
+        delay = self.rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    @staticmethod
+    def is_retryable(error):
+        """连接错误、超时、限流和服务器错误可以重试，请求本身有误时重试也不会成功"""
+        if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in RETRYABLE_STATUS_CODES
+        return False
+
+    @staticmethod
+    def retry_after(error):
+        """服务器在Retry-After头中要求的等待时间（秒），没有时返回None"""
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(value) if value else None
+        except ValueError:
+            return None
+
+class GameDeadlines:
+    """
+    按游戏ID记录回合的截止时间
+    同一个游戏的回合依次处理，每个游戏同时最多有一个截止时间；
+    以游戏ID为键，在请求线程中开始的回合，其LLM调用在引擎事件循环中也能找到截止时间
+    """
+
+    def __init__(self, budget_seconds=60.0, clock=time.monotonic):
+        """
+        Args:
+            budget_seconds: 每个回合的时间预算（秒），为0时不限制
+            clock: 计时函数
+        """
+        self.budget_seconds = budget_seconds
+        self.clock = clock
+        self._deadlines = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, game_id):
+        """
+        在回合期间设置游戏的截止时间
+        游戏已有截止时间时（例如回合中又调用了其他流程）沿用原来的截止时间
+        """
+        if not game_id or self.budget_seconds <= 0:
+            yield
+            return
+        with self._lock:
+            owner = game_id not in self._deadlines
+            if owner:
+                self._deadlines[game_id] = self.clock() + self.budget_seconds
+        try:
+            yield
+        finally:
+            if owner:
+                with self._lock:
+                    self._deadlines.pop(game_id, None)
+
+    def remaining(self, game_id):
+        """游戏回合剩余的时间（秒），没有截止时间时返回None"""
+        deadline = self._deadlines.get(game_id) if game_id else None
+        if deadline is None:
+            return None
+        return max(0.0, deadline - self.clock())
+
+class LLMTransport:
+    """
+    在回合预算内调用LLM，失败时按退避策略重试
+
+    每次调用的等待时间不超过游戏回合剩余的预算；预算不足以等到下一次重试时直接放弃，
+    抛出LLMDeadlineExceeded，由调用方决定兜底回复
+    """
+
+    def __init__(self, retry_policy=None, deadlines=None):
+        """
+        Args:
+            retry_policy: 重试策略
+            deadlines: 游戏回合的截止时间
+        """
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.deadlines = deadlines or GameDeadlines()
+
+        # 统计数据
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    async def call(self, make_request, game_id=None, can_retry=None):
+        """
+        调用LLM，临时性错误时重试
+
+        Args:
+            make_request: 无参数函数，每次调用返回发起一次请求的协程
+            game_id: 游戏ID，有回合截止时间时每次请求的等待时间不超过剩余的预算
+            can_retry: 可选的无参数函数，返回False时不再重试（例如流式回复已经输出了部分内容）
+
+        Returns:
+            请求协程的返回值
+
+        Raises:
+            LLMDeadlineExceeded: 回合预算已用完
+        """
+        self._count("calls")
+        attempt = 0
+        while True:
+            remaining = self.deadlines.remaining(game_id)
+            if remaining is not None and remaining <= 0:
+                self._count("deadline_exceeded")
+                raise LLMDeadlineExceeded(f"游戏回合的时间预算已用完: {game_id}")
+            try:
+                if remaining is None:
+                    return await make_request()
+                return await asyncio.wait_for(make_request(), remaining)
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise LLMDeadlineExceeded(f"游戏回合的时间预算已用完: {game_id}") from None
+            except Exception as e:
+                if (attempt >= self.retry_policy.max_retries or not self.retry_policy.is_retryable(e)
+                        or (can_retry is not None and not can_retry())):
+                    self._count("failures")
+                    raise
+                delay = self.retry_policy.delay(attempt, self.retry_policy.retry_after(e))
+                remaining = self.deadlines.remaining(game_id)
+                if remaining is not None and delay >= remaining:
+                    self._count("deadline_exceeded")
+                    raise LLMDeadlineExceeded(f"游戏回合的时间预算不足以等待重试: {game_id}") from e
+                print(f"LLM调用失败，{delay:.2f}秒后重试（第{attempt + 1}次）: {e}")
+                self._count("retries")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def record_fallback(self):
+        """记录一次使用兜底回复"""
+        self._count("fallbacks")
+
+    def stats(self):
+        """传输层的统计数据"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "deadline_exceeded": self.deadline_exceeded,
+                "fallbacks": self.fallbacks,
+                "turn_budget_seconds": self.deadlines.budget_seconds,
+                "max_retries": self.retry_policy.max_retries
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
@@ -0,0 +1,186 @@
+"""
+只追加的消息记录
+游戏状态中的消息列表在每个节点、每轮都会变成"原列表 + 新消息"。MessageLog让这些列表共享同一份底层存储：
+每个MessageLog只是底层存储前若干条消息的快照，追加消息不需要复制之前的消息，之前的快照也看不到之后追加的消息。
+消息本身是不可修改的Message，需要修改时用replace得到新的快照，避免不同状态之间互相影响
+"""
+
+import sys
+import threading
+from collections.abc import Mapping, Sequence
+from itertools import islice
+
+# 消息发送者，使用驻留的字符串，所有消息共享同一个字符串对象
+SYSTEM = sys.intern("system")
+DOCTOR = sys.intern("doctor")
+PATIENT = sys.intern("patient")
+BODY = sys.intern("body")
+_SENDERS = {sender: sender for sender in (SYSTEM, DOCTOR, PATIENT, BODY)}
+
+# 追加消息时检查并扩展底层存储需要是原子操作
+_append_lock = threading.Lock()
+
+class Message(Mapping):
+    """
+    不可修改的消息，只有sender和content两个字段，用__slots__保存，比字典占用的内存少得多
+    按只读字典的方式访问（msg["sender"]、{**msg}、与字典比较），序列化时用to_dict转换为字典；
+    需要修改内容时用 Message({**msg, "content": 新内容}) 创建新消息
+    """
+
+    __slots__ = ("sender", "content")
+    _FIELDS = ("sender", "content")
+
+    def __init__(self, data=(), **fields):
+        fields = dict(data, **fields)
+        unknown = set(fields) - set(self._FIELDS)
+        if unknown:
+            raise ValueError(f"未知的消息字段: {', '.join(sorted(unknown))}")
+        sender = fields.get("sender")
+        object.__setattr__(self, "sender", _SENDERS.get(sender, sender))
+        object.__setattr__(self, "content", fields.get("content", ""))
+
+    def __setattr__(self, name, value):
+        raise TypeError("消息不可修改，请创建新消息并用MessageLog.replace替换")
+
+    __delattr__ = __setattr__
+
+    def __getitem__(self, key):
+        if key == "sender":
+            return self.sender
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._FIELDS)
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return self.sender == other.sender and self.content == other.content
+        if isinstance(other, Mapping):
+            return len(other) == 2 and other.get("sender") == self.sender and other.get("content") == self.content
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.sender, self.content))
+
+    def __repr__(self):
+        return f"Message(sender={self.sender!r}, content={self.content!r})"
+
+    def __reduce__(self):
+        return (Message, (self.to_dict(),))
+
+    def to_dict(self):
+        """转换为JSON使用的字典"""
+        return {"sender": self.sender, "content": self.content}
+
+def as_message(msg):
+    """转换为Message，已经是Message时直接返回"""
+    return msg if isinstance(msg, Message) else Message(msg)
+
+class MessageLog(Sequence):
+    """
+    只追加的消息列表快照
+
+    log + [msg] 在快照位于底层存储末尾时直接扩展底层存储，不复制之前的消息，返回新的快照；
+    否则（另一个快照已经在同一位置追加过消息）先复制出新的底层存储。前缀切片 log[:n] 不复制消息。
+    log.append(msg) 会原地修改快照本身，只用于兼容旧代码
+    """
+
+    __slots__ = ("_items", "_length")
+
+    def __init__(self, messages=()):
+        if isinstance(messages, MessageLog):
+            self._items = messages._items
+            self._length = messages._length
+        else:
+            self._items = [as_message(msg) for msg in messages]
+            self._length = len(self._items)
+
+    @classmethod
+    def _view(cls, items, length):
+        log = cls.__new__(cls)
+        log._items = items
+        log._length = length
+        return log
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if start == 0 and step == 1:
+                return self._view(self._items, max(stop, 0))
+            return MessageLog(self._items[start:stop:step])
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("消息下标超出范围")
+        return self._items[index]
+
+    def __iter__(self):
+        return islice(self._items, self._length)
+
+    def __eq__(self, other):
+        if not isinstance(other, (MessageLog, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"MessageLog({list(self)!r})"
+
+    def __add__(self, messages):
+        new_items = [as_message(msg) for msg in messages]
+        items = self._items
+        with _append_lock:
+            if self._length == len(items):
+                items.extend(new_items)
+                return self._view(items, len(items))
+        # 其他快照已经在这个位置之后追加过消息，复制出新的底层存储
+        items = items[:self._length] + new_items
+        return self._view(items, len(items))
+
+    def append(self, msg):
+        """
+        在当前快照末尾原地追加一条消息，兼容直接修改列表的旧代码；共享底层存储的其他快照不受影响
+        会修改当前快照本身，游戏状态中的消息列表应使用 log + [msg] 得到新的快照
+        """
+        msg = as_message(msg)
+        with _append_lock:
+            if self._length != len(self._items):
+                # 其他快照已经在这个位置之后追加过消息，复制出自己的底层存储
+                self._items = self._items[:self._length]
+            self._items.append(msg)
+            self._length += 1
+
+    def replace(self, index, msg):
+        """返回把第index条消息替换为msg的新快照，当前快照不变"""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("消息下标超出范围")
+        items = self._items[:self._length]
+        items[index] = as_message(msg)
+        return self._view(items, self._length)
+
+    def copy(self):
+        """复制只需要共享底层存储，之后在任一快照上append都不影响另一个"""
+        return self._view(self._items, self._length)
+
+    def to_list(self):
+        """转换为JSON使用的字典列表"""
+        return [msg.to_dict() for msg in self]
+
+def as_message_log(messages):
+    """转换为MessageLog，已经是MessageLog时直接返回"""
+    return messages if isinstance(messages, MessageLog) else MessageLog(messages)
+
+def replace_message(messages, index, msg):
+    """返回把第index条消息替换为msg的消息列表（MessageLog），不修改原来的列表和消息"""
+    return as_message_log(messages).replace(index, msg)
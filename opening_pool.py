@@ -0,0 +1,146 @@
+"""
+游戏开局池
+在后台为每种疾病预先生成若干个开局（诊断、经过系统检查的病人问候），
+创建新游戏时直接取用，取用后在后台补充
+"""
+
+import time
+import asyncio
+import threading
+from collections import deque
+
+from game_engine import get_engine_loop
+
+class OpeningPool:
+    """
+    预先生成的游戏开局池
+
+    每个开局是一个字典，至少包含 game_id、diagnosis、messages，由generate协程生成；
+    超过ttl_seconds未被取用的开局视为过期并丢弃
+    """
+
+    def __init__(self, generate, diseases, size_per_disease=2, ttl_seconds=3600, refill_concurrency=2, on_expire=None):
+        """
+        Args:
+            generate: 生成开局的协程函数 generate(diagnosis) -> dict
+            diseases: 疾病列表
+            size_per_disease: 每种疾病保留的开局数量，为0时不启用开局池
+            ttl_seconds: 开局的有效期（秒）
+            refill_concurrency: 补充开局时同时进行的生成数量
+            on_expire: 可选的回调函数 on_expire(开局)，过期的开局被丢弃后调用，用于释放按游戏ID保存的资源
+        """
+        self.generate = generate
+        self.diseases = list(diseases)
+        self.size_per_disease = size_per_disease
+        self.ttl_seconds = ttl_seconds
+        self.refill_concurrency = max(1, refill_concurrency)
+        self.on_expire = on_expire
+
+        # 统计数据
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.failures = 0
+
+        self._openings = {disease: deque() for disease in self.diseases}
+        self._lock = threading.Lock()
+        self._refill_future = None
+
+    @property
+    def enabled(self):
+        return self.size_per_disease > 0
+
+    def pop(self, diagnosis):
+        """
+        取出一个指定疾病的开局
+
+        Args:
+            diagnosis: 疾病名称
+
+        Returns:
+            开局字典；开局池未启用或没有可用开局时返回None
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            expired = self._drop_expired()
+            openings = self._openings.get(diagnosis)
+            if openings:
+                self.hits += 1
+                opening = openings.popleft()
+            else:
+                self.misses += 1
+                opening = None
+        self._release(expired)
+        return opening
+
+    def ensure_filling(self):
+        """在引擎事件循环中补充开局，已有补充任务在进行时不重复启动"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._refill_future is not None and not self._refill_future.done():
+                return
+            self._refill_future = asyncio.run_coroutine_threadsafe(self.refill(), get_engine_loop())
+
+    async def refill(self):
+        """把每种疾病的开局补充到size_per_disease个"""
+        with self._lock:
+            expired = self._drop_expired()
+            missing = [
+                disease
+                for disease in self.diseases
+                for _ in range(self.size_per_disease - len(self._openings[disease]))
+            ]
+        self._release(expired)
+
+        semaphore = asyncio.Semaphore(self.refill_concurrency)
+
+        async def generate_one(disease):
+            async with semaphore:
+                try:
+                    opening = await self.generate(disease)
+                except Exception as e:
+                    self.failures += 1
+                    print(f"预生成开局失败: {disease}: {e}")
+                    return
+            opening["created_at"] = time.monotonic()
+            with self._lock:
+                self._openings[disease].append(opening)
+
+        await asyncio.gather(*[generate_one(disease) for disease in missing])
+
+    def stats(self):
+        """开局池的统计数据"""
+        with self._lock:
+            sizes = {disease: len(openings) for disease, openings in self._openings.items()}
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size_per_disease": self.size_per_disease,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+            "expired": self.expired,
+            "failures": self.failures,
+            "available": sizes
+        }
+
+    def _drop_expired(self):
+        """丢弃过期的开局，调用方需持有锁，返回丢弃的开局"""
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = []
+        for openings in self._openings.values():
+            while openings and openings[0]["created_at"] < deadline:
+                expired.append(openings.popleft())
+                self.expired += 1
+        return expired
+
+    def _release(self, expired):
+        """在锁外为丢弃的开局调用on_expire"""
+        if self.on_expire is None:
+            return
+        for opening in expired:
+            self.on_expire(opening)
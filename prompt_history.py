@@ -0,0 +1,119 @@
+"""
+增量格式化的对话历史
+每次调用LLM都需要把对话历史格式化为"发送者: 内容"的文本。按游戏缓存已经格式化的文本，
+新消息追加时只格式化新增的部分，不再每次重新格式化整个历史
+"""
+
+from collections import OrderedDict
+
+from sanitizer import SanitizedText
+
+class PromptHistory:
+    """
+    一局游戏的格式化对话历史，同时维护包含身体消息和不包含身体消息两种文本
+
+    消息列表在游戏中只会追加（或替换、去掉最后几条），已格式化的前缀按消息对象的身份判断是否仍然有效；
+    还没有清理过询问身体标记的病人消息之后可能被原地清理，这些消息每次都会检查内容是否变化
+    """
+
+    def __init__(self):
+        self._messages = []  # 已格式化的消息
+        self._contents = []  # 格式化时的消息内容
+        self._volatile = []  # 内容之后可能被原地修改的消息下标
+        self._full_text = ""  # 全部消息的文本
+        self._full_ends = []  # 每条消息之后全部消息文本的长度
+        self._dialog_text = ""  # 不包含身体消息的文本
+        self._dialog_ends = []  # 每条消息之后不包含身体消息文本的长度
+
+    def format(self, messages, include_body=True, count=None, start=0):
+        """
+        返回格式化的对话历史
+
+        Args:
+            messages: 当前的消息列表
+            include_body: 是否包含身体消息
+            count: 只格式化前count条消息，默认为全部
+            start: 从第start条消息开始格式化，默认从头开始
+
+        Returns:
+            每条消息一行的文本
+        """
+        self._sync(messages)
+        if count is None:
+            count = len(messages)
+        if count <= start or count <= 0:
+            return ""
+        text, ends = (self._full_text, self._full_ends) if include_body else (self._dialog_text, self._dialog_ends)
+        begin = ends[start - 1] if start > 0 else 0
+        if begin > 0:
+            begin += 1  # 跳过前一行末尾的换行
+        return text[begin:ends[count - 1]]
+
+    def _sync(self, messages):
+        """让缓存与消息列表一致：保留仍然有效的前缀，格式化之后的消息"""
+        valid = min(len(messages), len(self._messages))
+        if valid and messages[valid - 1] is not self._messages[valid - 1]:
+            # 不是同一局对话的延续，重新格式化
+            valid = 0
+        for index in self._volatile:
+            if index < valid and messages[index]["content"] is not self._contents[index]:
+                valid = index
+        if valid < len(self._messages):
+            self._truncate(valid)
+
+        for index in range(len(self._messages), len(messages)):
+            self._append(index, messages[index])
+
+    def _append(self, index, msg):
+        """格式化并追加一条消息"""
+        content = msg["content"]
+        line = f"{msg['sender']}: {content}"
+        self._messages.append(msg)
+        self._contents.append(content)
+        if msg["sender"] == "patient" and not isinstance(content, SanitizedText):
+            self._volatile.append(index)
+
+        self._full_text = f"{self._full_text}\n{line}" if self._full_text else line
+        self._full_ends.append(len(self._full_text))
+        if msg["sender"] != "body":
+            self._dialog_text = f"{self._dialog_text}\n{line}" if self._dialog_text else line
+        self._dialog_ends.append(len(self._dialog_text))
+
+    def _truncate(self, count):
+        """只保留前count条消息的格式化结果"""
+        del self._messages[count:]
+        del self._contents[count:]
+        del self._full_ends[count:]
+        del self._dialog_ends[count:]
+        self._volatile = [index for index in self._volatile if index < count]
+        self._full_text = self._full_text[:self._full_ends[-1]] if count else ""
+        self._dialog_text = self._dialog_text[:self._dialog_ends[-1]] if count else ""
+
+class PromptHistoryCache:
+    """按游戏ID保存PromptHistory，超过max_games时淘汰最久未使用的游戏"""
+
+    def __init__(self, max_games=1000):
+        self.max_games = max(1, max_games)
+        self._histories = OrderedDict()
+
+    def format(self, game_id, messages, include_body=True, count=None, start=0):
+        """
+        返回格式化的对话历史，参数与PromptHistory.format相同
+        没有游戏ID时不缓存
+        """
+        if game_id is None:
+            return PromptHistory().format(messages, include_body, count, start)
+
+        history = self._histories.get(game_id)
+        if history is None:
+            history = PromptHistory()
+            self._histories[game_id] = history
+            while len(self._histories) > self.max_games:
+                self._histories.popitem(last=False)
+        else:
+            self._histories.move_to_end(game_id)
+        return history.format(messages, include_body, count, start)
+
+    def release(self, game_id):
+        """游戏结束或被淘汰后删除缓存"""
+        self._histories.pop(game_id, None)
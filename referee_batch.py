@@ -0,0 +1,118 @@
+"""
+高负载时合并格式检查
+同时进行的病人消息格式检查达到一定数量时，新的检查不再各自调用LLM裁判，而是在很短的时间窗口内收集起来，
+合并为一次批量裁判；负载低时逐条检查，不等待窗口。
+批量裁判不受任何一个游戏回合预算的限制，每个等待者只等待自己游戏回合剩余的预算。
+所有方法都在引擎事件循环中调用，计数和待处理列表不需要加锁
+"""
+
+import asyncio
+from contextlib import contextmanager
+
+class RefereeBatcher:
+    """收集同时进行的格式检查，按时间窗口或数量上限合并为批量裁判"""
+
+    def __init__(self, judge_batch, min_concurrency=16, window_seconds=0.02, max_items=20):
+        """
+        Args:
+            judge_batch: 批量裁判的协程函数，参数为[(消息, 发送者, 正确的诊断)]和与之对应的游戏ID列表，
+                返回与之对应的结论列表
+            min_concurrency: 同时进行的检查达到这个数量时开始合并，0表示不合并
+            window_seconds: 收集同一批检查的时间窗口（秒）
+            max_items: 每批最多的检查数量，达到时不等窗口结束立即发出
+        """
+        self.judge_batch = judge_batch
+        self.min_concurrency = min_concurrency
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self._active = 0  # 正在进行的检查数量（包括逐条检查和合并的检查）
+        self._pending = []  # [(检查内容, 游戏ID, future)]
+        self._flush_handle = None
+        self._tasks = set()
+        # 统计数据
+        self.batches = 0
+        self.batched_items = 0
+        self.timeouts = 0  # 等待者超过自己的预算、没有等到结论的次数
+
+    @contextmanager
+    def track(self):
+        """在一次检查的整个过程中计入正在进行的检查"""
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+
+    def busy(self):
+        """正在进行的检查是否已达到合并的门槛"""
+        return self.min_concurrency > 0 and self._active >= self.min_concurrency
+
+    async def submit(self, item, game_id=None, timeout=None):
+        """
+        把一次检查加入当前批次，等待批量裁判的结论
+
+        Args:
+            item: (消息, 发送者, 正确的诊断)
+            game_id: 这次检查所属的游戏ID，用于记录日志
+            timeout: 最多等待的时间（秒），通常为游戏回合剩余的预算，为None时不限制
+
+        Returns:
+            这条消息的结论
+
+        Raises:
+            asyncio.TimeoutError: 超过timeout仍未得到结论，批量裁判继续进行，不影响其他等待者
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, game_id, future))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            # 等待者超时或被取消后不再读取结论，取消future让批量裁判跳过它，出错时不会留下无人读取的异常
+            future.cancel()
+
+    def stats(self):
+        """合并的统计数据"""
+        return {
+            "active": self._active,
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "avg_batch_size": self.batched_items / self.batches if self.batches else 0,
+            "timeouts": self.timeouts,
+            "min_concurrency": self.min_concurrency
+        }
+
+    def _flush(self):
+        """发出当前批次"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batches += 1
+        self.batched_items += len(batch)
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        """执行批量裁判并把结论分发给各个等待者，出错时每个等待者都收到同一个异常"""
+        try:
+            verdicts = await self.judge_batch([item for item, _, _ in batch], [game_id for _, game_id, _ in batch])
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), verdict in zip(batch, verdicts):
+            # 等待者可能已超时或被取消（例如客户端断开）
+            if not future.done():
+                future.set_result(verdict)
@@ -0,0 +1,237 @@
+"""
+裁判结论的解析
+裁判按要求输出JSON（诊断判断为{"correct": true/false}，格式检查为{"valid": true/false}）时用严格的JSON解析，
+只有回复不是预期的JSON时才退回到原来的文本匹配（"诊断正确: 是"和一组肯定、否定的表述）。
+文本匹配的表述预先合并为一个正则表达式，每次解析最多匹配两次。
+批量裁判的回复只接受带编号的JSON（{"verdicts": [{"index": 0, "ok": true}, ...]}），没有文本匹配的退路
+"""
+
+import re
+import json
+import threading
+
+# 诊断判断的结构化输出格式
+DIAGNOSIS_SCHEMA = {
+    "name": "diagnosis_verdict",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"correct": {"type": "boolean"}},
+        "required": ["correct"],
+        "additionalProperties": False
+    }
+}
+
+# 格式检查的结构化输出格式
+FORMAT_SCHEMA = {
+    "name": "format_verdict",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"valid": {"type": "boolean"}},
+        "required": ["valid"],
+        "additionalProperties": False
+    }
+}
+
+# 批量裁判的结构化输出格式，每条消息按编号给出结论
+BATCH_SCHEMA = {
+    "name": "batch_verdicts",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "verdicts": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"index": {"type": "integer"}, "ok": {"type": "boolean"}},
+                    "required": ["index", "ok"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["verdicts"],
+        "additionalProperties": False
+    }
+}
+
+def _any_of(patterns):
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+# 诊断判断的文本表述（先检查否定表述，没有否定表述时再检查肯定表述）
+DIAGNOSIS_CORRECT = _any_of([
+    r'诊断正确\s*[:：]?\s*(是|正确|对|没错|确实|肯定)',
+    r'正确诊断\s*[:：]?\s*(是|正确|对|没错|确实|肯定)',
+    r'诊断(是|正确|对|没错|确实|肯定)(正确|对|没错)',
+    r'医生(正确|准确)地?诊断',
+    r'医生的诊断是正确的',
+    r'诊断结果(正确|准确|符合)',
+    r'(正确|准确)地?判断出了?疾病'
+])
+DIAGNOSIS_INCORRECT = _any_of([
+    r'诊断正确\s*[:：]?\s*(否|不正确|不对|错误|不准确)',
+    r'诊断不正确',
+    r'诊断错误',
+    r'没有正确诊断',
+    r'医生没有(正确|准确)诊断',
+    r'医生的诊断(不正确|不准确|有误|错误)'
+])
+
+# 格式检查的文本表述
+FORMAT_VALID = _any_of([
+    r'符合要求\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+    r'符合规则\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+    r'合理性\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+    r'(合理|正确|恰当|适当)\s*[:：]?\s*(是|正确|合理|可以|没问题|通过)',
+    r'回复(合理|正确|恰当|适当)',
+    r'没有问题',
+    r'可以接受'
+])
+FORMAT_INVALID = _any_of([
+    r'符合要求\s*[:：]?\s*(否|不正确|不合理|不可以|有问题|不通过)',
+    r'不符合要求',
+    r'不合理',
+    r'有问题',
+    r'不恰当',
+    r'不适当'
+])
+
+# 最常见的回复形式（只有一个布尔字段的JSON对象），不需要完整的JSON解析
+_SIMPLE_JSON = re.compile(r'\{\s*"(\w+)"\s*:\s*(true|false)\s*\}')
+
+def parse_json_verdict(text, key):
+    """
+    严格解析JSON格式的结论
+
+    回复可以带有```json代码块或前后的说明文字，但其中的JSON对象必须包含布尔类型的key
+
+    Args:
+        text: 裁判的回复
+        key: 结论字段名（correct或valid）
+
+    Returns:
+        True/False，回复不是预期的JSON时返回None
+    """
+    text = text.strip()
+    simple = _SIMPLE_JSON.fullmatch(text)
+    if simple:
+        return simple.group(2) == "true" if simple.group(1) == key else None
+    if not text.startswith("{"):
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            return None
+        text = text[start:end + 1]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    value = data.get(key) if isinstance(data, dict) else None
+    return value if isinstance(value, bool) else None
+
+def parse_batch_entries(text, count):
+    """
+    解析批量裁判的回复，取出每条消息的结论对象
+
+    Args:
+        text: 裁判的回复
+        count: 这一批消息的数量
+
+    Returns:
+        长度为count的列表，每项为回复中这条消息的结论对象（如{"index": 0, "ok": true}）；
+        回复中缺少、编号超出范围或ok不是布尔值的项为None
+    """
+    found = [None] * count
+    text = text.strip()
+    if not text.startswith(("{", "[")):
+        start, end = text.find("{"), text.rfind("}")
+        if start < 0 or end < start:
+            return found
+        text = text[start:end + 1]
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return found
+    entries = data.get("verdicts") if isinstance(data, dict) else data
+    if not isinstance(entries, list):
+        return found
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        index, ok = entry.get("index"), entry.get("ok")
+        # bool是int的子类，编号不能是true/false
+        if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < count and isinstance(ok, bool):
+            found[index] = entry
+    return found
+
+def parse_batch_verdicts(text, count):
+    """
+    解析批量裁判的回复
+
+    Returns:
+        长度为count的列表，每项为True/False；回复中缺少、编号超出范围或不是布尔值的项为None
+    """
+    return [None if entry is None else entry["ok"] for entry in parse_batch_entries(text, count)]
+
+def parse_text_verdict(text, exact, positive, negative):
+    """
+    用原来的文本匹配解析结论：包含标准格式时为肯定；否则有否定表述时为否定，有肯定表述时为肯定
+
+    Returns:
+        (结论, 是否匹配到了任何表述)
+    """
+    if exact in text:
+        return True, True
+    if negative.search(text):
+        return False, True
+    if positive.search(text):
+        return True, True
+    return False, False
+
+class VerdictParser:
+    """解析裁判的诊断判断和格式检查结论，并统计各种解析方式的次数"""
+
+    def __init__(self):
+        # 统计数据
+        self.json = 0  # 按JSON解析成功的次数
+        self.text = 0  # 退回文本匹配并匹配到表述的次数
+        self.unparsed = 0  # 两种方式都无法解析、按默认结论处理的次数
+        self.batch_items = 0  # 批量裁判中解析出结论的消息数量
+        self.batch_missing = 0  # 批量裁判中缺少结论、需要逐条重新判断的消息数量
+        self._lock = threading.Lock()
+
+    def diagnosis(self, text):
+        """解析诊断判断，无法解析时视为诊断不正确"""
+        return self._parse(text, "correct", "诊断正确: 是", DIAGNOSIS_CORRECT, DIAGNOSIS_INCORRECT)
+
+    def format(self, text):
+        """解析格式检查，无法解析时视为不符合要求"""
+        return self._parse(text, "valid", "符合要求: 是", FORMAT_VALID, FORMAT_INVALID)
+
+    def batch(self, text, count):
+        """解析批量裁判的回复，返回每条消息的结论对象（见parse_batch_entries），缺少结论的项为None"""
+        entries = parse_batch_entries(text, count)
+        missing = entries.count(None)
+        with self._lock:
+            self.batch_items += count - missing
+            self.batch_missing += missing
+        return entries
+
+    def stats(self):
+        """解析方式的统计数据"""
+        with self._lock:
+            return {"json": self.json, "text": self.text, "unparsed": self.unparsed,
+                    "batch_items": self.batch_items, "batch_missing": self.batch_missing}
+
+    def _parse(self, text, key, exact, positive, negative):
+        verdict = parse_json_verdict(text, key)
+        if verdict is not None:
+            self._count("json")
+            return verdict
+        verdict, matched = parse_text_verdict(text, exact, positive, negative)
+        self._count("text" if matched else "unparsed")
+        return verdict
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+用批量裁判重新检查保存的对话记录
+用法: python revalidate_transcripts.py [对话记录目录或文件 ...]
+
+所有记录中的医生和病人消息合并后按token预算分批交给LLM裁判，列出与记录中的结果不一致的消息：
+- 医生消息：游戏在这条消息后结束，裁判却认为诊断不正确；或者游戏没有结束，裁判却认为诊断正确
+- 病人消息：已经发给医生，裁判却认为不符合格式要求
+"""
+
+import os
+import sys
+import glob
+import time
+
+from game_engine import judge_batch
+from transcript import read_transcript
+
+def collect_items(paths):
+    """
+    读取对话记录，返回 (批量裁判的消息列表, [(记录文件, 消息, 发送者, 记录中的结果)])
+
+    无法确定诊断的记录会被跳过
+    """
+    items, records = [], []
+    for path in paths:
+        messages, diagnosis = read_transcript(path)
+        if diagnosis is None:
+            print(f"跳过 {path}：记录中没有诊断")
+            continue
+        for i, msg in enumerate(messages):
+            if msg["sender"] == "doctor":
+                # 医生消息后面紧接着恭喜的系统消息时，这条消息当时被判定为诊断正确
+                recorded = i + 1 < len(messages) and messages[i + 1]["sender"] == "system"
+            elif msg["sender"] == "patient":
+                recorded = True
+            else:
+                continue
+            items.append((msg["content"], msg["sender"], diagnosis))
+            records.append((path, msg["content"], msg["sender"], recorded))
+    return items, records
+
+def main():
+    targets = sys.argv[1:] or ["conversations"]
+    paths = []
+    for target in targets:
+        paths.extend(sorted(glob.glob(os.path.join(target, "*.txt"))) if os.path.isdir(target) else [target])
+
+    items, records = collect_items(paths)
+    if not items:
+        print("没有需要检查的消息")
+        return
+
+    start = time.perf_counter()
+    verdicts = judge_batch(items)
+    elapsed = time.perf_counter() - start
+
+    mismatches = [(record, verdict) for record, verdict in zip(records, verdicts) if verdict != record[3]]
+    print(f"检查了{len(paths)}个对话记录中的{len(items)}条消息，耗时{elapsed:.1f}秒")
+    for (path, content, sender, recorded), verdict in mismatches:
+        if sender == "doctor":
+            result = "裁判认为诊断正确，游戏没有结束" if verdict else "裁判认为诊断不正确，游戏却已结束"
+        else:
+            result = "裁判认为不符合格式要求"
+        print(f"{os.path.basename(path)} | {'医生' if sender == 'doctor' else '病人'}：{content} | {result}")
+    print(f"不一致的消息: {len(mismatches)}条")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+询问身体标记的清理
+病人通过 [询问身体:xxx]（或旧格式 [询问身体] xxx）向身体提问，这些标记不应出现在对话记录和返回给前端的消息中。
+所有正则表达式在这里预先编译，新旧两种格式合并为一个表达式，一次替换完成清理；
+清理后的内容以SanitizedText保存，再次遇到时无需重新匹配
+"""
+
+import re
+
+from message_log import replace_message
+
+# 清理用的合并表达式：
+# [询问身体:xxx]或[询问身体：xxx]格式，包括可能的空格和换行，同时支持中英文冒号；
+# 或旧格式[询问身体]，后面可能跟着冒号
+INQUIRY_PATTERN = re.compile(r'\s*\[\s*询问身体\s*(?:[：:]\s*.*?\]\s*|\]\s*[：:]?\s*)')
+
+# 提取询问内容：新格式取方括号内冒号之后的内容
+INQUIRY_CONTENT_PATTERN = re.compile(r'\s*\[\s*询问身体\s*[：:]\s*(.*?)\]\s*')
+
+# 提取询问内容：旧格式取[询问身体]之后的内容
+OLD_INQUIRY_CONTENT_PATTERN = re.compile(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*(.*)')
+
+class SanitizedText(str):
+    """已经清理过询问身体标记的文本，行为与普通字符串相同，序列化为JSON时也是普通字符串"""
+
+def strip_inquiry(text):
+    """
+    清理文本中的询问身体标记并去除首尾空白
+
+    Args:
+        text: 病人消息内容
+
+    Returns:
+        清理后的内容（SanitizedText）
+    """
+    if isinstance(text, SanitizedText):
+        return text
+    if "询问身体" not in text:
+        return SanitizedText(text.strip())
+    return SanitizedText(INQUIRY_PATTERN.sub('', text).strip())
+
+def extract_inquiry(text):
+    """
+    提取病人向身体询问的内容
+
+    Args:
+        text: 病人消息内容
+
+    Returns:
+        询问内容，没有询问或询问内容为空时返回None
+    """
+    if "询问身体" not in text:
+        return None
+    match = INQUIRY_CONTENT_PATTERN.search(text)
+    if match and match.group(1).strip():
+        return match.group(1).strip()
+    match = OLD_INQUIRY_CONTENT_PATTERN.search(text)
+    if match and match.group(1).strip():
+        return match.group(1).strip()
+    return None
+
+def sanitize_history(messages):
+    """
+    清理本轮新增的病人消息中的询问身体标记，不修改原来的消息列表和消息
+
+    之前各轮的病人消息在当时的系统节点中已经清理过，只需从末尾向前检查到最近一条医生消息为止；
+    病人节点生成的回复已经是SanitizedText，只做类型判断，不会重新匹配
+
+    Args:
+        messages: 消息列表
+
+    Returns:
+        清理后的消息列表（MessageLog），没有需要清理的消息时返回原列表
+    """
+    index = len(messages)
+    while index > 0:
+        index -= 1
+        msg = messages[index]
+        if msg["sender"] == "doctor":
+            break
+        if msg["sender"] == "patient" and not isinstance(msg["content"], SanitizedText):
+            # 只替换这一条消息，其余消息与原列表共享
+            messages = replace_message(messages, index, {**msg, "content": strip_inquiry(msg["content"])})
+    return messages
+
+def visible_message(msg, drop_empty=True):
+    """
+    返回给前端的一条消息：身体消息不返回，病人消息使用清理后的内容（不修改原消息）
+
+    Args:
+        msg: 消息
+        drop_empty: 是否不返回清理前为空的病人消息
+
+    Returns:
+        返回给前端的消息，不返回时为None
+    """
+    sender = msg["sender"]
+    if sender == "body":
+        return None
+    if sender == "patient":
+        if drop_empty and not msg["content"].strip():
+            return None
+        content = strip_inquiry(msg["content"])
+        if content != msg["content"]:
+            msg = dict(msg, content=content)
+    return msg
+
+def visible_messages(messages, drop_empty=True):
+    """
+    返回给前端的消息：去掉身体消息，病人消息使用清理后的内容（不修改原消息）
+
+    Args:
+        messages: 消息列表
+        drop_empty: 是否去掉清理前为空的病人消息
+
+    Returns:
+        消息列表
+    """
+    result = []
+    for msg in messages:
+        msg = visible_message(msg, drop_empty)
+        if msg is not None:
+            result.append(msg)
+    return result
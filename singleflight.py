@@ -0,0 +1,93 @@
+"""
+合并同时进行的相同调用
+第一个调用方执行调用，同时到达的相同调用方等待同一个结果；调用失败时所有等待者收到同一个异常，
+只属于第一个调用方的失败（例如它自己的回合预算用完）除外，等待者改为自己执行调用。
+每个调用方最多等待自己的超时时间，不受第一个调用方的限制。
+调用结束后（无论成功与否）立即移除记录，之后的调用重新执行。
+共享的结果保存在线程安全的concurrent.futures.Future中，不同线程、不同事件循环中的调用方都可以等待
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+
+class SingleFlight:
+    """按键合并同时进行的调用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # 键 -> 共享结果的Future
+        # 统计数据
+        self.leaders = 0  # 实际执行的调用次数
+        self.joined = 0  # 合并到已在进行的调用的次数
+
+    async def do(self, key, make_call, timeout=None, retry_on=()):
+        """
+        执行调用，或者等待正在进行的相同调用
+
+        调用在第一个调用方的事件循环中作为独立任务执行，任何调用方被取消或超时都不影响其他调用方
+
+        Args:
+            key: 调用的键
+            make_call: 无参数的协程函数，执行调用
+            timeout: 这个调用方最多等待的时间（秒），为None时不限制
+            retry_on: 只属于第一个调用方的异常类型，等待者收到时改为用自己的make_call重新执行
+
+        Returns:
+            (调用结果, 是否合并到了已在进行的调用)
+
+        Raises:
+            asyncio.TimeoutError: 超过timeout仍未得到结果
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._lock:
+                shared = self._calls.get(key)
+                joined = shared is not None
+                if joined:
+                    self.joined += 1
+                else:
+                    shared = concurrent.futures.Future()
+                    self._calls[key] = shared
+                    self.leaders += 1
+
+            if not joined:
+                try:
+                    task = asyncio.ensure_future(make_call())
+                except BaseException as e:
+                    self._finish(key, shared, None, e)
+                    raise
+                task.add_done_callback(lambda done, shared=shared: self._finish(key, shared, done))
+            # shield避免等待者被取消或超时时连带取消共享的结果
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(shared)), remaining), joined
+            except retry_on:
+                if not joined:
+                    raise
+                # 只属于第一个调用方的失败，重新执行（可能成为新的第一个调用方）
+
+    def in_flight(self):
+        """正在进行的调用数量"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """合并的统计数据"""
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "joined": self.joined}
+
+    def _finish(self, key, shared, task, error=None):
+        """先移除记录再公布结果，公布之后到达的调用方会重新执行调用"""
+        with self._lock:
+            if self._calls.get(key) is shared:
+                del self._calls[key]
+        if task is None:
+            shared.set_exception(error)
+        elif task.cancelled():
+            shared.cancel()
+        elif task.exception() is not None:
+            shared.set_exception(task.exception())
+        else:
+            shared.set_result(task.result())
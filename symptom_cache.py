@@ -0,0 +1,147 @@
+"""
+初始症状缓存
+按疾病缓存若干个不同的初始症状描述，缓存满后随机取用其中一个，
+既能跨游戏复用，又保持游戏的多样性
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from collections import OrderedDict
+
+class SymptomCache:
+    """
+    按疾病缓存的初始症状变体
+
+    每种疾病最多保存variants_per_disease个变体，变体数量不足时get返回None，
+    由调用方生成新的变体；超过ttl_seconds的变体会被淘汰；
+    疾病数量超过max_diseases时淘汰最久未使用的疾病
+    """
+
+    def __init__(self, variants_per_disease=3, ttl_seconds=86400, max_diseases=100, persist_path=None):
+        """
+        Args:
+            variants_per_disease: 每种疾病保存的变体数量
+            ttl_seconds: 变体的有效期（秒）
+            max_diseases: 最多缓存的疾病数量
+            persist_path: 持久化文件路径，为空时不保存到磁盘
+        """
+        self.variants_per_disease = max(1, variants_per_disease)
+        self.ttl_seconds = ttl_seconds
+        self.max_diseases = max(1, max_diseases)
+        self.persist_path = persist_path
+
+        # 统计数据
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # {疾病: [{"content": 症状描述, "created_at": 生成时间}]}，按最近使用排序
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if persist_path:
+            self._load()
+
+    def get(self, diagnosis):
+        """
+        获取一个缓存的初始症状
+
+        Args:
+            diagnosis: 疾病名称
+
+        Returns:
+            随机选取的症状描述；变体数量还不足时返回None
+        """
+        with self._lock:
+            variants = self._fresh_variants(diagnosis)
+            if len(variants) < self.variants_per_disease:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(diagnosis)
+            self.hits += 1
+            return random.choice(variants)["content"]
+
+    def variant_count(self, diagnosis):
+        """当前缓存的某种疾病的有效变体数量"""
+        with self._lock:
+            return len(self._fresh_variants(diagnosis))
+
+    def add(self, diagnosis, content):
+        """
+        添加一个新生成的初始症状变体，变体已满时忽略
+
+        Args:
+            diagnosis: 疾病名称
+            content: 症状描述
+        """
+        with self._lock:
+            variants = self._fresh_variants(diagnosis)
+            if len(variants) >= self.variants_per_disease or any(v["content"] == content for v in variants):
+                return
+            variants.append({"content": content, "created_at": time.time()})
+            self._entries[diagnosis] = variants
+            self._entries.move_to_end(diagnosis)
+
+            while len(self._entries) > self.max_diseases:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            if self.persist_path:
+                self._save()
+
+    def clear(self):
+        """清空缓存（不删除持久化文件）"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """缓存的统计数据"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "diseases": len(self._entries),
+                "variants": sum(len(variants) for variants in self._entries.values())
+            }
+
+    def _fresh_variants(self, diagnosis):
+        """返回某种疾病未过期的变体，并淘汰过期的变体，调用方需持有锁"""
+        variants = self._entries.get(diagnosis)
+        if not variants:
+            return []
+        deadline = time.time() - self.ttl_seconds
+        fresh = [v for v in variants if v["created_at"] >= deadline]
+        if len(fresh) != len(variants):
+            self.evictions += len(variants) - len(fresh)
+            if fresh:
+                self._entries[diagnosis] = fresh
+            else:
+                del self._entries[diagnosis]
+        return fresh
+
+    def _load(self):
+        """从持久化文件加载缓存"""
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for diagnosis, variants in data.items():
+                self._entries[diagnosis] = variants[:self.variants_per_disease]
+            print(f"已加载初始症状缓存: {len(self._entries)}个疾病")
+        except Exception as e:
+            print(f"加载初始症状缓存失败: {e}")
+
+    def _save(self):
+        """把缓存写入持久化文件（先写临时文件再替换，避免写到一半的文件），调用方需持有锁"""
+        tmp_path = self.persist_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.persist_path)
+        except Exception as e:
+            print(f"保存初始症状缓存失败: {e}")
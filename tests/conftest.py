@@ -9,12 +9,18 @@
 import pytest
 import os
 import sys
+import re
+import json
 import uuid
+import time
+import asyncio
+from types import SimpleNamespace
 from unittest.mock import patch
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import game_engine
 from api import app, active_games, recent_requests, api_logs
 from config import GAME_CONFIG
 
@@ -50,12 +56,8 @@ def test_game_id():
     return str(uuid.uuid4())
 
 @pytest.fixture
-def test_game_state(test_game_id):
-    """创建测试游戏状态"""
-    # 设置较小的对话轮数限制，方便测试
-    GAME_CONFIG["max_conversation_turns"] = 3
-    
-    # 创建游戏状态
+def started_game(test_game_id):
+    """创建轮到医生发言的流感游戏（病人已经向医生问好），返回游戏ID"""
     active_games[test_game_id] = {
         "messages": [
             {"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"},
@@ -71,3 +73,68 @@ def test_game_state(test_game_id):
     api_logs[test_game_id] = []
     
     return test_game_id
+
+@pytest.fixture
+def test_game_state(started_game):
+    """创建测试游戏状态"""
+    # 设置较小的对话轮数限制，方便测试
+    GAME_CONFIG["max_conversation_turns"] = 3
+    
+    return started_game
+
+class FakeLLM:
+    """模拟的LLM接口，记录调用并按提示内容返回预设回复"""
+
+    def __init__(self):
+        self.calls = []  # [(系统消息, 用户消息)]
+        self.intervals = []  # 每次调用的(开始时间, 返回时间)，与calls一一对应
+        self.delay = 0  # 每次调用的模拟延迟（秒）
+        self.token_delay = 0  # 流式调用时每个片段的模拟延迟（秒）
+
+    def reply(self, system_message, prompt):
+        """默认回复：诊断判断为否，格式检查为是（提示要求输出JSON时按JSON回复，批量裁判按编号回复），其余为普通病人回复"""
+        if '"verdicts"' in prompt:
+            items = re.findall(r"^\[(\d+)\] 发送者: (医生|病人)", prompt, re.M)
+            return json.dumps({"verdicts": [{"index": int(index), "ok": sender == "病人"} for index, sender in items]})
+        if '"correct"' in prompt:
+            return '{"correct": false}'
+        if '"valid"' in prompt:
+            return '{"valid": true}'
+        if "诊断正确" in prompt:
+            return "诊断正确: 否"
+        if "符合要求" in prompt:
+            return "符合要求: 是"
+        return "医生，我头有点疼。"
+
+    async def create(self, model=None, messages=None, **kwargs):
+        system_message = messages[0]["content"]
+        prompt = messages[-1]["content"]
+        self.calls.append((system_message, prompt))
+        start = time.perf_counter()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        content = self.reply(system_message, prompt)
+        self.intervals.append((start, time.perf_counter()))
+        if kwargs.get("stream"):
+            return self._stream(content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+    async def _stream(self, content):
+        """按字符逐段返回流式回复"""
+        for char in content:
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=char))])
+
+@pytest.fixture
+def fake_llm():
+    """用FakeLLM替换异步OpenAI客户端，前后清空LLM响应缓存"""
+    def clear_caches():
+        game_engine.llm_response_cache.clear()
+        game_engine.initial_symptoms_cache.clear()
+
+    clear_caches()
+    fake = FakeLLM()
+    with patch.object(game_engine.async_client.chat.completions, "create", fake.create):
+        yield fake
+    clear_caches()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试API调用日志的JSONL存储
+"""
+
+import json
+import time
+import threading
+import pytest
+from api_log_store import append_api_log, read_api_logs, convert_to_json, ApiLogSink
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_append_and_read_roundtrip(tmp_path):
+    """测试追加写入后可以读回列表视图"""
+    log_file = str(tmp_path / "api_calls_test.jsonl")
+    for i in range(3):
+        append_api_log(log_file, {"call_id": str(i), "output": f"回复{i}"})
+
+    logs = read_api_logs(log_file)
+    assert [log["call_id"] for log in logs] == ["0", "1", "2"]
+    assert logs[2]["output"] == "回复2"
+
+def test_read_skips_truncated_line(tmp_path):
+    """测试写了一半的最后一行会被跳过"""
+    log_file = tmp_path / "api_calls_test.jsonl"
+    append_api_log(str(log_file), {"call_id": "a"})
+    with open(log_file, "a", encoding="utf-8") as f:
+        f.write('{"call_id": "b", "out')
+
+    assert read_api_logs(str(log_file)) == [{"call_id": "a"}]
+
+def test_read_legacy_json_array(tmp_path):
+    """测试兼容旧的JSON数组日志文件"""
+    log_file = tmp_path / "api_calls_test.json"
+    log_file.write_text(json.dumps([{"call_id": "a"}, {"call_id": "b"}]), encoding="utf-8")
+
+    assert len(read_api_logs(str(log_file))) == 2
+
+def test_convert_to_json(tmp_path):
+    """测试JSONL日志可转换为旧格式的JSON数组文件"""
+    log_file = str(tmp_path / "api_calls_test.jsonl")
+    append_api_log(log_file, {"call_id": "a"})
+    append_api_log(log_file, {"call_id": "b"})
+
+    output = convert_to_json(log_file)
+    assert output.endswith("api_calls_test.json")
+    with open(output, "r", encoding="utf-8") as f:
+        assert json.load(f) == [{"call_id": "a"}, {"call_id": "b"}]
+
+def test_sink_batches_and_flushes(tmp_path):
+    """测试后台写入器按批写入并能等待写盘完成"""
+    log_file = str(tmp_path / "api_calls_sink.jsonl")
+    sink = ApiLogSink(batch_size=10, flush_interval_ms=50)
+    for i in range(25):
+        assert sink.submit(log_file, {"call_id": str(i)})
+
+    sink.flush()
+    assert [log["call_id"] for log in read_api_logs(log_file)] == [str(i) for i in range(25)]
+    assert sink.written == 25
+    sink.close()
+
+def test_sink_close_writes_pending_records(tmp_path):
+    """测试关闭写入器时会写完队列中剩余的日志"""
+    log_file = str(tmp_path / "api_calls_sink.jsonl")
+    sink = ApiLogSink(batch_size=1000, flush_interval_ms=10000)
+    for i in range(5):
+        sink.submit(log_file, {"call_id": str(i)})
+
+    sink.close()
+    assert len(read_api_logs(log_file)) == 5
+
+def test_sink_close_races_with_submit(tmp_path):
+    """测试关闭写入器与提交日志同时进行时不会丢失日志"""
+    log_file = str(tmp_path / "api_calls_sink.jsonl")
+    sink = ApiLogSink(batch_size=1000, flush_interval_ms=10000)
+    sink.submit(log_file, {"call_id": "start"})
+    barrier = threading.Barrier(5)
+
+    def worker(i):
+        barrier.wait()
+        for j in range(100):
+            sink.submit(log_file, {"call_id": f"{i}-{j}"})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    sink.close()
+    for thread in threads:
+        thread.join()
+
+    assert len(read_api_logs(log_file)) == 1 + 4 * 100
+
+def test_sink_drops_when_queue_full(tmp_path):
+    """测试队列写满时按drop策略丢弃新日志"""
+    release = threading.Event()
+
+    class BlockedSink(ApiLogSink):
+        def _write_batch(self, batch):
+            release.wait(5)
+            super()._write_batch(batch)
+
+    log_file = str(tmp_path / "api_calls_sink.jsonl")
+    sink = BlockedSink(batch_size=1, flush_interval_ms=0, max_queue_size=1)
+    sink.submit(log_file, {"call_id": "0"})
+    # 等待写入线程取走第一条并阻塞在写盘上
+    while sink._queue.qsize():
+        time.sleep(0.01)
+    assert sink.submit(log_file, {"call_id": "1"})
+    assert not sink.submit(log_file, {"call_id": "2"})
+    assert sink.dropped == 1
+
+    release.set()
+    sink.close()
+    assert [log["call_id"] for log in read_api_logs(log_file)] == ["0", "1"]
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试异步游戏引擎和异步接口
+"""
+
+import json
+import time
+import asyncio
+import threading
+import pytest
+import api
+from game_engine import ainvoke_llm, patient_node, run_in_engine
+from api import active_games
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_sync_node_wraps_async_node(fake_llm):
+    """测试同步节点函数通过引擎事件循环执行异步节点"""
+    state = {
+        "messages": [
+            {"sender": "system", "content": "游戏开始"},
+            {"sender": "patient", "content": "医生您好"},
+            {"sender": "doctor", "content": "您哪里不舒服？"}
+        ],
+        "current_sender": "patient",
+        "diagnosis": "流感",
+        "game_over": False
+    }
+
+    new_state = patient_node(state)
+    assert new_state["messages"][-1] == {"sender": "patient", "content": "医生，我头有点疼。"}
+    assert new_state["current_sender"] == "system"
+
+def test_concurrent_llm_calls_overlap(fake_llm):
+    """测试多个LLM调用在引擎事件循环中并发执行"""
+    fake_llm.delay = 0.2
+
+    async def run_many():
+        return await asyncio.gather(*[
+            ainvoke_llm(f"并发测试提示{i}", "系统消息") for i in range(50)
+        ])
+
+    start = time.perf_counter()
+    results = asyncio.run(run_in_engine(run_many()))
+    elapsed = time.perf_counter() - start
+
+    assert len(results) == 50
+    assert len(fake_llm.calls) == 50
+    # 串行执行需要10秒，并发执行应接近单次延迟
+    assert elapsed < 2
+
+def test_async_send_message_endpoint(fake_llm, started_game, client):
+    """测试异步发送消息接口"""
+    response = client.post('/api/async/send_message',
+                           json={'game_id': started_game, 'message': '您哪里不舒服？'})
+    data = json.loads(response.data)
+
+    assert response.status_code == 200
+    assert data["current_sender"] == "doctor"
+    assert data["messages"][-1] == {"sender": "patient", "content": "医生，我头有点疼。"}
+    assert active_games[started_game]["turn_count"] == 1
+
+def test_blocking_io_runs_off_engine_loop(fake_llm, started_game, client, monkeypatch):
+    """测试游戏状态的读写和对话记录的保存不在引擎事件循环的线程中执行"""
+    async def engine_thread():
+        return threading.get_ident()
+
+    engine = asyncio.run(run_in_engine(engine_thread()))
+    threads = []
+
+    def record(func):
+        def wrapper(*args, **kwargs):
+            threads.append((func.__name__, threading.get_ident()))
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(api.game_store, "load", record(api.game_store.load))
+    monkeypatch.setattr(api.game_store, "save", record(api.game_store.save))
+    monkeypatch.setattr(api, "auto_save_conversation", record(api.auto_save_conversation))
+
+    response = client.post('/api/async/send_message', json={'game_id': started_game, 'message': '您哪里不舒服？'})
+    assert response.status_code == 200
+    assert sorted(name for name, _ in threads) == ["auto_save_conversation", "load", "save"]
+    assert all(thread != engine for _, thread in threads)
+
+def test_asgi_new_game(fake_llm, clean_state):
+    """测试ASGI入口直接由异步引擎创建游戏"""
+    from asgi import application
+
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/api/new_game", "client": ("127.0.0.9", 0)}
+    asyncio.run(application(scope, receive, send))
+
+    assert sent[0]["status"] == 200
+    data = json.loads(sent[1]["body"])
+    assert data["game_id"] in active_games
+    assert data["current_sender"] == "doctor"
+    assert data["messages"][-1]["sender"] == "patient"
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试长对话的上下文管理
+"""
+
+import asyncio
+import pytest
+from prompt_history import PromptHistoryCache
+from context_window import ContextManager, estimate_tokens
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def make_messages(turns):
+    messages = [{"sender": "system", "content": "游戏开始"}]
+    for i in range(turns):
+        messages.append({"sender": "doctor", "content": f"问题{i}"})
+        messages.append({"sender": "patient", "content": f"回答{i}"})
+    return messages
+
+class FakeSummarizer:
+    """记录调用并返回合并后的摘要"""
+
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, game_id, previous_summary, formatted_messages):
+        self.calls.append((previous_summary, formatted_messages))
+        if self.fail:
+            raise RuntimeError("LLM不可用")
+        return f"摘要{len(self.calls)}"
+
+def build(manager, game_id, messages, **kwargs):
+    return asyncio.run(manager.abuild(game_id, messages, **kwargs))
+
+def test_estimate_tokens():
+    """测试中文按字符、英文按每4个字符估计token"""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("头痛") == 2
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("头痛abc") == 3
+
+def test_short_game_uses_full_history():
+    """测试没有超出窗口时使用完整的对话历史，不生成摘要"""
+    summarize = FakeSummarizer()
+    manager = ContextManager(PromptHistoryCache(), summarize, window_messages=10, summary_interval_turns=2)
+    messages = make_messages(4)
+    assert build(manager, "g", messages) == "\n".join(f"{m['sender']}: {m['content']}" for m in messages)
+    assert summarize.calls == []
+
+def test_summary_is_regenerated_lazily():
+    """测试窗口之外累积足够轮数后才生成摘要，摘要之后的消息保留原文"""
+    summarize = FakeSummarizer()
+    manager = ContextManager(PromptHistoryCache(), summarize, window_messages=4, summary_interval_turns=2)
+
+    # 窗口之外只有1轮对话，还不生成摘要
+    build(manager, "g", make_messages(3))
+    assert summarize.calls == []
+
+    messages = make_messages(4)
+    history = build(manager, "g", messages)
+    assert len(summarize.calls) == 1
+    assert summarize.calls[0] == ("", "system: 游戏开始\ndoctor: 问题0\npatient: 回答0\ndoctor: 问题1\npatient: 回答1")
+    assert history.startswith("[之前对话的摘要]\n摘要1\n")
+    assert history.endswith("doctor: 问题2\npatient: 回答2\ndoctor: 问题3\npatient: 回答3")
+
+    # 下一轮复用摘要，再下一轮把新移出窗口的对话合并进摘要
+    build(manager, "g", make_messages(5))
+    assert len(summarize.calls) == 1
+    build(manager, "g", make_messages(6))
+    assert len(summarize.calls) == 2
+    assert summarize.calls[1] == ("摘要1", "doctor: 问题2\npatient: 回答2\ndoctor: 问题3\npatient: 回答3")
+    assert manager.stats()["summaries"] == 2
+
+def test_summary_failure_keeps_messages():
+    """测试生成摘要失败时保留原文"""
+    summarize = FakeSummarizer(fail=True)
+    manager = ContextManager(PromptHistoryCache(), summarize, window_messages=4, summary_interval_turns=2)
+    messages = make_messages(4)
+    history = build(manager, "g", messages)
+    assert "摘要" not in history
+    assert history.startswith("system: 游戏开始")
+    assert manager.stats()["summary_failures"] == 1
+
+def test_summary_not_used_for_other_messages():
+    """测试消息被替换后不再使用旧的摘要，释放游戏后删除摘要"""
+    summarize = FakeSummarizer()
+    manager = ContextManager(PromptHistoryCache(), summarize, window_messages=4, summary_interval_turns=10)
+    manager._summaries["g"] = ("旧摘要", 3, ("patient", "回答0"))
+
+    assert build(manager, "g", make_messages(3)).startswith("[之前对话的摘要]\n旧摘要")
+    other = make_messages(3)
+    other[2] = {"sender": "patient", "content": "替换后的回答"}
+    assert "旧摘要" not in build(manager, "g", other)
+
+    manager.release("g")
+    assert manager.stats()["games_with_summary"] == 0
+
+def test_token_budget_trims_oldest_messages():
+    """测试超过token上限时从最早的消息开始截断，至少保留最后一条消息"""
+    manager = ContextManager(PromptHistoryCache(), FakeSummarizer(), window_messages=0, max_history_tokens=30)
+    messages = make_messages(10)
+    history = build(manager, "g", messages)
+    assert history.startswith("（更早的对话已省略）\n")
+    assert history.endswith("patient: 回答9")
+    assert estimate_tokens(history.split("\n", 1)[1]) <= 30
+    assert manager.stats()["trimmed"] == 1
+
+    messages = [{"sender": "doctor", "content": "很长的问题" * 100}]
+    assert build(manager, "g", messages) == messages[0]["sender"] + ": " + messages[0]["content"]
+
+def test_without_body_and_prefix():
+    """测试不包含身体消息的视图和只使用前count条消息"""
+    manager = ContextManager(PromptHistoryCache(), FakeSummarizer(), window_messages=0, max_history_tokens=0)
+    messages = make_messages(2) + [{"sender": "body", "content": "发烧"}, {"sender": "patient", "content": "我发烧了"}]
+    assert "body" not in build(manager, "g", messages, include_body=False)
+    assert build(manager, "g", messages, count=len(messages) - 1).endswith("body: 发烧")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试基于规则的诊断匹配
+"""
+
+import json
+import pytest
+from config import GAME_CONFIG
+from diagnosis_matcher import DiagnosisMatcher
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+@pytest.fixture
+def matcher():
+    return DiagnosisMatcher(GAME_CONFIG["diseases"])
+
+@pytest.mark.parametrize("message,diagnosis", [
+    ("你得了流感", "流感"),
+    ("我的诊断是流行性感冒", "流感"),
+    ("你这是偏头疼，注意休息", "偏头痛"),
+    ("你患的是过敏性鼻炎", "过敏性鼻炎"),
+    ("诊断结果：Influenza", "流感"),
+    ("你有糖尿病", "糖尿病"),
+])
+def test_positive_goes_to_referee(matcher, message, diagnosis):
+    """测试明确说出正确疾病（包括别名）时规则判定为正确，但仍交给LLM裁判确认"""
+    assert matcher.match(message, diagnosis).correct is True
+    assert matcher.decide(message, diagnosis) is None
+
+@pytest.mark.parametrize("message", [
+    "我不认为是流感",
+    "我不认为你得的是流感",
+    "很难说是流感",
+    "我还不能确定你是流感",
+    "现在还没法诊断为流感",
+    "如果是流感会发烧",
+    "我不觉得是流感",
+    "你孩子是流感",
+])
+def test_never_decides_correct_locally(matcher, message):
+    """测试否定、不确定、假设和说的是别人的消息都不会在本地判定为诊断正确"""
+    result = matcher.decide(message, "流感")
+    assert result is None or result.correct is False
+
+@pytest.mark.parametrize("message", [
+    "我不认为是流感",
+    "我不认为你得的是流感",
+    "很难说是流感",
+    "我还不能确定你是流感",
+    "现在还没法诊断为流感",
+    "如果是流感会发烧",
+    "我不觉得是流感",
+])
+def test_negations_and_hedges(matcher, message):
+    """测试"不认为"、"难说"、"没法"、"如果"等表述不被当作明确的诊断"""
+    assert matcher.match(message, "流感").correct is False
+
+@pytest.mark.parametrize("message,diagnosis", [
+    ("你哪里不舒服？", "流感"),
+    ("肚子疼多久了", "胃溃疡"),
+    ("你患的是过敏性鼻炎", "流感"),
+    ("你得了中耳炎", "扁桃体炎"),
+    ("你不是流感，是肺炎", "流感"),
+    ("我认为你不是得了哮喘", "哮喘"),
+    ("可能是流感或者肺炎", "流感"),
+])
+def test_confident_negative(matcher, message, diagnosis):
+    """测试问诊问题、其他疾病、否定和列举多种可能时判定为不正确"""
+    assert matcher.decide(message, diagnosis).correct is False
+
+@pytest.mark.parametrize("message,diagnosis", [
+    ("是流感吗？", "流感"),
+    ("是不是扁桃体发炎了", "扁桃体炎"),
+    ("会不会是偏头痛", "偏头痛"),
+    ("不排除流感", "流感"),
+    ("我觉得你是感冒了", "流感"),
+    ("我的诊断是病毒引起的发热", "流感"),
+])
+def test_ambiguous_messages_go_to_referee(matcher, message, diagnosis):
+    """测试提问、不确定的表述和相近的说法交给LLM裁判"""
+    assert matcher.decide(message, diagnosis) is None
+
+def test_traditional_characters(matcher):
+    """测试繁体字写出的正确诊断不会被本地判定为不正确"""
+    assert matcher.match("你这是偏頭痛", "偏头痛").correct is True
+    assert matcher.match("你得了胃潰瘍", "胃溃疡").correct is True
+    assert matcher.decide("你这是偏頭痛", "偏头痛") is None
+
+@pytest.mark.parametrize("message", ["你这是头风病", "我的结论是某某综合征", "应该是神经痛"])
+def test_unknown_disease_names_go_to_referee(matcher, message):
+    """测试别名表中没有的疾病说法交给LLM裁判"""
+    assert matcher.decide(message, "偏头痛") is None
+
+def test_longest_name_wins(matcher):
+    """测试较长的疾病名称优先匹配，"过敏性鼻炎"不会被当作其他疾病"""
+    assert matcher.match("你这是过敏性鼻炎", "过敏性鼻炎").correct is True
+    assert matcher.match("流行性感冒", "流感").correct is True
+
+def test_stats(matcher):
+    """测试本地判断的统计数据"""
+    matcher.decide("你得了流感", "流感")
+    matcher.decide("你哪里不舒服？", "流感")
+    matcher.decide("是流感吗？", "流感")
+    stats = matcher.stats()
+    assert (stats["positives"], stats["negatives"], stats["deferred"]) == (1, 1, 2)
+    assert stats["llm_calls_avoided_rate"] == pytest.approx(1 / 3)
+
+def referee_calls(fake_llm):
+    return [prompt for _, prompt in fake_llm.calls if "诊断正确" in prompt]
+
+def test_send_message_skips_referee(fake_llm, started_game, client, monkeypatch):
+    """测试本地能确定诊断不正确的医生消息不调用LLM裁判，规则认为正确的消息由LLM裁判确认后才结束游戏"""
+    data = json.loads(client.post('/api/send_message',
+                                  json={'game_id': started_game, 'message': '您哪里不舒服？'}).data)
+    assert data["game_over"] is False
+    assert data["messages"][-1]["sender"] == "patient"
+    assert not referee_calls(fake_llm)
+
+    reply = fake_llm.reply
+    monkeypatch.setattr(fake_llm, "reply", lambda system, prompt: (
+        '{"correct": true}' if '"correct"' in prompt else reply(system, prompt)))
+    data = json.loads(client.post('/api/send_message',
+                                  json={'game_id': started_game, 'message': '你得的是流行性感冒'}).data)
+    assert data["game_over"] is True
+    assert len(referee_calls(fake_llm)) == 1
+
+def test_ambiguous_message_uses_referee(fake_llm, started_game, client):
+    """测试模棱两可的医生消息仍由LLM裁判判断"""
+    data = json.loads(client.post('/api/send_message',
+                                  json={'game_id': started_game, 'message': '是流感吗？'}).data)
+    assert data["game_over"] is False
+    assert len(referee_calls(fake_llm)) == 1
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试紧凑的游戏状态记录
+"""
+
+import json
+import copy
+import pytest
+from game_state import GameState, json_default
+from message_log import Message, MessageLog
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def make_state():
+    return {
+        "messages": [{"sender": "system", "content": "游戏开始"}, {"sender": "patient", "content": "我头疼"}],
+        "current_sender": "doctor",
+        "diagnosis": "流感",
+        "game_over": False,
+        "turn_count": 0
+    }
+
+def test_reads_and_writes_like_dict():
+    """测试按字典的方式读写，包括缺少的字段和额外的字段"""
+    state = GameState.from_mapping(make_state())
+    assert state == make_state()
+    assert isinstance(state["messages"], MessageLog)
+    assert isinstance(state["messages"][0], Message)
+
+    state["turn_count"] = 3
+    state["game_over"] = True
+    assert state["turn_count"] == 3 and state.get("game_over") is True
+
+    del state["turn_count"]
+    assert "turn_count" not in state
+    assert state.get("turn_count", 0) == 0
+    with pytest.raises(KeyError):
+        state["turn_count"]
+
+    state["custom"] = 1
+    assert state["custom"] == 1
+    assert list(state) == ["messages", "current_sender", "diagnosis", "game_over", "custom"]
+    assert {**state}["custom"] == 1
+
+def test_transient_fields_are_dropped():
+    """测试只在节点之间传递的系统笔记不保存"""
+    state = GameState.from_mapping({**make_state(), "system_notes": "医生消息已接收"})
+    assert "system_notes" not in state
+    assert GameState.from_mapping(state) is state
+
+def test_strings_are_interned():
+    """测试疾病名称和发送者在不同游戏之间共享同一个字符串对象"""
+    first = GameState.from_mapping(json.loads(json.dumps(make_state(), ensure_ascii=False)))
+    second = GameState.from_mapping(json.loads(json.dumps(make_state(), ensure_ascii=False)))
+    assert first["diagnosis"] is second["diagnosis"]
+    assert first["current_sender"] is second["current_sender"]
+    assert first["messages"][1]["sender"] is second["messages"][1]["sender"]
+
+def test_json_round_trip():
+    """测试与原来的JSON格式互相转换"""
+    state = GameState.from_mapping(make_state())
+    encoded = json.dumps(state, ensure_ascii=False, default=json_default)
+    assert json.loads(encoded) == make_state()
+    assert state.to_dict() == make_state()
+    assert type(state.to_dict()["messages"][0]) is dict
+    assert copy.deepcopy(state) == state
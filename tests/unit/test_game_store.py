@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试游戏状态存储
+"""
+
+import os
+import pytest
+import api
+from game_store import InMemoryGameStore, SQLiteGameStore, SQLiteDict, LockedDict, GameConflictError
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def make_state(game_over=False):
+    return {"messages": [{"sender": "system", "content": "游戏开始"}], "current_sender": "doctor",
+            "diagnosis": "流感", "game_over": game_over, "turn_count": 0}
+
+def test_capacity_evicts_finished_games_first():
+    """测试超出数量上限时优先淘汰已结束的游戏，再淘汰最久未访问的游戏"""
+    evicted = []
+    store = InMemoryGameStore(max_games=2, reap_interval_seconds=0,
+                              on_evict=lambda game_id, state, logs, meta: evicted.append(game_id))
+    store["a"] = make_state()
+    store["b"] = make_state(game_over=True)
+    store["c"] = make_state()
+    assert evicted == ["b"]
+
+    store["a"]
+    store["d"] = make_state()
+    assert evicted == ["b", "c"]
+    assert sorted(store) == ["a", "d"]
+    assert store.stats()["evictions"]["capacity"] == 2
+
+def test_reap_idle_and_finished_games():
+    """测试后台清理淘汰无人访问和已结束超时的游戏"""
+    store = InMemoryGameStore(idle_timeout_seconds=3600, finished_ttl_seconds=-1, reap_interval_seconds=0)
+    store["active"] = make_state()
+    store["over"] = make_state(game_over=True)
+    assert store.reap() == 1
+    assert list(store) == ["active"]
+
+    store.idle_timeout_seconds = -1
+    assert store.reap() == 1
+    assert len(store) == 0
+    assert store.stats()["evictions"] == {"idle": 1, "finished": 1, "capacity": 0}
+
+def test_logs_view():
+    """测试游戏日志的字典视图与游戏一起淘汰"""
+    store = InMemoryGameStore(reap_interval_seconds=0)
+    store["a"] = make_state()
+    store.logs["a"] = ["游戏开始"]
+    store.append_log("a", "患者询问身体")
+    store.append_log("missing", "已淘汰的游戏")
+    assert store.logs["a"] == ["游戏开始", "患者询问身体"]
+    assert store.logs.get("missing", []) == []
+
+    del store["a"]
+    assert "a" not in store.logs
+
+def test_evicted_game_is_flushed_to_disk(tmp_path, monkeypatch):
+    """测试淘汰的游戏在删除前写入对话文件"""
+    monkeypatch.chdir(tmp_path)
+    store = InMemoryGameStore(max_games=1, reap_interval_seconds=0, on_evict=api._save_evicted_game)
+    state = make_state()
+    state["messages"].append({"sender": "doctor", "content": "你哪里不舒服？"})
+    store["old"] = state
+    store.logs["old"] = ["游戏开始，诊断为: 流感"]
+    store["new"] = make_state()
+
+    files = os.listdir(tmp_path / "conversations")
+    assert len(files) == 1 and files[0].endswith("_old.txt")
+    content = (tmp_path / "conversations" / files[0]).read_text(encoding="utf-8")
+    assert "你哪里不舒服？" in content
+    assert "游戏开始，诊断为: 流感" in content
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    """测试SQLite存储在两个实例（模拟两个工作进程）间共享游戏、日志和附加信息"""
+    path = str(tmp_path / "games.sqlite3")
+    worker_a = SQLiteGameStore(path, reap_interval_seconds=0)
+    worker_b = SQLiteGameStore(path, reap_interval_seconds=0)
+
+    worker_a["g"] = make_state()
+    worker_a.logs["g"] = ["游戏开始，诊断为: 流感"]
+    worker_b.append_log("g", "患者询问身体: 头痛吗")
+    worker_b.set_meta("g", "conversation_file", "conversations/x.txt")
+
+    assert worker_b["g"]["diagnosis"] == "流感"
+    assert worker_a.logs["g"] == ["游戏开始，诊断为: 流感", "患者询问身体: 头痛吗"]
+    assert worker_a.get_meta("g", "conversation_file") == "conversations/x.txt"
+    assert list(worker_b) == ["g"]
+
+def test_optimistic_locking(tmp_path):
+    """测试游戏被其他工作进程修改后，基于旧版本的保存会失败"""
+    path = str(tmp_path / "games.sqlite3")
+    worker_a = SQLiteGameStore(path, reap_interval_seconds=0)
+    worker_b = SQLiteGameStore(path, reap_interval_seconds=0)
+    worker_a["g"] = make_state()
+
+    state_a, version_a = worker_a.load("g")
+    state_b, version_b = worker_b.load("g")
+    worker_b.save("g", dict(state_b, turn_count=1), expected_version=version_b)
+
+    with pytest.raises(GameConflictError):
+        worker_a.save("g", dict(state_a, turn_count=1), expected_version=version_a)
+    assert worker_a.load("g")[1] == version_b + 1
+
+def test_sqlite_store_eviction(tmp_path):
+    """测试SQLite存储的数量上限和淘汰回调"""
+    evicted = []
+    store = SQLiteGameStore(str(tmp_path / "games.sqlite3"), max_games=1, reap_interval_seconds=0,
+                            on_evict=lambda game_id, state, logs, meta: evicted.append((game_id, logs)))
+    store["a"] = make_state(game_over=True)
+    store.append_log("a", "游戏结束")
+    store["b"] = make_state()
+    assert evicted == [("a", ["游戏结束"])]
+    assert list(store) == ["b"]
+    assert store.stats()["evictions"]["capacity"] == 1
+
+def test_shared_dict_modify(tmp_path):
+    """测试共享字典的原子修改和条目上限"""
+    path = str(tmp_path / "games.sqlite3")
+    stats_a = SQLiteDict(path, "stats")
+    stats_b = SQLiteDict(path, "stats")
+
+    def record(stats):
+        stats["attempts"] += 1
+        return stats
+
+    for stats in (stats_a, stats_b, stats_a):
+        stats.modify("流感", record, {"attempts": 0})
+    assert stats_b["流感"] == {"attempts": 3}
+
+    recent = SQLiteDict(path, "recent", max_entries=2)
+    for key in "abc":
+        recent[key] = {"game_id": key}
+    assert list(recent) == ["b", "c"]
+
+    local = LockedDict()
+    local.modify("流感", record, {"attempts": 0})
+    assert local["流感"] == {"attempts": 1}
+
+def test_send_message_conflict_returns_409(client, fake_llm):
+    """测试处理期间游戏被其他请求修改时返回409，不覆盖较新的状态"""
+    game_id = "conflict-game"
+    api.active_games[game_id] = make_state()
+    api.api_logs[game_id] = []
+    original_load = api.game_store.load
+
+    def load_then_modify(load_game_id):
+        # 模拟读取之后另一个工作进程保存了新的状态
+        state, version = original_load(load_game_id)
+        api.active_games[load_game_id] = dict(state, turn_count=5)
+        return state, version
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(api.game_store, "load", load_then_modify)
+        response = client.post("/api/send_message", json={"game_id": game_id, "message": "你好"})
+
+    assert response.status_code == 409
+    assert api.active_games[game_id]["turn_count"] == 5
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试LLM响应缓存
+"""
+
+import pytest
+from game_engine import invoke_llm, llm_response_cache
+from llm_cache import LLMResponseCache, SQLiteResponseCache, create_response_cache
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_key_includes_model_and_full_hash():
+    """测试缓存键是包含模型ID的完整哈希"""
+    key = LLMResponseCache.make_key("model-a", "系统", "提示")
+    assert len(key) == 64
+    assert key != LLMResponseCache.make_key("model-b", "系统", "提示")
+    # 不同的分段方式不会得到相同的键
+    assert LLMResponseCache.make_key("m", "ab", "c") != LLMResponseCache.make_key("m", "a", "bc")
+
+def test_lru_eviction_by_entry_count():
+    """测试条目数量超过上限时淘汰最久未使用的条目"""
+    cache = LLMResponseCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.stats()["evictions"] == 1
+
+def test_memory_stays_bounded():
+    """测试大量写入后内存占用不超过上限"""
+    cache = LLMResponseCache(max_entries=100000, max_bytes=64 * 1024)
+    for i in range(5000):
+        cache.set(f"key-{i}", "诊断正确: 否" * 10)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 64 * 1024
+    assert stats["entries"] < 5000
+    assert stats["evictions"] == 5000 - stats["entries"]
+
+def test_expired_entries_miss():
+    """测试过期条目视为未命中"""
+    cache = LLMResponseCache(ttl_seconds=-1)
+    cache.set("a", "1")
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_sqlite_cache_survives_restart(tmp_path):
+    """测试SQLite缓存在重新打开后保留，并可以被另一个实例（进程）读取"""
+    path = str(tmp_path / "llm_cache.sqlite3")
+    cache = SQLiteResponseCache(path)
+    cache.set("a", "诊断正确: 是")
+
+    other = SQLiteResponseCache(path)
+    assert other.get("a") == "诊断正确: 是"
+    assert other.get("b") is None
+    assert other.stats()["hits"] == 1
+    assert other._connect().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+def test_sqlite_cache_bounds(tmp_path):
+    """测试SQLite缓存的条目数量、大小上限和有效期"""
+    cache = SQLiteResponseCache(str(tmp_path / "c.sqlite3"), max_entries=3)
+    for key in "abcd":
+        cache.set(key, key)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 3
+
+    cache = SQLiteResponseCache(str(tmp_path / "b.sqlite3"), max_bytes=100)
+    for i in range(20):
+        cache.set(f"key-{i}", "x" * 30)
+    assert cache.stats()["bytes"] <= 100
+    assert cache.get("key-19") == "x" * 30
+
+    cache = SQLiteResponseCache(str(tmp_path / "t.sqlite3"), ttl_seconds=-1)
+    cache.set("a", "1")
+    assert cache.get("a") is None
+
+def test_create_response_cache(tmp_path):
+    """测试按配置创建缓存后端"""
+    assert isinstance(create_response_cache("memory"), LLMResponseCache)
+    assert isinstance(create_response_cache("sqlite", str(tmp_path / "c.sqlite3")), SQLiteResponseCache)
+    with pytest.raises(ValueError):
+        create_response_cache("redis")
+
+def test_invoke_llm_cache_opt_out(fake_llm):
+    """测试可以按调用关闭缓存"""
+    assert invoke_llm("缓存测试", "系统") == invoke_llm("缓存测试", "系统")
+    assert len(fake_llm.calls) == 1
+
+    invoke_llm("缓存测试", "系统", use_cache=False)
+    invoke_llm("缓存测试", "系统", use_cache=False)
+    assert len(fake_llm.calls) == 3
+    assert llm_response_cache.stats()["hits"] >= 1
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试LLM调用的调度：并发上限、优先级排队和排队时间统计
+"""
+
+import asyncio
+import pytest
+
+import game_engine
+from game_engine import ainvoke_llm, run_in_engine
+from llm_scheduler import LLMScheduler, percentile
+from llm_transport import create_async_client
+from .test_llm_transport import mock_server  # noqa: F401  模拟的OpenAI兼容接口
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_priority_order():
+    """测试并发位置空出后按优先级放行：病人回复、裁判、后台补充开局池"""
+    order = []
+
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1, background_window_seconds=0)
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        async def record(name):
+            order.append(name)
+
+        async def background_call():
+            with scheduler.background():
+                await scheduler.run(lambda: record("pool"), "patient")
+
+        holder = asyncio.ensure_future(scheduler.run(hold, "referee"))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(background_call()),
+                   asyncio.ensure_future(scheduler.run(lambda: record("referee"), "referee")),
+                   asyncio.ensure_future(scheduler.run(lambda: record("patient"), "patient"))]
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        return scheduler.stats()
+
+    stats = asyncio.run(run())
+    assert order == ["patient", "referee", "pool"]
+    assert stats["queued_calls"] == 3
+    assert stats["active"] == 0
+
+def test_background_window_lets_foreground_first():
+    """测试后台调用先等待时间窗口，窗口内到达的前台调用先得到位置"""
+    order = []
+
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1, background_window_seconds=0.05)
+
+        async def record(name):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+        async def background_call():
+            with scheduler.background():
+                await scheduler.run(lambda: record("pool"), "body")
+
+        task = asyncio.ensure_future(background_call())
+        await asyncio.sleep(0.01)
+        await asyncio.gather(task, scheduler.run(lambda: record("patient"), "patient"))
+
+    asyncio.run(run())
+    assert order == ["patient", "pool"]
+
+def test_cancelled_waiter_does_not_leak_slot():
+    """测试排队时被取消的调用不占用并发位置"""
+    async def run():
+        scheduler = LLMScheduler(max_concurrency=1)
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+
+        async def done():
+            return "ok"
+
+        holder = asyncio.ensure_future(scheduler.run(hold, "patient"))
+        await asyncio.sleep(0)
+        cancelled = asyncio.ensure_future(scheduler.run(done, "referee"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        release.set()
+        await holder
+        assert await asyncio.wait_for(scheduler.run(done, "referee"), 1) == "ok"
+        return scheduler.stats()
+
+    assert asyncio.run(run())["active"] == 0
+
+def test_percentile():
+    """测试最近秩分位数"""
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 90) == 0
+
+def test_limits_concurrency_against_server(mock_server, monkeypatch):  # noqa: F811
+    """测试通过模拟服务器发出的调用不超过并发上限，同时进行的相同裁判调用只请求一次，并记录排队时间"""
+    server = mock_server([("delay", 0.05, "医生，我头有点疼。")] * 8)
+    client = create_async_client(base_url=server.base_url, api_key="test")
+    scheduler = LLMScheduler(max_concurrency=2)
+    monkeypatch.setenv("MODEL_ID", "mock")
+    monkeypatch.setattr(game_engine, "async_client", client)
+    monkeypatch.setattr(game_engine, "llm_scheduler", scheduler)
+    game_engine.llm_response_cache.clear()
+
+    async def run_all():
+        patient_calls = [ainvoke_llm(f"病人提示{i}", "病人", use_cache=False, call_type="patient") for i in range(6)]
+        referee_calls = [ainvoke_llm("相同的裁判提示", "裁判", call_type="referee") for _ in range(4)]
+        try:
+            return await asyncio.gather(*patient_calls, *referee_calls)
+        finally:
+            await client.close()
+
+    try:
+        results = asyncio.run(run_in_engine(run_all()))
+    finally:
+        game_engine.llm_response_cache.clear()
+    assert len(results) == 10
+    assert server.requests == 7
+    assert server.max_active <= 2
+    stats = scheduler.stats()
+    assert stats["queue_delay_ms"]["patient"]["count"] == 6
+    assert stats["queue_delay_ms"]["patient"]["max"] > 0
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试LLM传输层：超时、退避重试、回合时间预算和兜底回复
+使用本地的模拟HTTP服务器注入延迟和错误
+"""
+
+import json
+import time
+import random
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+import game_engine
+from llm_transport import (
+    create_async_client, RetryPolicy, GameDeadlines, LLMTransport, LLMDeadlineExceeded
+)
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+class MockLLMServer:
+    """
+    模拟的OpenAI兼容接口
+    script中的每一项依次用于一个请求：("ok", 回复)、("status", 状态码) 或 ("delay", 秒数, 回复)
+    script用完后都返回正常回复
+    """
+
+    def __init__(self, script=()):
+        self.script = list(script)
+        self.requests = 0
+        self.active = 0  # 正在处理的请求数量
+        self.max_active = 0  # 同时处理的请求数量的最大值
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("content-length", 0)))
+                with server.lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                    action = server.script.pop(0) if server.script else ("ok", "医生，我头有点疼。")
+                try:
+                    if action[0] == "status":
+                        self._send(action[1], {"error": {"message": "模拟的错误"}})
+                        return
+                    if action[0] == "delay":
+                        time.sleep(action[1])
+                    self._send(200, {
+                        "id": "mock", "object": "chat.completion", "created": 0, "model": "mock",
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": action[-1]}}]
+                    })
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端已超时断开
+                    pass
+                finally:
+                    with server.lock:
+                        server.active -= 1
+
+            def _send(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def mock_server():
+    servers = []
+
+    def start(script=()):
+        server = MockLLMServer(script)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+def chat(server, transport, game_id=None, read_timeout=5.0):
+    """通过传输层向模拟服务器发送一次请求，返回回复内容"""
+    async def run():
+        client = create_async_client(base_url=server.base_url, api_key="test", read_timeout=read_timeout)
+
+        async def request():
+            response = await client.chat.completions.create(
+                model="mock", messages=[{"role": "user", "content": "你好"}])
+            return response.choices[0].message.content
+
+        try:
+            return await transport.call(request, game_id)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+def fast_retries(max_retries=2):
+    return RetryPolicy(max_retries=max_retries, backoff_base=0.01, backoff_max=0.05, rng=random.Random(0))
+
+def test_retries_server_errors(mock_server):
+    """测试服务器错误后退避重试，重试成功时返回正常回复"""
+    server = mock_server([("status", 500), ("status", 503), ("ok", "好多了")])
+    transport = LLMTransport(retry_policy=fast_retries())
+    assert chat(server, transport) == "好多了"
+    assert server.requests == 3
+    assert transport.stats()["retries"] == 2
+
+def test_does_not_retry_client_errors(mock_server):
+    """测试请求本身有误时不重试"""
+    server = mock_server([("status", 400)])
+    transport = LLMTransport(retry_policy=fast_retries())
+    with pytest.raises(openai.BadRequestError):
+        chat(server, transport)
+    assert server.requests == 1
+    assert transport.stats()["failures"] == 1
+
+def test_read_timeout_is_retried(mock_server):
+    """测试读取超时后重试，不会一直等待卡住的上游"""
+    server = mock_server([("delay", 1.0, "太慢了"), ("ok", "正常回复")])
+    transport = LLMTransport(retry_policy=fast_retries())
+    start = time.monotonic()
+    assert chat(server, transport, read_timeout=0.2) == "正常回复"
+    assert time.monotonic() - start < 1.0
+    assert server.requests == 2
+
+def test_turn_budget_limits_total_wait(mock_server):
+    """测试回合的时间预算用完后不再等待上游"""
+    server = mock_server([("delay", 2.0, "太慢了")])
+    deadlines = GameDeadlines(budget_seconds=0.3)
+    transport = LLMTransport(retry_policy=fast_retries(), deadlines=deadlines)
+    start = time.monotonic()
+    with deadlines.scope("game"):
+        with pytest.raises(LLMDeadlineExceeded):
+            chat(server, transport, game_id="game")
+    assert time.monotonic() - start < 1.5
+    assert deadlines.remaining("game") is None
+    assert transport.stats()["deadline_exceeded"] == 1
+
+def test_backoff_delay_is_jittered_and_capped():
+    """测试退避时间在指数增长的上限内随机取值，并遵守Retry-After"""
+    policy = RetryPolicy(backoff_base=0.5, backoff_max=4.0, rng=random.Random(1))
+    delays = [policy.delay(attempt) for attempt in range(6)]
+    for attempt, delay in enumerate(delays):
+        assert 0 <= delay <= min(4.0, 0.5 * 2 ** attempt)
+    assert len(set(delays)) == len(delays)
+    assert policy.delay(0, retry_after=3) >= 3
+    assert policy.delay(0, retry_after=60) <= 4.0
+
+def test_scope_is_reentrant():
+    """测试回合中再次进入同一个游戏的预算时沿用原来的截止时间"""
+    now = [100.0]
+    deadlines = GameDeadlines(budget_seconds=10, clock=lambda: now[0])
+    with deadlines.scope("game"):
+        now[0] += 4
+        with deadlines.scope("game"):
+            assert deadlines.remaining("game") == 6
+        assert deadlines.remaining("game") == 6
+    assert deadlines.remaining("game") is None
+
+def test_send_message_uses_fallback_replies(fake_llm, started_game, client, monkeypatch):
+    """测试回合预算用完时使用兜底回复，请求仍然正常返回"""
+    monkeypatch.setattr(game_engine.llm_transport.deadlines, "budget_seconds", 0.05)
+    fake_llm.delay = 1.0
+    fallbacks = game_engine.llm_transport.fallbacks
+
+    start = time.monotonic()
+    response = client.post('/api/send_message', json={'game_id': started_game, 'message': '是流感吗？'})
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert time.monotonic() - start < 1.0
+    assert data["game_over"] is False
+    assert data["messages"][-1] == {"sender": "patient", "content": "医生，我能再详细说明一下我的症状吗？"}
+    assert game_engine.llm_transport.fallbacks > fallbacks
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试只追加的消息记录
+"""
+
+import json
+import copy
+import pickle
+import threading
+import pytest
+from message_log import Message, MessageLog, as_message_log, replace_message
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def msg(i):
+    return {"sender": "doctor", "content": f"问题{i}"}
+
+def test_append_shares_storage_and_keeps_snapshots():
+    """测试追加消息时共享底层存储，之前的快照看不到之后追加的消息"""
+    first = MessageLog([msg(0)])
+    second = first + [msg(1)]
+    third = second + [msg(2)]
+    assert first._items is second._items is third._items
+    assert first == [msg(0)]
+    assert second == [msg(0), msg(1)]
+    assert third == [msg(0), msg(1), msg(2)]
+
+    # 在旧快照上追加时复制出自己的底层存储，不影响其他快照
+    branch = second + [msg(9)]
+    assert branch == [msg(0), msg(1), msg(9)]
+    assert third == [msg(0), msg(1), msg(2)]
+    assert branch._items is not third._items
+
+def test_in_place_append_on_copy():
+    """测试在复制的快照上原地追加不影响原快照"""
+    log = MessageLog([msg(0)])
+    copied = log.copy()
+    copied.append(msg(1))
+    log.append(msg(2))
+    assert copied == [msg(0), msg(1)]
+    assert log == [msg(0), msg(2)]
+
+def test_sequence_behaviour():
+    """测试下标、切片、比较和序列化与普通列表相同"""
+    messages = [msg(i) for i in range(5)]
+    log = MessageLog(messages)
+    assert log[-1] == msg(4)
+    assert log[:-1] == messages[:-1]
+    assert log[:-1]._items is log._items
+    assert log[1::2] == messages[1::2]
+    assert list(reversed(log)) == list(reversed(messages))
+    assert msg(2) in log
+    assert messages == log and log == messages
+    with pytest.raises(IndexError):
+        log[:2][2]
+    assert json.loads(json.dumps(log.to_list())) == messages
+
+def test_messages_are_immutable():
+    """测试消息不可原地修改，只能替换为新消息"""
+    log = MessageLog([msg(0), msg(1)])
+    assert isinstance(log[0], Message)
+    assert log[0] == msg(0)
+    with pytest.raises(TypeError):
+        log[0]["content"] = "修改"
+    with pytest.raises(TypeError):
+        log[0].content = "修改"
+
+    replaced = log.replace(0, {**log[0], "content": "修改"})
+    assert replaced[0]["content"] == "修改"
+    assert log[0]["content"] == "问题0"
+    assert copy.deepcopy(log[0]) == msg(0)
+    assert pickle.loads(pickle.dumps(log[0])) == msg(0)
+
+def test_helpers_accept_plain_lists():
+    """测试普通列表也可以替换消息，且不修改原列表"""
+    messages = [msg(0), msg(1)]
+    replaced = replace_message(messages, -1, msg(9))
+    assert isinstance(replaced, MessageLog)
+    assert replaced == [msg(0), msg(9)]
+    assert messages == [msg(0), msg(1)]
+    assert as_message_log(replaced) is replaced
+
+def test_concurrent_appends_from_same_snapshot():
+    """测试多个线程从同一个快照追加时各自得到正确的消息列表"""
+    base = MessageLog([msg(0)])
+    results = {}
+
+    def worker(i):
+        results[i] = base + [msg(i + 1)]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, log in results.items():
+        assert log == [msg(0), msg(i + 1)]
+    assert base == [msg(0)]
+
+def test_concurrent_in_place_appends_keep_every_message():
+    """测试多个线程在同一个快照上原地追加时不会丢失消息"""
+    base = MessageLog([msg(0)])
+    base + [msg(-1)]  # 让base不在底层存储末尾，第一次原地追加需要复制
+    barrier = threading.Barrier(8)
+
+    def worker(i):
+        barrier.wait()
+        for j in range(50):
+            base.append(msg(i * 100 + j))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(base) == 1 + 8 * 50
+    assert sorted(m["content"] for m in base[1:]) == sorted(msg(i * 100 + j)["content"]
+                                                           for i in range(8) for j in range(50))
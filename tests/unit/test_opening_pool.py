@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试预先生成的游戏开局池
+"""
+
+import json
+import asyncio
+import pytest
+from unittest.mock import patch
+import api
+import game_engine
+from api import active_games, _agenerate_opening
+from opening_pool import OpeningPool
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_refill_and_pop(fake_llm):
+    """测试补充开局后可以按疾病取用，并统计命中和未命中"""
+    pool = OpeningPool(_agenerate_opening, ["流感", "肺炎"], size_per_disease=2)
+    asyncio.run(pool.refill())
+
+    assert pool.stats()["available"] == {"流感": 2, "肺炎": 2}
+
+    opening = pool.pop("流感")
+    assert opening["diagnosis"] == "流感"
+    assert opening["messages"][-1]["sender"] == "patient"
+    assert pool.pop("流感")
+    assert pool.pop("流感") is None
+
+    stats = pool.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["available"] == {"流感": 0, "肺炎": 2}
+
+def test_expired_openings_are_dropped():
+    """测试超过有效期的开局会被丢弃"""
+    async def generate(diagnosis):
+        return {"game_id": diagnosis, "diagnosis": diagnosis, "messages": []}
+
+    pool = OpeningPool(generate, ["流感"], size_per_disease=1, ttl_seconds=0)
+    asyncio.run(pool.refill())
+
+    assert pool.pop("流感") is None
+    assert pool.stats()["expired"] == 1
+
+def test_expired_openings_release_game_resources(fake_llm):
+    """测试过期的开局被丢弃时释放生成时按它的游戏ID记录的日志文件名"""
+    pool = OpeningPool(_agenerate_opening, ["流感"], size_per_disease=1, ttl_seconds=0,
+                       on_expire=api.opening_pool.on_expire)
+    asyncio.run(pool.refill())
+    game_id = pool._openings["流感"][0]["game_id"]
+    assert game_id in game_engine.game_log_files
+
+    assert pool.pop("流感") is None
+    assert game_id not in game_engine.game_log_files
+    assert pool.stats()["expired"] == 1
+
+def test_disabled_pool_never_generates():
+    """测试开局数量为0时不启用开局池"""
+    async def generate(diagnosis):
+        raise AssertionError("不应生成开局")
+
+    pool = OpeningPool(generate, ["流感"], size_per_disease=0)
+    pool.ensure_filling()
+    assert pool.pop("流感") is None
+    assert pool.stats()["misses"] == 0
+
+def test_new_game_uses_pooled_opening(fake_llm, clean_state, client):
+    """测试创建新游戏时直接使用预先生成的开局，不调用LLM"""
+    pool = OpeningPool(_agenerate_opening, ["流感"], size_per_disease=1)
+    asyncio.run(pool.refill())
+    opening_game_id = pool._openings["流感"][0]["game_id"]
+    calls_before = len(fake_llm.calls)
+
+    with patch.object(api, "opening_pool", pool), patch.dict(api.GAME_CONFIG, {"diseases": ["流感"]}):
+        with patch.object(pool, "ensure_filling"):
+            response = client.post('/api/new_game')
+    data = json.loads(response.data)
+
+    assert data["game_id"] == opening_game_id
+    assert active_games[opening_game_id]["diagnosis"] == "流感"
+    assert active_games[opening_game_id]["current_sender"] == "doctor"
+    assert len(fake_llm.calls) == calls_before
+    assert pool.stats()["hits"] == 1
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试增量格式化的对话历史
+"""
+
+import pytest
+from prompt_history import PromptHistory, PromptHistoryCache
+from sanitizer import sanitize_history
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def full_format(messages, include_body=True):
+    """原来每次重新格式化全部历史的方式"""
+    return "\n".join(f"{msg['sender']}: {msg['content']}" for msg in messages
+                     if include_body or msg["sender"] != "body")
+
+def make_turn(i):
+    return [
+        {"sender": "doctor", "content": f"第{i}个问题"},
+        {"sender": "patient", "content": f"[询问身体:问题{i}]"},
+        {"sender": "body", "content": f"身体感受{i}"},
+        {"sender": "patient", "content": f"回答{i}"},
+    ]
+
+def test_incremental_matches_full_format():
+    """测试逐轮追加消息时两种视图都与完整格式化的结果相同"""
+    history = PromptHistory()
+    messages = [{"sender": "system", "content": "游戏开始"}]
+    for i in range(5):
+        for msg in make_turn(i):
+            messages = messages + [msg]
+            assert history.format(messages) == full_format(messages)
+            assert history.format(messages, include_body=False) == full_format(messages, include_body=False)
+
+def test_only_new_messages_are_formatted(monkeypatch):
+    """测试已格式化的消息不会重新格式化"""
+    history = PromptHistory()
+    messages = [{"sender": "system", "content": "游戏开始"}] + make_turn(0)
+    history.format(messages)
+
+    appended = []
+    original = PromptHistory._append
+    def counting_append(self, index, msg):
+        appended.append(index)
+        return original(self, index, msg)
+    monkeypatch.setattr(PromptHistory, "_append", counting_append)
+
+    messages = messages + make_turn(1)
+    history.format(messages)
+    history.format(messages, include_body=False)
+    assert appended == [5, 6, 7, 8]
+
+def test_prefix_view():
+    """测试只格式化前count条消息"""
+    history = PromptHistory()
+    messages = [{"sender": "system", "content": "游戏开始"}] + make_turn(0)
+    assert history.format(messages, count=len(messages) - 1) == full_format(messages[:-1])
+    assert history.format(messages, include_body=False, count=3) == full_format(messages[:3], include_body=False)
+    assert history.format(messages, count=0) == ""
+    assert history.format([]) == ""
+
+def test_sanitized_message_is_reformatted():
+    """测试病人消息清理询问身体标记后（替换为新消息或原地修改）重新格式化"""
+    history = PromptHistory()
+    messages = [{"sender": "system", "content": "游戏开始"}] + make_turn(0)
+    assert "[询问身体:问题0]" in history.format(messages)
+
+    sanitized = sanitize_history(messages)
+    assert history.format(sanitized) == full_format(sanitized)
+    assert "询问身体" not in history.format(sanitized)
+
+    assert "[询问身体:问题0]" in history.format(messages)
+    messages[2]["content"] = ""
+    assert history.format(messages) == full_format(messages)
+
+def test_replaced_and_removed_messages():
+    """测试替换或去掉最后一条消息，以及换成另一局对话时结果仍然正确"""
+    history = PromptHistory()
+    messages = [{"sender": "system", "content": "游戏开始"}] + make_turn(0)
+    history.format(messages)
+
+    replaced = messages[:-1] + [{"sender": "patient", "content": "替换后的回答"}]
+    assert history.format(replaced) == full_format(replaced)
+
+    removed = replaced[:-2]
+    assert history.format(removed) == full_format(removed)
+
+    other = [{"sender": "system", "content": "另一局"}, {"sender": "doctor", "content": "你好"}]
+    assert history.format(other) == full_format(other)
+
+def test_cache_per_game_and_release():
+    """测试按游戏缓存、淘汰最久未使用的游戏和释放缓存"""
+    cache = PromptHistoryCache(max_games=2)
+    messages = [{"sender": "system", "content": "游戏开始"}] + make_turn(0)
+
+    for game_id in ["a", "b", "c"]:
+        assert cache.format(game_id, messages) == full_format(messages)
+    assert list(cache._histories) == ["b", "c"]
+
+    cache.release("b")
+    assert list(cache._histories) == ["c"]
+    assert cache.format(None, messages, include_body=False) == full_format(messages, include_body=False)
+    assert list(cache._histories) == ["c"]
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试批量裁判和高负载时格式检查的合并
+"""
+
+import gc
+import asyncio
+import pytest
+import game_engine
+from config import GAME_CONFIG
+from game_engine import judge_batch, run_in_engine
+from referee_batch import RefereeBatcher
+from referee_verdict import parse_batch_verdicts
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def batch_calls(fake_llm):
+    return [prompt for _, prompt in fake_llm.calls if '"verdicts"' in prompt]
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"verdicts": [{"index": 0, "ok": true}, {"index": 1, "ok": false}]}', [True, False]),
+    ('```json\n{"verdicts": [{"index": 1, "ok": true}]}\n```', [None, True]),
+    ('[{"index": 0, "ok": false}, {"index": 1, "ok": true}]', [False, True]),
+    ('{"verdicts": [{"index": 5, "ok": true}, {"index": true, "ok": true}, {"index": 0, "ok": "是"}]}', [None, None]),
+    ("符合要求: 是", [None, None]),
+])
+def test_parse_batch_verdicts(text, expected):
+    """测试按编号解析批量结论，缺少或无效的项为None"""
+    assert parse_batch_verdicts(text, 2) == expected
+
+def test_mixed_items_in_one_call(fake_llm):
+    """测试医生和病人消息合并为一次调用，本地规则能确定不正确的诊断不交给LLM"""
+    items = [
+        ("你哪里不舒服？", "doctor", "流感"),
+        ("是流感吗？", "doctor", "流感"),
+        ("我头疼，还发烧", "patient", "流感"),
+        ("我胃疼", "patient", "胃溃疡"),
+    ]
+    assert judge_batch(items) == [False, False, True, True]
+    assert len(fake_llm.calls) == 1
+    prompt = batch_calls(fake_llm)[0]
+    assert "你哪里不舒服" not in prompt
+    assert '[0] 发送者: 医生 | 正确的诊断: 流感 | 消息: "是流感吗？"' in prompt
+
+def test_chunking_by_token_budget(fake_llm, monkeypatch):
+    """测试超过token预算时自动分批"""
+    monkeypatch.setitem(GAME_CONFIG["referee"], "batch_max_tokens", 60)
+    items = [(f"我第{i}天还是头疼，晚上睡不着", "patient", "偏头痛") for i in range(6)]
+    assert judge_batch(items) == [True] * 6
+    calls = batch_calls(fake_llm)
+    assert len(calls) > 1
+    assert sum(prompt.count("发送者: 病人") for prompt in calls) == 6
+
+def test_missing_verdicts_are_judged_individually(fake_llm):
+    """测试回复中缺少结论的消息逐条重新判断"""
+    reply = fake_llm.reply
+    fake_llm.reply = lambda system_message, prompt: ('{"verdicts": [{"index": 0, "ok": false}]}'
+                                                     if '"verdicts"' in prompt else reply(system_message, prompt))
+    items = [("我得了偏头痛", "patient", "偏头痛"), ("头一跳一跳地疼", "patient", "偏头痛")]
+    assert judge_batch(items) == [False, True]
+    assert len(fake_llm.calls) == 2
+    assert "头一跳一跳地疼" in fake_llm.calls[1][1]
+
+def test_unknown_sender_rejected(fake_llm):
+    """测试只接受医生和病人消息"""
+    with pytest.raises(ValueError):
+        judge_batch([("恭喜", "system", "流感")])
+
+def test_batcher_merges_concurrent_checks():
+    """测试同时提交的检查合并为一批，每个等待者收到自己的结论"""
+    batches = []
+
+    async def judge(items, game_ids):
+        batches.append(items)
+        return [item[0].endswith("好") for item in items]
+
+    async def run():
+        batcher = RefereeBatcher(judge, min_concurrency=1, window_seconds=0.01)
+        return await asyncio.gather(*(batcher.submit((text, "patient", "流感")) for text in ["好", "坏", "还好"])), batcher
+
+    verdicts, batcher = asyncio.run(run())
+    assert verdicts == [True, False, True]
+    assert len(batches) == 1
+    assert batcher.stats()["avg_batch_size"] == 3
+
+def test_batcher_flushes_at_max_items():
+    """测试达到数量上限时不等时间窗口立即发出"""
+    batches = []
+
+    async def judge(items, game_ids):
+        batches.append(len(items))
+        return [True] * len(items)
+
+    async def run():
+        batcher = RefereeBatcher(judge, min_concurrency=1, window_seconds=10, max_items=2)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(("x", "patient", "流感")) for _ in range(4))), 1)
+
+    assert asyncio.run(run()) == [True] * 4
+    assert batches == [2, 2]
+
+def test_batcher_error_reaches_every_waiter():
+    """测试批量裁判出错时每个等待者都收到异常"""
+    async def judge(items, game_ids):
+        raise RuntimeError("裁判不可用")
+
+    async def run():
+        batcher = RefereeBatcher(judge, min_concurrency=1, window_seconds=0.01)
+        return await asyncio.gather(*(batcher.submit(("x", "patient", "流感")) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
+
+def test_batcher_waiter_timeout():
+    """测试每个等待者只等待自己的时间，超时的等待者不影响同一批的其他等待者"""
+    async def judge(items, game_ids):
+        await asyncio.sleep(0.05)
+        return list(game_ids)
+
+    async def run():
+        batcher = RefereeBatcher(judge, min_concurrency=1, window_seconds=0.01)
+        results = await asyncio.gather(batcher.submit(("x", "patient", "流感"), "game-a", timeout=0.01),
+                                       batcher.submit(("y", "patient", "流感"), "game-b", timeout=5),
+                                       return_exceptions=True)
+        return results, batcher.stats()
+
+    (short, long), stats = asyncio.run(run())
+    assert isinstance(short, asyncio.TimeoutError)
+    assert long == "game-b"
+    assert stats["timeouts"] == 1
+
+def test_batcher_error_after_waiter_timeout():
+    """测试等待者超时后批量裁判出错时，不会留下无人读取的异常"""
+    async def judge(items, game_ids):
+        await asyncio.sleep(0.03)
+        raise RuntimeError("裁判不可用")
+
+    async def run():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context["message"]))
+        batcher = RefereeBatcher(judge, min_concurrency=1, window_seconds=0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await batcher.submit(("x", "patient", "流感"), "game-a", timeout=0.01)
+        await asyncio.sleep(0.1)
+        gc.collect()
+        return errors
+
+    assert asyncio.run(run()) == []
+
+def test_busy_threshold():
+    """测试只有同时进行的检查达到门槛才合并，0表示不合并"""
+    batcher = RefereeBatcher(None, min_concurrency=2)
+    with batcher.track():
+        assert not batcher.busy()
+        with batcher.track():
+            assert batcher.busy()
+    assert not RefereeBatcher(None, min_concurrency=0).busy()
+
+def test_format_check_batched_under_load(fake_llm, monkeypatch):
+    """测试高负载时各游戏的病人消息格式检查合并为一次批量裁判"""
+    monkeypatch.setitem(GAME_CONFIG, "check_patient_response", True)
+    monkeypatch.setattr(game_engine.referee_batcher, "min_concurrency", 2)
+    fake_llm.delay = 0.05
+
+    def state(content):
+        return {
+            "messages": [{"sender": "doctor", "content": "哪里不舒服？"}, {"sender": "patient", "content": content}],
+            "current_sender": "system",
+            "diagnosis": "流感",
+            "game_over": False
+        }
+
+    logged = []
+    save_api_log = game_engine.save_api_log
+    monkeypatch.setattr(game_engine, "save_api_log", lambda log_data, game_id=None, *args: (
+        logged.append((game_id, log_data["input"]["user_message"])), save_api_log(log_data, game_id, *args)))
+
+    async def check_all():
+        return await asyncio.gather(*(game_engine.asystem_node(state(f"我第{i}天发烧了"), f"game-{i}") for i in range(4)))
+
+    results = asyncio.run(run_in_engine(check_all()))
+    assert all(result["current_sender"] == "doctor" for result in results)
+    # 第一个检查逐条进行，之后同时进行的检查被合并，系统笔记是裁判对这条消息的回复
+    assert len(batch_calls(fake_llm)) == 1
+    assert sum(result["system_notes"].startswith('{"index": ') for result in results) == 3
+    # 批量裁判的调用记录到每个参与的游戏的日志中
+    assert sorted(game_id for game_id, prompt in logged if '"verdicts"' in prompt) == ["game-1", "game-2", "game-3"]
+    for i in range(4):
+        game_engine.release_game(f"game-{i}")
+
+def test_format_check_batched_within_budget(fake_llm, monkeypatch):
+    """测试合并的格式检查只等待自己游戏回合剩余的预算，超出时按逐条检查的兜底处理"""
+    monkeypatch.setitem(GAME_CONFIG, "check_patient_response", True)
+    monkeypatch.setattr(game_engine.referee_batcher, "min_concurrency", 1)
+    monkeypatch.setattr(game_engine.llm_transport.deadlines, "budget_seconds", 0.05)
+    fake_llm.delay = 0.2
+    state = {
+        "messages": [{"sender": "doctor", "content": "哪里不舒服？"}, {"sender": "patient", "content": "我发烧了"}],
+        "current_sender": "system",
+        "diagnosis": "流感",
+        "game_over": False
+    }
+
+    async def check():
+        with game_engine.llm_transport.deadlines.scope("budget-game"):
+            result = await game_engine.asystem_node(state, "budget-game")
+        # 等批量裁判结束，不影响之后的测试
+        await asyncio.sleep(fake_llm.delay * 2)
+        return result
+
+    result = asyncio.run(run_in_engine(check()))
+    assert result["current_sender"] == "doctor"
+    assert result["system_notes"] == "符合要求: 是"
+    assert game_engine.referee_batcher.stats()["timeouts"] >= 1
+    game_engine.release_game("budget-game")
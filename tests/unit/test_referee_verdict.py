@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试裁判结论的解析
+"""
+
+import json
+import pytest
+import game_engine
+from config import GAME_CONFIG
+from referee_verdict import VerdictParser, parse_json_verdict
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"correct": true}', True),
+    ('{"correct": false}', False),
+    ('```json\n{"correct": true}\n```', True),
+    ('判断结果如下：{"correct": false}', False),
+    ('{"correct": "是"}', None),
+    ('{"valid": true}', None),
+    ('{"correct": tru', None),
+    ("诊断正确: 是", None),
+])
+def test_parse_json_verdict(text, expected):
+    """测试严格的JSON解析：字段必须存在且为布尔值"""
+    assert parse_json_verdict(text, "correct") is expected
+
+@pytest.mark.parametrize("text,expected", [
+    ("诊断正确: 是", True),
+    ("诊断正确：否", False),
+    ("医生的诊断是正确的", True),
+    ("诊断错误，医生说的是肺炎", False),
+    ("医生的回答和标准诊断一致", False),
+])
+def test_diagnosis_text_fallback(text, expected):
+    """测试不是JSON的回复退回原来的文本匹配"""
+    assert VerdictParser().diagnosis(text) is expected
+
+@pytest.mark.parametrize("text,expected", [
+    ("符合要求: 是", True),
+    ('{"valid": false}', False),
+    ("不符合要求，包含了疾病名称", False),
+    ("回复合理", True),
+    ("可以接受，但是有问题", False),
+])
+def test_format_verdict(text, expected):
+    """测试格式检查的解析，否定表述优先"""
+    assert VerdictParser().format(text) is expected
+
+def test_stats():
+    """测试按解析方式统计"""
+    parser = VerdictParser()
+    parser.diagnosis('{"correct": true}')
+    parser.diagnosis("诊断正确: 否")
+    parser.diagnosis("无法判断")
+    parser.batch('{"verdicts": [{"index": 0, "ok": true}]}', 2)
+    assert parser.stats() == {"json": 1, "text": 1, "unparsed": 1, "batch_items": 1, "batch_missing": 1}
+
+def test_json_schema_mode_sends_response_format(fake_llm, started_game, client, monkeypatch):
+    """测试json_schema模式下裁判调用带上response_format，JSON回复直接解析"""
+    monkeypatch.setitem(GAME_CONFIG["referee"], "output", "json_schema")
+    monkeypatch.setitem(GAME_CONFIG["diagnosis_matcher"], "enabled", False)
+    formats = []
+    create = fake_llm.create
+
+    async def recording_create(model=None, messages=None, **kwargs):
+        formats.append(kwargs.get("response_format"))
+        return await create(model=model, messages=messages, **kwargs)
+    monkeypatch.setattr(game_engine.async_client.chat.completions, "create", recording_create)
+
+    fake_llm.reply = lambda system_message, prompt: '{"correct": true}' if '"correct"' in prompt else "医生，我头有点疼。"
+
+    data = json.loads(client.post('/api/send_message',
+                                  json={'game_id': started_game, 'message': '你得了流感'}).data)
+    assert data["game_over"] is True
+    assert formats[0]["type"] == "json_schema"
+    assert formats[0]["json_schema"]["name"] == "diagnosis_verdict"
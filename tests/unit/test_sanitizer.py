@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试询问身体标记的清理
+"""
+
+import re
+import json
+import pytest
+import sanitizer
+from game_engine import patient_node
+from message_log import MessageLog
+from sanitizer import SanitizedText, strip_inquiry, extract_inquiry, sanitize_history, visible_messages
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+SAMPLES = [
+    "医生，我头疼。",
+    "[询问身体:头疼多久了]",
+    "[询问身体：头疼多久了] 医生，我头疼。",
+    "  [ 询问身体 ： 有没有发烧 ]  ",
+    "[询问身体] 有没有发烧",
+    "[询问身体]：有没有发烧",
+    "医生，[询问身体:有没有发烧]我还咳嗽。",
+    "[询问身体:头疼]和[询问身体]咳嗽",
+    "",
+]
+
+def legacy_strip(text):
+    """原来的两次替换"""
+    text = re.sub(r'\s*\[\s*询问身体\s*[：:]\s*.*?\]\s*', '', text)
+    text = re.sub(r'\s*\[\s*询问身体\s*\]\s*[：:]?\s*', '', text)
+    return text.strip()
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_single_pass_matches_legacy(text):
+    """测试合并后的一次替换与原来的两次替换结果相同"""
+    assert strip_inquiry(text) == legacy_strip(text)
+
+def test_extract_inquiry():
+    """测试提取新旧两种格式的询问内容"""
+    assert extract_inquiry("[询问身体：头疼多久了]") == "头疼多久了"
+    assert extract_inquiry("[询问身体] 有没有发烧") == "有没有发烧"
+    assert extract_inquiry("[询问身体:  ]") is None
+    assert extract_inquiry("医生，我头疼。") is None
+
+def test_history_is_not_rescanned(monkeypatch):
+    """测试已清理过的消息不会重新匹配"""
+    original = [{"sender": "patient", "content": f"[询问身体:问题{i}]回复{i}"} for i in range(50)]
+    messages = sanitize_history(original)
+    assert all(isinstance(msg["content"], SanitizedText) for msg in messages)
+    assert messages[0]["content"] == "回复0"
+    # 不修改原来的列表和消息
+    assert original[0]["content"] == "[询问身体:问题0]回复0"
+    assert sanitize_history(messages) is messages
+
+    calls = []
+
+    class CountingPattern:
+        def sub(self, repl, text):
+            calls.append(text)
+            return ""
+
+    monkeypatch.setattr(sanitizer, "INQUIRY_PATTERN", CountingPattern())
+    messages.append({"sender": "patient", "content": "[询问身体:新问题]"})
+    messages = sanitize_history(messages)
+    assert calls == ["[询问身体:新问题]"]
+    assert messages[-1]["content"] == ""
+
+def test_only_current_turn_is_checked():
+    """测试只检查最近一条医生消息之后的消息，只替换需要清理的消息，其余消息与原列表共享"""
+    earlier = [{"sender": "patient", "content": "[询问身体:之前的问题]"}, {"sender": "doctor", "content": "还有哪里不舒服？"}]
+    turn = [{"sender": "patient", "content": "[询问身体:头疼吗]"}, {"sender": "body", "content": "头疼"},
+            {"sender": "patient", "content": strip_inquiry("我头疼")}]
+    messages = MessageLog(earlier + turn)
+    sanitized = sanitize_history(messages)
+    assert sanitized[0]["content"] == "[询问身体:之前的问题]"
+    assert sanitized[2]["content"] == ""
+    assert sanitized[4] is messages[4]
+    # 病人节点生成的回复已经是SanitizedText，不需要清理时返回原列表
+    current = messages[:2] + [messages[4]]
+    assert sanitize_history(current) is current
+
+def test_patient_reply_is_sanitized(fake_llm):
+    """测试病人节点生成的回复已经清理过，系统节点不需要重新检查"""
+    state = {
+        "messages": [{"sender": "system", "content": "游戏开始"}, {"sender": "patient", "content": "医生您好"},
+                     {"sender": "doctor", "content": "哪里不舒服？"}],
+        "current_sender": "patient",
+        "diagnosis": "流感",
+        "game_over": False
+    }
+    messages = patient_node(state)["messages"]
+    assert isinstance(messages[-1]["content"], SanitizedText)
+    assert sanitize_history(messages) is messages
+
+def test_visible_messages():
+    """测试返回给前端的消息去掉身体消息，且不修改原消息"""
+    messages = [
+        {"sender": "patient", "content": "[询问身体:头疼吗]"},
+        {"sender": "body", "content": "头疼"},
+        {"sender": "patient", "content": ""},
+        {"sender": "doctor", "content": "你好"},
+    ]
+    result = visible_messages(messages)
+    assert result == [{"sender": "patient", "content": ""}, {"sender": "doctor", "content": "你好"}]
+    assert messages[0]["content"] == "[询问身体:头疼吗]"
+    assert len(visible_messages(messages, drop_empty=False)) == 3
+    assert json.dumps(result, ensure_ascii=False).count("询问身体") == 0
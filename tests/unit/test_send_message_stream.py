@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试流式发送消息接口
+"""
+
+import json
+import pytest
+from api import active_games
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def parse_events(response):
+    """把SSE响应解析为 [(事件名, 数据)]"""
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if not block.strip():
+            continue
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_stream_patient_reply(fake_llm, started_game, client):
+    """测试流式接口输出处理阶段和病人回复片段"""
+    response = client.post('/api/send_message_stream',
+                           json={'game_id': started_game, 'message': '您哪里不舒服？'})
+    assert response.mimetype == "text/event-stream"
+    events = parse_events(response)
+
+    phases = [data["phase"] for event, data in events if event == "phase"]
+    assert phases == ["system_check", "patient_reply", "referee"]
+
+    tokens = "".join(data["content"] for event, data in events if event == "token")
+    assert tokens == "医生，我头有点疼。"
+
+    event, data = events[-1]
+    assert event == "done"
+    assert data["messages"][-1] == {"sender": "patient", "content": tokens}
+    assert active_games[started_game]["turn_count"] == 1
+
+def test_stream_hides_body_inquiry(fake_llm, started_game, client):
+    """测试询问身体的回复不会被输出，最终回复基于身体感知流式输出"""
+    def reply(system_message, prompt):
+        if "诊断正确" in prompt:
+            return "诊断正确: 否"
+        if "身体感官系统" in system_message:
+            return "头部：持续胀痛"
+        if "刚才询问了自己的身体感受" in prompt:
+            return "我头一直胀痛。"
+        return "[询问身体:我头痛吗？]"
+
+    fake_llm.reply = reply
+
+    events = parse_events(client.post('/api/send_message_stream',
+                                      json={'game_id': started_game, 'message': '您头痛吗？'}))
+
+    phases = [data["phase"] for event, data in events if event == "phase"]
+    assert phases == ["system_check", "patient_reply", "body_inquiry", "patient_reply", "referee"]
+    assert "".join(data["content"] for event, data in events if event == "token") == "我头一直胀痛。"
+    assert events[-1][0] == "done"
+
+def test_stream_invalid_game(client):
+    """测试无效请求返回error事件"""
+    events = parse_events(client.post('/api/send_message_stream',
+                                      json={'game_id': 'missing', 'message': '你好'}))
+    assert events == [("error", {"error": "Invalid request"})]
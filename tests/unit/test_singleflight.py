@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试同时进行的相同调用的合并
+"""
+
+import asyncio
+import threading
+import pytest
+
+import game_engine
+from game_engine import ainvoke_llm, invoke_llm, run_in_engine
+from singleflight import SingleFlight
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_concurrent_callers_share_one_call():
+    """测试同时到达的相同调用只执行一次，不同的键分别执行"""
+    calls = []
+
+    async def run():
+        flight = SingleFlight()
+
+        def make(key):
+            async def call():
+                calls.append(key)
+                await asyncio.sleep(0.01)
+                return f"结果{key}"
+            return call
+
+        results = await asyncio.gather(*(flight.do(key, make(key)) for key in ["a", "a", "b", "a"]))
+        return results, flight.stats()
+
+    results, stats = asyncio.run(run())
+    assert [result for result, _ in results] == ["结果a", "结果a", "结果b", "结果a"]
+    assert [joined for _, joined in results] == [False, True, False, True]
+    assert sorted(calls) == ["a", "b"]
+    assert stats == {"in_flight": 0, "leaders": 2, "joined": 2}
+
+def test_failure_reaches_all_waiters_then_clears():
+    """测试调用失败时所有等待者收到同一个异常，之后的调用重新执行"""
+    attempts = []
+
+    async def run():
+        flight = SingleFlight()
+
+        async def failing():
+            attempts.append("fail")
+            await asyncio.sleep(0.01)
+            raise RuntimeError("上游错误")
+
+        async def working():
+            attempts.append("ok")
+            return "好了"
+
+        errors = await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+        assert flight.in_flight() == 0
+        return errors, await flight.do("k", working)
+
+    errors, retried = asyncio.run(run())
+    assert all(isinstance(error, RuntimeError) and str(error) == "上游错误" for error in errors)
+    assert errors[0] is errors[1] is errors[2]
+    assert retried == ("好了", False)
+    assert attempts == ["fail", "ok"]
+
+def test_cancelled_waiter_does_not_cancel_call():
+    """测试某个等待者被取消时，调用继续进行，其他等待者正常得到结果"""
+    async def run():
+        flight = SingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.02)
+            return "结果"
+
+        first = asyncio.ensure_future(flight.do("k", call))
+        second = asyncio.ensure_future(flight.do("k", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ("结果", True)
+
+def test_waiter_timeout_and_leader_only_errors():
+    """测试每个等待者只等待自己的超时时间；只属于第一个调用方的异常不传给等待者，等待者重新执行"""
+    class LeaderOnlyError(Exception):
+        pass
+
+    attempts = []
+
+    async def run():
+        flight = SingleFlight()
+
+        async def slow():
+            attempts.append("slow")
+            await asyncio.sleep(0.1)
+            return "结果"
+
+        # 等待者超时不影响第一个调用方
+        leader = asyncio.ensure_future(flight.do("k", slow))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.do("k", slow, timeout=0.01)
+        assert await leader == ("结果", False)
+
+        async def leader_fails():
+            attempts.append("leader")
+            await asyncio.sleep(0.01)
+            raise LeaderOnlyError()
+
+        async def own_call():
+            attempts.append("own")
+            return "自己的结果"
+
+        first = asyncio.ensure_future(flight.do("j", leader_fails, retry_on=LeaderOnlyError))
+        await asyncio.sleep(0)
+        second = await flight.do("j", own_call, retry_on=LeaderOnlyError)
+        with pytest.raises(LeaderOnlyError):
+            await first
+        return second
+
+    assert asyncio.run(run()) == ("自己的结果", False)
+    assert attempts == ["slow", "leader", "own"]
+
+def test_callers_on_different_threads_and_loops():
+    """测试不同线程中各自事件循环里的调用方合并到同一次调用"""
+    flight = SingleFlight()
+    calls = []
+    results = []
+    started = threading.Barrier(4)
+
+    async def call():
+        calls.append(threading.current_thread().name)
+        await asyncio.sleep(0.05)
+        return "结果"
+
+    def worker():
+        started.wait()
+        results.append(asyncio.run(flight.do("k", call)))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(joined for _, joined in results) == [False, True, True, True]
+    assert all(result == "结果" for result, _ in results)
+
+def test_concurrent_identical_invoke_llm_calls_once(fake_llm):
+    """测试同时进行的相同LLM调用只请求一次API，日志中标记为合并"""
+    fake_llm.delay = 0.02
+
+    async def run():
+        return await asyncio.gather(*(ainvoke_llm("相同的裁判提示", "裁判", call_type="referee") for _ in range(5)))
+
+    results = asyncio.run(run_in_engine(run()))
+    assert results == ["医生，我头有点疼。"] * 5
+    assert len(fake_llm.calls) == 1
+    assert game_engine.llm_singleflight.in_flight() == 0
+    assert sum("API返回(合并)" in log for log in list(game_engine.recent_api_calls)[-5:]) == 4
+
+    # 调用结束后，之后的相同调用使用缓存
+    invoke_llm("相同的裁判提示", "裁判")
+    assert len(fake_llm.calls) == 1
+
+def test_failed_call_is_not_treated_as_duplicate(fake_llm, monkeypatch):
+    """测试失败的调用不留下记录，重试时重新调用API，而不是被当作没有结果的重复调用"""
+    fail = {"remaining": 1}
+    create = fake_llm.create
+
+    async def flaky_create(model=None, messages=None, **kwargs):
+        await asyncio.sleep(0.02)
+        if fail["remaining"]:
+            fail["remaining"] -= 1
+            raise RuntimeError("请求中途失败")
+        return await create(model=model, messages=messages, **kwargs)
+
+    monkeypatch.setattr(game_engine.async_client.chat.completions, "create", flaky_create)
+
+    async def run():
+        return await asyncio.gather(*(ainvoke_llm("会失败的提示", "裁判") for _ in range(3)), return_exceptions=True)
+
+    errors = asyncio.run(run_in_engine(run()))
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+    assert invoke_llm("会失败的提示", "裁判") == "医生，我头有点疼。"
+    assert len(fake_llm.calls) == 1
+
+def test_games_with_different_budgets(fake_llm, monkeypatch):
+    """测试合并的调用方各自使用自己游戏回合的预算：预算短的游戏得到兜底回复，预算长的游戏得到结果"""
+    fake_llm.delay = 0.2
+    deadlines = game_engine.llm_transport.deadlines
+
+    async def turn(game_id, budget, fallback):
+        monkeypatch.setattr(deadlines, "budget_seconds", budget)
+        with deadlines.scope(game_id):
+            return await ainvoke_llm("预算不同的裁判提示", "裁判", game_id=game_id, fallback=fallback,
+                                     call_type="referee")
+
+    async def run(first, second):
+        game_engine.llm_response_cache.clear()
+        return await asyncio.gather(turn(*first), turn(*second))
+
+    # 预算短的游戏先发出调用：它的预算用完后，预算长的游戏自己重新调用，而不是收到兜底回复
+    results = asyncio.run(run_in_engine(run(("game-a", 0.05, "兜底A"), ("game-b", 5, "兜底B"))))
+    assert results == ["兜底A", "医生，我头有点疼。"]
+    assert len(fake_llm.calls) == 2
+
+    # 没有回合预算的调用方先发出调用：预算短的游戏只等待自己的预算
+    results = asyncio.run(run_in_engine(run((None, 0, None), ("game-a", 0.05, "兜底A"))))
+    assert results == ["医生，我头有点疼。", "兜底A"]
+    assert len(fake_llm.calls) == 3
+    assert game_engine.llm_singleflight.in_flight() == 0
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试推测执行：系统判断诊断与病人回复并行
+"""
+
+import json
+import pytest
+from unittest.mock import patch
+from config import GAME_CONFIG
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+@pytest.fixture
+def speculative_game(started_game):
+    """开启推测执行并创建游戏（关闭本地的诊断匹配，每条医生消息都由LLM裁判判断）"""
+    with patch.dict(GAME_CONFIG, {"speculative_patient_reply": True}), \
+            patch.dict(GAME_CONFIG["diagnosis_matcher"], {"enabled": False}):
+        yield started_game
+
+def test_referee_and_patient_run_concurrently(fake_llm, speculative_game, client):
+    """测试诊断判断和病人回复并行执行，一轮只需一次LLM往返时间"""
+    fake_llm.delay = 0.3
+
+    response = client.post('/api/send_message',
+                           json={'game_id': speculative_game, 'message': '您哪里不舒服？'})
+    data = json.loads(response.data)
+
+    assert data["messages"][-1] == {"sender": "patient", "content": "医生，我头有点疼。"}
+    assert data["current_sender"] == "doctor"
+    assert len(fake_llm.calls) == 2
+    # 串行执行时后一次调用在前一次返回之后才开始，两次调用的时间段不会重叠
+    (first_start, first_end), (second_start, second_end) = fake_llm.intervals
+    assert max(first_start, second_start) < min(first_end, second_end)
+
+def test_correct_diagnosis_discards_patient_reply(fake_llm, speculative_game, client):
+    """测试诊断正确时丢弃推测生成的病人回复"""
+    def reply(system_message, prompt):
+        if "诊断正确" in prompt:
+            return "诊断正确: 是"
+        return "医生，我头有点疼。"
+
+    fake_llm.reply = reply
+
+    response = client.post('/api/send_message',
+                           json={'game_id': speculative_game, 'message': '你得了流感'})
+    data = json.loads(response.data)
+
+    assert data["game_over"] is True
+    assert [msg["sender"] for msg in data["messages"]][-2:] == ["doctor", "system"]
+    assert "恭喜" in data["messages"][-1]["content"]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试按疾病缓存的初始症状
+"""
+
+import pytest
+from unittest.mock import patch
+import game_engine
+from game_engine import get_initial_symptoms
+from symptom_cache import SymptomCache
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def test_cache_fills_variants_before_hitting():
+    """测试变体数量不足时未命中，满后随机取用"""
+    cache = SymptomCache(variants_per_disease=2)
+    assert cache.get("流感") is None
+    cache.add("流感", "- 发烧")
+    assert cache.get("流感") is None
+    cache.add("流感", "- 咳嗽")
+    cache.add("流感", "- 头痛")  # 变体已满，忽略
+
+    assert {cache.get("流感") for _ in range(50)} == {"- 发烧", "- 咳嗽"}
+    assert cache.stats()["variants"] == 2
+
+def test_expired_variants_are_evicted():
+    """测试过期的变体被淘汰"""
+    cache = SymptomCache(variants_per_disease=1, ttl_seconds=-1)
+    cache.add("流感", "- 发烧")
+    assert cache.get("流感") is None
+    assert cache.stats()["evictions"] == 1
+
+def test_least_recently_used_disease_is_evicted():
+    """测试疾病数量超过上限时淘汰最久未使用的疾病"""
+    cache = SymptomCache(variants_per_disease=1, max_diseases=2)
+    cache.add("流感", "- 发烧")
+    cache.add("肺炎", "- 咳嗽")
+    cache.get("流感")
+    cache.add("胃溃疡", "- 胃痛")
+
+    assert cache.get("肺炎") is None
+    assert cache.get("流感") == "- 发烧"
+    assert cache.stats()["evictions"] == 1
+
+def test_cache_persists_to_disk(tmp_path):
+    """测试缓存写入磁盘后重启可以继续使用"""
+    path = str(tmp_path / "symptom_cache.json")
+    cache = SymptomCache(variants_per_disease=1, persist_path=path)
+    cache.add("流感", "- 发烧")
+
+    restarted = SymptomCache(variants_per_disease=1, persist_path=path)
+    assert restarted.get("流感") == "- 发烧"
+
+def test_initial_symptoms_reused_across_games(fake_llm):
+    """测试不同游戏的同一疾病复用缓存的症状变体"""
+    count = {"n": 0}
+
+    def reply(system_message, prompt):
+        count["n"] += 1
+        return f"- 症状变体{count['n']}"
+
+    fake_llm.reply = reply
+    cache = SymptomCache(variants_per_disease=2)
+    with patch.object(game_engine, "initial_symptoms_cache", cache):
+        results = [get_initial_symptoms("流感", f"game-{i}") for i in range(10)]
+
+    assert len(fake_llm.calls) == 2
+    assert set(results) == {"- 症状变体1", "- 症状变体2"}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试对话记录文件的增量写入
+"""
+
+import glob
+import json
+import pytest
+from unittest.mock import patch
+import api
+from transcript import TranscriptWriter, read_transcript
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+MESSAGES = [
+    {"sender": "system", "content": "游戏开始，请为来到诊室的病人诊断病情"},
+    {"sender": "patient", "content": "医生您好，我头疼。"},
+    {"sender": "doctor", "content": "疼了多久？"},
+    {"sender": "patient", "content": "[询问身体：疼了多久]"},
+    {"sender": "body", "content": "三天"},
+    {"sender": "patient", "content": "大概三天了。"},
+]
+
+def test_append_matches_full_render(tmp_path):
+    """测试逐轮追加得到的对话内容与一次性写入的完整记录相同"""
+    writer = TranscriptWriter(str(tmp_path))
+    incremental = str(tmp_path / "incremental.txt")
+    full = str(tmp_path / "full.txt")
+
+    cursor = None
+    for end in (2, 3, 6):
+        cursor = writer.append(incremental, MESSAGES[:end], cursor)
+    assert cursor == 6
+
+    writer.render(full, MESSAGES, [])
+    full_text = open(full, encoding="utf-8").read()
+    incremental_text = open(incremental, encoding="utf-8").read()
+    assert full_text.startswith(incremental_text)
+    assert "询问身体" not in incremental_text
+    assert "三天\n" not in incremental_text
+
+def test_append_only_renders_new_messages(tmp_path):
+    """测试每次保存只处理新增的消息"""
+    writer = TranscriptWriter(str(tmp_path))
+    filename = str(tmp_path / "t.txt")
+    cursor = writer.append(filename, MESSAGES[:3])
+
+    with patch.object(writer, "_render_messages", wraps=writer._render_messages) as render:
+        writer.append(filename, MESSAGES, cursor)
+    assert render.call_args[0][0] == MESSAGES[3:]
+
+def test_read_transcript_round_trip(tmp_path):
+    """测试读回记录文件中的消息和诊断（完整记录读游戏日志，追加写入的记录读结束时的系统消息）"""
+    writer = TranscriptWriter(str(tmp_path))
+    messages = MESSAGES + [
+        {"sender": "doctor", "content": "你得了偏头痛\n注意休息"},
+        {"sender": "system", "content": "恭喜！你正确诊断出了病人的疾病：偏头痛。"},
+    ]
+    full = str(tmp_path / "full.txt")
+    writer.render(full, messages, ["游戏开始，诊断为: 偏头痛"])
+    read, diagnosis = read_transcript(full)
+    assert diagnosis == "偏头痛"
+    assert [(m["sender"], m["content"]) for m in read] == [
+        ("patient", "医生您好，我头疼。"), ("doctor", "疼了多久？"), ("patient", ""),
+        ("patient", "大概三天了。"), ("doctor", "你得了偏头痛\n注意休息"), ("system", messages[-1]["content"]),
+    ]
+
+    incremental = str(tmp_path / "incremental.txt")
+    writer.append(incremental, messages)
+    assert read_transcript(incremental) == (read, "偏头痛")
+    writer.append(incremental, MESSAGES)
+    assert read_transcript(incremental)[1] is None
+
+def test_game_saves_without_scanning_directory(fake_llm, client, tmp_path, monkeypatch):
+    """测试游戏过程中自动保存不再扫描conversations目录，保存对话时写入完整记录"""
+    monkeypatch.chdir(tmp_path)
+    original_glob = glob.glob
+
+    def guarded_glob(pattern, *args, **kwargs):
+        assert not pattern.startswith("conversations"), "不应扫描conversations目录"
+        return original_glob(pattern, *args, **kwargs)
+
+    with patch.object(glob, "glob", guarded_glob):
+        game_id = json.loads(client.post('/api/new_game').data)["game_id"]
+        client.post('/api/send_message', json={"game_id": game_id, "message": "您哪里不舒服？"})
+
+        filename = api.game_store.get_meta(game_id, "conversation_file")
+        text = open(filename, encoding="utf-8").read()
+        assert "👨‍⚕️ 医生：您哪里不舒服？" in text
+        assert "## 游戏日志" not in text
+
+        data = json.loads(client.post(f'/api/save_conversation/{game_id}').data)
+    assert data["filename"] == filename
+    assert "## 游戏日志" in data["conversation_text"]
+    assert "游戏开始，诊断为" in data["conversation_text"]
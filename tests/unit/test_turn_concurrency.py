@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试同一个游戏的并发请求和幂等键
+"""
+
+import json
+import asyncio
+import threading
+import pytest
+from api import app, active_games, game_store, handle_send_message
+from game_turns import TurnCoordinator
+from config import GAME_CONFIG
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+@pytest.fixture
+def game(started_game, monkeypatch):
+    """创建一个轮到医生的游戏（关闭本地的诊断匹配，每个回合都调用一次LLM裁判）"""
+    monkeypatch.setitem(GAME_CONFIG["diagnosis_matcher"], "enabled", False)
+    return started_game
+
+def diagnosis_checks(fake_llm):
+    """LLM调用中的诊断判断"""
+    return [prompt for _, prompt in fake_llm.calls if "诊断正确" in prompt]
+
+def post_in_parallel(requests):
+    """每个请求使用独立的测试客户端并同时发出，返回 [(状态码, 响应数据)]"""
+    results = [None] * len(requests)
+    barrier = threading.Barrier(len(requests))
+
+    def worker(index, payload, headers):
+        with app.test_client() as client:
+            barrier.wait()
+            response = client.post('/api/send_message', json=payload, headers=headers)
+            results[index] = (response.status_code, json.loads(response.data))
+
+    threads = [threading.Thread(target=worker, args=(i, payload, headers))
+               for i, (payload, headers) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def test_parallel_messages_are_serialized(fake_llm, game):
+    """测试并发发送到同一个游戏的消息依次处理，每条消息都完整地处理一次"""
+    fake_llm.delay = 0.02
+    count = 8
+    results = post_in_parallel([
+        ({"game_id": game, "message": f"问题{i}"}, {}) for i in range(count)
+    ])
+
+    assert all(status == 200 for status, _ in results)
+    state = active_games[game]
+    doctor_messages = [msg["content"] for msg in state["messages"] if msg["sender"] == "doctor"]
+    assert sorted(doctor_messages) == sorted(f"问题{i}" for i in range(count))
+    assert state["turn_count"] == count
+    # 每轮一次诊断判断（格式检查的结果会被缓存，不计入）
+    assert len(diagnosis_checks(fake_llm)) == count
+
+def test_idempotency_key_runs_pipeline_once(fake_llm, game):
+    """测试带相同幂等键的重复请求只处理一次，并返回相同的结果"""
+    fake_llm.delay = 0.05
+    payload = {"game_id": game, "message": "您哪里不舒服？"}
+    results = post_in_parallel([(payload, {"Idempotency-Key": "retry-1"})] * 5)
+
+    assert all(status == 200 for status, _ in results)
+    assert all(data == results[0][1] for _, data in results)
+    assert active_games[game]["turn_count"] == 1
+    assert len(diagnosis_checks(fake_llm)) == 1
+
+    # 完成后的重试也直接返回结果
+    with app.test_client() as client:
+        response = client.post('/api/send_message', json=dict(payload, idempotency_key="retry-1"))
+    assert json.loads(response.data) == results[0][1]
+    assert len(diagnosis_checks(fake_llm)) == 1
+
+def test_async_handlers_share_the_game_queue(fake_llm, game):
+    """测试异步接口的并发请求同样依次处理"""
+    fake_llm.delay = 0.02
+
+    async def send_all():
+        return await asyncio.gather(*[handle_send_message(game, f"问题{i}") for i in range(4)])
+
+    results = asyncio.run(send_all())
+    assert all(status == 200 for _, status in results)
+    assert active_games[game]["turn_count"] == 4
+
+def test_failed_turn_is_not_cached():
+    """测试出错的回合不保留结果，重试时重新执行"""
+    coordinator = TurnCoordinator()
+    attempts = []
+
+    def fail():
+        attempts.append(1)
+        raise RuntimeError("LLM调用失败")
+
+    with pytest.raises(RuntimeError):
+        coordinator.run("g", "k", fail)
+    assert coordinator.run("g", "k", lambda: ({"ok": True}, 200)) == ({"ok": True}, 200)
+    assert coordinator.run("g", "k", fail) == ({"ok": True}, 200)
+    assert len(attempts) == 1
+
+def test_turn_limit_does_not_modify_loaded_state(game, client, monkeypatch):
+    """测试达到轮数上限时保存新状态，不修改其他请求已经读取到的状态"""
+    monkeypatch.setitem(GAME_CONFIG, "max_conversation_turns", 0)
+    loaded, _ = game_store.load(game)
+    messages = list(loaded["messages"])
+
+    data = json.loads(client.post('/api/send_message', json={'game_id': game, 'message': '您哪里不舒服？'}).data)
+    assert data["game_over"] is True
+    assert active_games[game]["game_over"] is True
+    assert active_games[game]["messages"][-1]["sender"] == "system"
+    assert loaded["game_over"] is False
+    assert loaded["messages"] == messages
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+测试返回给前端的消息视图和增量响应
+"""
+
+import json
+import pytest
+import sanitizer
+from message_log import MessageLog
+from sanitizer import visible_messages
+from visible_view import VisibleMessageView, VisibleMessageCache
+from api import visible_views
+
+# 使用pytest标记
+pytestmark = pytest.mark.unit
+
+def make_log():
+    return MessageLog([
+        {"sender": "system", "content": "游戏开始"},
+        {"sender": "patient", "content": "医生您好"},
+        {"sender": "doctor", "content": "哪里不舒服？"},
+        {"sender": "patient", "content": "[询问身体:头疼吗]"},
+        {"sender": "body", "content": "头疼"},
+        {"sender": "patient", "content": "我头疼"},
+    ])
+
+def test_view_matches_visible_messages():
+    """测试视图与每次重新过滤的结果相同，包括替换和去掉消息之后"""
+    view = VisibleMessageView()
+    log = make_log()
+    assert view.messages(log) == visible_messages(log)
+    assert view.messages(log, since=3) == visible_messages(log)[3:]
+
+    longer = log + [{"sender": "doctor", "content": "多久了？"}, {"sender": "patient", "content": ""}]
+    assert view.messages(longer) == visible_messages(longer)
+
+    replaced = longer.replace(3, {"sender": "patient", "content": "我发烧"})
+    assert view.messages(replaced) == visible_messages(replaced)
+    assert view.messages(log[:2]) == visible_messages(log[:2])
+
+def test_only_new_messages_are_processed(monkeypatch):
+    """测试已处理的消息不会重新过滤"""
+    view = VisibleMessageView()
+    log = make_log()
+    view.messages(log)
+
+    processed = []
+    original = sanitizer.visible_message
+    def counting(msg, drop_empty=True):
+        processed.append(msg["content"])
+        return original(msg, drop_empty)
+    monkeypatch.setattr("visible_view.visible_message", counting)
+
+    view.messages(log)
+    view.messages(log + [{"sender": "doctor", "content": "多久了？"}])
+    assert processed == ["多久了？"]
+
+def test_plain_lists_are_not_cached():
+    """测试普通列表中的消息可能被原地修改，不使用缓存"""
+    view = VisibleMessageView()
+    messages = [dict(msg) for msg in make_log()]
+    view.messages(messages)
+    messages[1]["content"] = "修改后的问候"
+    assert view.messages(messages)[1]["content"] == "修改后的问候"
+
+def test_cache_release():
+    """测试按游戏缓存和释放"""
+    cache = VisibleMessageCache(max_games=1)
+    cache.messages("a", make_log())
+    cache.messages("b", make_log())
+    assert list(cache._views) == ["b"]
+    cache.release("b")
+    assert not cache._views
+
+def test_send_message_delta(fake_llm, started_game, client):
+    """测试发送消息时传入since只返回新消息"""
+    response = client.post('/api/send_message',
+                           json={'game_id': started_game, 'message': '您哪里不舒服？', 'since': 2})
+    data = json.loads(response.data)
+    assert response.status_code == 200
+    assert data["message_offset"] == 2
+    assert data["message_count"] == 4
+    assert data["messages"] == [
+        {"sender": "doctor", "content": "您哪里不舒服？"},
+        {"sender": "patient", "content": "医生，我头有点疼。"}
+    ]
+
+    # 客户端的消息数量与服务器不一致时从头返回全部消息
+    response = client.get(f'/api/game_status/{started_game}?since=10')
+    data = json.loads(response.data)
+    assert data["message_offset"] == 0
+    assert len(data["messages"]) == data["message_count"] == 4
+
+    # 不传since时返回全部消息
+    data = json.loads(client.get(f'/api/game_status/{started_game}').data)
+    assert len(data["messages"]) == 4
+    assert "message_offset" not in data
+    visible_views.release(started_game)
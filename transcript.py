@@ -0,0 +1,141 @@
+"""
+对话记录文件
+游戏进行中每轮只把新增的消息追加到记录文件末尾；
+游戏结束或玩家保存对话时才写入包含游戏日志的完整记录；read_transcript把记录文件读回消息列表，用于重新检查保存的对话
+"""
+
+import os
+import re
+from datetime import datetime
+
+from sanitizer import strip_inquiry
+
+# 记录中显示的发送者名称
+_SENDER_NAMES = {"patient": "👤 病人", "doctor": "👨‍⚕️ 医生", "system": "🎮 系统"}
+
+# 游戏日志中记录诊断的行和游戏结束时的系统消息
+_DIAGNOSIS_LOG = re.compile(r"游戏开始，诊断为: (.+)")
+_DIAGNOSIS_CONGRATS = re.compile(r"恭喜！你正确诊断出了病人的疾病：(.+?)。")
+
+def read_transcript(filename):
+    """
+    读取对话记录文件
+
+    记录中只有医生、病人和最终的系统消息（病人消息中的询问身体内容已被清理）。
+    诊断从完整记录的游戏日志中读取，游戏进行中追加写入的记录没有游戏日志，只能从结束时的系统消息中读取
+
+    Args:
+        filename: 记录文件路径
+
+    Returns:
+        (消息列表, 诊断)，无法确定诊断时诊断为None
+    """
+    with open(filename, encoding="utf-8") as f:
+        text = f.read()
+    body, _, logs = text.partition("\n\n## 游戏日志\n")
+    body = body.split("## 对话内容\n", 1)[-1].split("\n最后更新时间: ", 1)[0]
+
+    prefixes = {f"{name}：": sender for sender, name in _SENDER_NAMES.items()}
+    messages = []
+    for line in body.split("\n"):
+        prefix = next((p for p in prefixes if line.startswith(p)), None)
+        if prefix:
+            messages.append({"sender": prefixes[prefix], "content": line[len(prefix):]})
+        elif messages and not line.startswith("-" * 70):
+            # 消息内容中的换行
+            messages[-1]["content"] += "\n" + line
+    for msg in messages:
+        # 每条消息后面有一个空行
+        msg["content"] = msg["content"].rstrip("\n")
+
+    found = _DIAGNOSIS_LOG.search(logs)
+    if not found:
+        found = next((m for m in (_DIAGNOSIS_CONGRATS.search(msg["content"]) for msg in messages
+                                  if msg["sender"] == "system") if m), None)
+    return messages, found.group(1).strip() if found else None
+
+class TranscriptWriter:
+    """按游戏写入对话记录文件"""
+
+    def __init__(self, directory="conversations"):
+        """
+        Args:
+            directory: 对话记录文件所在的目录
+        """
+        self.directory = directory
+
+    def new_filename(self, game_id):
+        """为游戏生成新的记录文件名（使用时间戳+game_id确保按时间排序且不会重名）"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.directory, f"conversation_{timestamp}_{game_id}.txt")
+
+    def append(self, filename, messages, cursor=None):
+        """
+        把cursor之后的新消息追加到记录文件
+
+        Args:
+            filename: 记录文件路径
+            messages: 游戏的全部消息
+            cursor: 上次已写入的消息数量，为空时重新写入标题和全部消息
+
+        Returns:
+            新的cursor（已写入的消息数量）
+        """
+        if cursor is None or cursor > len(messages):
+            os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+            with open(filename, "w", encoding="utf-8") as f:
+                f.write(self._render_header())
+                f.write(self._render_messages(messages))
+        elif cursor < len(messages):
+            with open(filename, "a", encoding="utf-8") as f:
+                f.write(self._render_messages(messages[cursor:]))
+        return len(messages)
+
+    def render(self, filename, messages, logs):
+        """
+        写入完整的对话记录（对话内容、游戏日志和更新时间）
+
+        Args:
+            filename: 记录文件路径
+            messages: 游戏的全部消息
+            logs: 游戏日志
+        """
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(self._render_header())
+            f.write(self._render_messages(messages))
+
+            # 写入游戏日志
+            if logs:
+                f.write("\n\n## 游戏日志\n")
+                f.write("-"*70 + "\n\n")
+                for log in logs:
+                    f.write(log + "\n\n")
+
+            # 写入时间戳
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            f.write(f"\n最后更新时间: {timestamp}\n")
+
+    def _render_header(self):
+        """记录文件的标题"""
+        return (
+            "="*70 + "\n"
+            + " "*20 + "AI问诊小游戏记录\n"
+            + "="*70 + "\n\n"
+            + "## 对话内容\n"
+            + "-"*70 + "\n\n"
+        )
+
+    def _render_messages(self, messages):
+        """只显示医生、病人和最终的系统消息，并清理病人消息中的询问身体内容"""
+        lines = []
+        for msg in messages:
+            sender = msg["sender"]
+            if sender == "patient":
+                content = strip_inquiry(msg["content"])
+            elif sender == "doctor" or (sender == "system" and "恭喜" in msg["content"]):
+                content = msg["content"]
+            else:
+                continue
+            lines.append(f"{_SENDER_NAMES[sender]}：{content}\n\n")
+        return "".join(lines)
@@ -0,0 +1,87 @@
+"""
+返回给前端的消息视图
+每个游戏缓存一份已经去掉身体消息、清理过询问身体标记的消息列表，新消息追加时只处理新增的部分，
+响应时不再每次重新过滤整个历史；客户端可以只取自己还没有的消息（增量响应）
+"""
+
+import threading
+from collections import OrderedDict
+from operator import is_
+
+from message_log import MessageLog
+from sanitizer import visible_message, visible_messages
+
+class VisibleMessageView:
+    """
+    一个游戏返回给前端的消息
+
+    MessageLog中的消息不可修改，已处理的前缀按消息对象的身份判断是否仍然有效；
+    普通列表中的消息可能被原地修改，不缓存
+    """
+
+    def __init__(self):
+        self._source = []  # 已处理的原始消息
+        self._counts = []  # 处理完每条原始消息后可见消息的数量
+        self._visible = []  # 可见消息
+
+    def messages(self, messages, since=0):
+        """
+        返回第since条之后的可见消息
+
+        Args:
+            messages: 游戏的原始消息列表
+            since: 客户端已有的可见消息数量
+
+        Returns:
+            可见消息列表
+        """
+        if not isinstance(messages, MessageLog):
+            return visible_messages(messages)[since:]
+
+        source = self._source
+        if len(messages) < len(source) or not all(map(is_, messages, source)):
+            valid = next((i for i, (a, b) in enumerate(zip(messages, source)) if a is not b),
+                         min(len(messages), len(source)))
+            self._truncate(valid)
+
+        for index in range(len(self._source), len(messages)):
+            msg = messages[index]
+            self._source.append(msg)
+            visible = visible_message(msg)
+            if visible is not None:
+                self._visible.append(visible)
+            self._counts.append(len(self._visible))
+        return self._visible[since:]
+
+    def _truncate(self, count):
+        """只保留前count条原始消息的处理结果"""
+        del self._source[count:]
+        del self._counts[count:]
+        del self._visible[self._counts[-1] if count else 0:]
+
+class VisibleMessageCache:
+    """按游戏ID保存VisibleMessageView，超过max_games时淘汰最久未使用的游戏"""
+
+    def __init__(self, max_games=1000):
+        self.max_games = max(1, max_games)
+        self._views = OrderedDict()
+        # 请求线程和引擎事件循环都会读取视图
+        self._lock = threading.Lock()
+
+    def messages(self, game_id, messages, since=0):
+        """返回游戏第since条之后的可见消息，参数与VisibleMessageView.messages相同"""
+        with self._lock:
+            view = self._views.get(game_id)
+            if view is None:
+                view = VisibleMessageView()
+                self._views[game_id] = view
+                while len(self._views) > self.max_games:
+                    self._views.popitem(last=False)
+            else:
+                self._views.move_to_end(game_id)
+            return view.messages(messages, since)
+
+    def release(self, game_id):
+        """游戏被淘汰后删除缓存"""
+        with self._lock:
+            self._views.pop(game_id, None)